@@ -0,0 +1,321 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from typing import Optional, Dict, Any
+
+import metrics
+import order_store
+import scheduler
+
+# Per-client token bucket: sustained try-ons per minute (0 disables) and burst size. Buckets live
+# in the order database, so the limit holds across all server processes
+TRYON_RATE_PER_MINUTE = float(os.getenv("TRYON_RATE_PER_MINUTE", "6"))
+TRYON_BURST = float(os.getenv("TRYON_BURST", "3"))
+# Server processes sharing the limits below: the uvicorn worker count (Procfile and
+# asgi_server.py launch --workers from this same variable), 1 for `python api_server.py`
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Try-ons allowed to hold an upstream slot at once, and to wait for one (beyond this they are
+# shed immediately), across the whole server; each process enforces its share
+TRYON_MAX_INFLIGHT = int(os.getenv("TRYON_MAX_INFLIGHT", "4"))
+TRYON_MAX_QUEUE = int(os.getenv("TRYON_MAX_QUEUE", "16"))
+# Proxies in front of the server that append to X-Forwarded-For; the entry the outermost one
+# added is the client. Earlier entries are whatever the client sent. 0 ignores the header.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+# Longest a queued request waits for a slot before giving up with 503
+TRYON_QUEUE_TIMEOUT = float(os.getenv("TRYON_QUEUE_TIMEOUT", "120"))
+# Requests predicted to finish later than this (queue wait + expected Space time) are shed up front (0 disables)
+TRYON_MAX_ETA = float(os.getenv("TRYON_MAX_ETA", "300"))
+
+REJECTED_METRIC = "verse_admission_rejected_total"
+# Buckets are pruned once there are this many
+MAX_TRACKED_CLIENTS = 10000
+# Initial guess for how long a slot is held, refined by an EWMA of observed calls
+DEFAULT_SERVICE_SECONDS = 20.0
+EWMA_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """Request not admitted; carries the HTTP status and a Retry-After estimate in seconds."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+    def body(self) -> Dict[str, Any]:
+        messages = {
+            "rate_limited": "Too many try-on requests. Please wait a moment before trying again.",
+            "queue_full": "The try-on service is at capacity. Please try again shortly.",
+            "queue_timeout": "The try-on service is busy. Please try again shortly.",
+            "preempted": "Higher-priority requests took your place in the queue. Please try again shortly.",
+            "eta_exceeded": "The try-on service is too busy to finish your request in time. Please try again shortly.",
+        }
+        return {"error": messages.get(self.reason, self.reason), "reason": self.reason,
+                "retry_after": self.retry_after}
+
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    client TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (client, name)
+);
+""")
+
+
+def client_key(headers, remote_addr: Optional[str], trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """
+    Identify the caller: the X-Forwarded-For entry our trusted proxy appended, else the socket
+    address. Entries to the left of it come from the client and can't be trusted.
+    """
+    forwarded = [hop.strip() for hop in headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    if trusted_hops > 0 and len(forwarded) >= trusted_hops:
+        return forwarded[-trusted_hops]
+    return remote_addr or "unknown"
+
+
+def per_process(limit: int, processes: int = WEB_CONCURRENCY) -> int:
+    """One process's share of a server-wide limit (at least 1)."""
+    return max(1, limit // processes)
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted", "rejected", "queued", "klass", "fair_tag")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+        self.rejected = False
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController:
+    """
+    Admission for expensive upstream work: per-client token buckets (429) shared by all server
+    processes, a limit on in-flight calls with a bounded wait queue, and shedding (503) when the
+    queue is full or a request would finish too late to be worth queueing (see eta.py).
+    The in-flight and queue limits are this process's share of the server-wide ones.
+    Waiters are dispatched by weighted fair queuing over clients and priority classes
+    (scheduler.FairQueue). Usable from threads (Flask) and from asyncio handlers.
+    """
+
+    def __init__(self, rate_per_minute: float = TRYON_RATE_PER_MINUTE, burst: float = TRYON_BURST,
+                 max_inflight: int = per_process(TRYON_MAX_INFLIGHT),
+                 max_queue: int = per_process(TRYON_MAX_QUEUE),
+                 queue_timeout: float = TRYON_QUEUE_TIMEOUT, max_eta: float = TRYON_MAX_ETA,
+                 name: str = "tryon"):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_eta = max_eta
+        self.name = name
+        self.inflight = 0
+        self.service_seconds = DEFAULT_SERVICE_SECONDS
+        self._waiters = scheduler.FairQueue()
+        self._lock = threading.Lock()
+        metrics.register_gauge(f"verse_{name}_inflight", lambda: {(): self.inflight},
+                               "Requests holding an upstream slot")
+        metrics.register_gauge(f"verse_{name}_queued",
+                               lambda: {(("class", k),): v for k, v in self._waiters.by_class.items()},
+                               "Requests waiting for an upstream slot, by priority class")
+
+    def check_rate(self, client: str, cost: float = 1.0) -> None:
+        """Take `cost` tokens (one per upstream call) from the client's bucket or raise Rejected(429)."""
+        if self.rate <= 0:
+            return
+        wait = self._take_tokens(client, cost)
+        if wait is not None:
+            self._reject("rate_limited")
+            raise Rejected(429, "rate_limited", wait)
+
+    async def check_rate_async(self, client: str, cost: float = 1.0) -> None:
+        """check_rate() for asyncio handlers: the bucket update runs off the event loop."""
+        if self.rate <= 0:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.check_rate, client, cost)
+
+    def _take_tokens(self, client: str, cost: float) -> Optional[float]:
+        """Debit the client's bucket; returns None if admitted, else seconds until it would be."""
+        conn = order_store.get_connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE client = ? AND name = ?",
+                               (client, self.name)).fetchone()
+            tokens = self.burst if row is None else min(
+                self.burst, row["tokens"] + max(0.0, now - row["updated_at"]) * self.rate)
+            # A request costing more than the burst still goes through once the bucket is full
+            needed = min(cost, self.burst)
+            wait = (needed - tokens) / self.rate if tokens < needed else None
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (client, name, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                         (client, self.name, tokens if wait is not None else tokens - cost, now))
+            if row is None and self._tracked_clients(conn) > MAX_TRACKED_CLIENTS:
+                # Buckets that have refilled completely carry no state worth keeping
+                conn.execute("DELETE FROM rate_buckets WHERE name = ? AND updated_at < ?",
+                             (self.name, now - self.burst / self.rate))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _tracked_clients(self, conn=None) -> int:
+        conn = conn or order_store.get_connection()
+        return conn.execute("SELECT COUNT(*) FROM rate_buckets WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def retry_after(self, queued: Optional[int] = None) -> float:
+        """Estimated seconds until a newly queued request would get a slot."""
+        if queued is None:
+            queued = len(self._waiters)
+        return self.service_seconds * (queued + 1) / max(1, self.max_inflight)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self, reserve: int = 1) -> bool:
+        """
+        Take a slot only if nobody is waiting and `reserve` more stay free: for optional
+        background work that must not hold up customers. Pair with release().
+        """
+        with self._lock:
+            if self._waiters or self.inflight + reserve >= self.max_inflight:
+                return False
+            self.inflight += 1
+            return True
+
+    def _reject(self, reason: str) -> None:
+        metrics.inc(REJECTED_METRIC, route=self.name, reason=reason)
+
+    def _enqueue(self, waiter_factory, client: str, klass: str,
+                 expected_seconds: Optional[float] = None) -> Optional[_Waiter]:
+        """Grab a free slot (returns None) or join the queue (returns the waiter)."""
+        with self._lock:
+            if self.inflight < self.max_inflight and not self._waiters:
+                self.inflight += 1
+                return None
+            if expected_seconds is not None and self.max_eta > 0:
+                # Only queued requests are shed: with a free slot even a slow Space gets tried
+                # (and the estimate learns when it speeds up again)
+                eta = self.retry_after() + expected_seconds
+                if eta > self.max_eta:
+                    self._reject("eta_exceeded")
+                    raise Rejected(503, "eta_exceeded", eta - self.max_eta)
+            if len(self._waiters) >= self.max_queue:
+                # A full queue sheds its lowest-priority waiter in favour of a higher class
+                lowest = self._waiters.lowest()
+                weights = self._waiters.weights
+                if lowest is None or weights.get(lowest.klass, 0.0) >= weights.get(klass, 0.0):
+                    self._reject("queue_full")
+                    raise Rejected(503, "queue_full", self.retry_after())
+                self._waiters.remove(lowest)
+                lowest.rejected = True
+                lowest.wake()
+                self._reject("preempted")
+            waiter = waiter_factory()
+            self._waiters.push(waiter, client, klass)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Leave the queue; returns True if a slot had already been handed over (caller owns it)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _granted(self, waiter: Optional[_Waiter], klass: str, start: float) -> float:
+        """Finish an acquire: raise if the waiter was preempted, else record its queue wait."""
+        if waiter is not None and waiter.rejected:
+            raise Rejected(503, "preempted", self.retry_after())
+        waited = time.monotonic() - start
+        metrics.observe(scheduler.QUEUE_WAIT_METRIC, waited, **{"class": klass})
+        return waited
+
+    def acquire(self, client: str = "", klass: str = scheduler.DEFAULT_CLASS,
+                expected_seconds: Optional[float] = None) -> float:
+        """
+        Block until a slot is free; returns the queue wait in seconds. Raises Rejected(503).
+        expected_seconds is the predicted upstream time once admitted (eta.EtaEstimator).
+        """
+        start = time.monotonic()
+        waiter = self._enqueue(_Waiter, client, klass, expected_seconds)
+        if waiter is not None and not waiter.event.wait(self.queue_timeout):
+            if not self._abandon(waiter):
+                self._reject("queue_timeout")
+                raise Rejected(503, "queue_timeout", self.retry_after())
+        return self._granted(waiter, klass, start)
+
+    async def acquire_async(self, client: str = "", klass: str = scheduler.DEFAULT_CLASS,
+                            expected_seconds: Optional[float] = None) -> float:
+        """acquire() for asyncio handlers: waits without holding a thread."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(lambda: _Waiter(loop), client, klass, expected_seconds)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    self._reject("queue_timeout")
+                    raise Rejected(503, "queue_timeout", self.retry_after())
+            except asyncio.CancelledError:
+                # Client went away while queued: hand back the slot if we were just given one
+                if self._abandon(waiter):
+                    self.release()
+                raise
+        return self._granted(waiter, klass, start)
+
+    def release(self, held_seconds: Optional[float] = None) -> None:
+        """Free a slot, handing it straight to the next waiter in fair-queue order if there is one."""
+        with self._lock:
+            if held_seconds is not None:
+                self.service_seconds += EWMA_ALPHA * (held_seconds - self.service_seconds)
+            waiter = self._waiters.pop()
+            if waiter is not None:
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.inflight -= 1
+
+    def admit(self, client: str, klass: str = scheduler.DEFAULT_CLASS,
+              expected_seconds: Optional[float] = None) -> float:
+        """Rate limit then acquire a slot (threads). Pair with release()."""
+        self.check_rate(client)
+        return self.acquire(client, klass, expected_seconds)
+
+    async def admit_async(self, client: str, klass: str = scheduler.DEFAULT_CLASS,
+                          expected_seconds: Optional[float] = None) -> float:
+        await self.check_rate_async(client)
+        return await self.acquire_async(client, klass, expected_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "queued_by_class": dict(self._waiters.by_class),
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "max_eta": self.max_eta,
+            "service_seconds_ewma": round(self.service_seconds, 2),
+            "processes": WEB_CONCURRENCY,
+            "tracked_clients": self._tracked_clients(),
+        }
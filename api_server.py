@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, Response, stream_with_context
 from flask_cors import CORS
 from gradio_client import Client, handle_file
 import os
@@ -7,15 +7,40 @@ import razorpay
 from PIL import Image, ImageFilter, ImageEnhance
 import io
 import base64
+import uuid
 import cv2
 import numpy as np
 from datetime import datetime
 import gemini_utils
 from io import BytesIO
-import hmac
-import hashlib
 from dotenv import load_dotenv
 from gemini_utils import generate_size_recommendation, generate_style_advice, generate_tracking_update, call_gemini
+from image_utils import detect_and_crop_person, locate_and_crop_person
+import image_ingest
+import image_output
+import tryon_service
+import artifact_store
+import prerender
+import quality
+import admission
+import eta
+import scheduler
+import space_jobs
+import space_pool
+from payment_gateway import PaymentGateway, PaymentGatewayError, IdempotencyKeyReused, cart_hash
+import webhooks
+import reconciliation
+import metrics
+import profiling
+import traffic_capture
+import math
+import time
+import hmac
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import wraps
+from contextlib import contextmanager, closing
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,33 +49,106 @@ load_dotenv()
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "rzp_live_RmFbFMzaZX1gjM")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "4Tpe6twOBSSZIRWPXhlZQMYk")
 
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+# Pooled, idempotent Razorpay gateway (see payment_gateway.py)
+payment_gateway = PaymentGateway(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+razorpay_client = payment_gateway.client
+
+# Apply queued Razorpay webhook events to orders in the background
+webhooks.start_worker()
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
+# Token required (X-Admin-Token header) for /api/admin/* endpoints; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+
+# Logs stage breakdown + profile of requests slower than SLOW_REQUEST_MS
+slow_requests = profiling.SlowRequestTracker()
+
+# Opt-in (TRAFFIC_CAPTURE=true) sanitized request log for bench/replay.py
+traffic = traffic_capture.TrafficCapture()
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.begin_request()
+    slow_requests.begin()
+
+@app.after_request
+def _record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        duration = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(metrics.HTTP_METRIC, duration,
+                        route=route, method=request.method, status=response.status_code)
+        trace = slow_requests.current()
+        slow_requests.stop_profile(trace)
+        if response.is_streamed:
+            # Streamed try-ons do their work in the generator: track them until the response closes
+            method, status = request.method, response.status_code
+            response.call_on_close(lambda: slow_requests.end(trace, route, method, status,
+                                                             time.perf_counter() - start))
+        else:
+            slow_requests.end(trace, route, request.method, response.status_code, duration)
+        traffic.record(request, response, route, duration)
+    return response
+
+def require_admin(fn):
+    """Restrict an endpoint to requests carrying the admin token."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            return jsonify({'error': 'Admin access required'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
 # Set maximum file upload size to 50MB
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB in bytes
 
 # Get Hugging Face token from environment
 HF_TOKEN = os.getenv("HF_TOKEN", "").strip()
 
+# Space (or any Gradio app URL, e.g. the local fake in bench/) serving the /tryon endpoint
+TRYON_SPACE = os.getenv("TRYON_SPACE", "yisol/IDM-VTON")
+
+import httpx
+
+def make_space_client(src):
+    """Gradio client for one Space, with the optional HF token and a longer timeout."""
+    if HF_TOKEN:
+        space_client = Client(src, hf_token=HF_TOKEN, download_files=artifact_store.DOWNLOAD_DIR)
+    else:
+        space_client = Client(src, download_files=artifact_store.DOWNLOAD_DIR)
+    # Configure client with longer timeout (5 minutes for slow API responses)
+    space_client.httpx_kwargs = {"timeout": httpx.Timeout(300.0, connect=60.0)}
+    return space_client
+
 # Initialize the Gradio client with optional HF token and increased timeout
 if HF_TOKEN:
     print("🔑 Using Hugging Face token for authentication")
-    client = Client("yisol/IDM-VTON", hf_token=HF_TOKEN)
 else:
     print("⚠️  No Hugging Face token found - using anonymous access (may have quota limits)")
     print("💡 To add a token, create a .env file with: HF_TOKEN=your_token_here")
-    client = Client("yisol/IDM-VTON")
+client = make_space_client(TRYON_SPACE)
 
-# Configure client with longer timeout (5 minutes for slow API responses)
-import httpx
-client.httpx_kwargs = {"timeout": httpx.Timeout(300.0, connect=60.0)}
+# Health-routed pool of Spaces with background keep-alive probes (see space_pool.py)
+spaces = space_pool.SpacePool(space_pool.configured_spaces(TRYON_SPACE), hf_token=HF_TOKEN)
+spaces.start_prober()
+# Gradio clients for the other Spaces, created on first use
+_space_clients = {TRYON_SPACE: client}
+_space_clients_lock = threading.Lock()
+
+def space_client(src):
+    with _space_clients_lock:
+        if src not in _space_clients:
+            _space_clients[src] = make_space_client(src)
+        return _space_clients[src]
 
 GARMENT_DIR = "garments"
 BACKGROUND_DIR = "backgrounds"
-OUTPUT_DIR = "outputs"
+OUTPUT_DIR = tryon_service.OUTPUT_DIR
 
 for dir_path in [GARMENT_DIR, BACKGROUND_DIR, OUTPUT_DIR]:
     os.makedirs(dir_path, exist_ok=True)
@@ -58,174 +156,127 @@ for dir_path in [GARMENT_DIR, BACKGROUND_DIR, OUTPUT_DIR]:
 for dir_path in [GARMENT_DIR, BACKGROUND_DIR, OUTPUT_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
-def detect_and_crop_person(image_path):
-    """
-    Detect person in image and crop to show only the person.
-    Uses OpenCV face detection and estimates body area.
-    Returns path to cropped image, or original if no person detected.
-    """
-    try:
-        import cv2
-        
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            print("⚠️  Could not read image, using original")
-            return image_path
-        
-        height, width = img.shape[:2]
-        
-        # Try face detection first (most reliable for person photos)
-        face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) > 0:
-            # Found face(s) - use the largest one
-            largest_face = max(faces, key=lambda f: f[2] * f[3])
-            x, y, w, h = largest_face
-            
-            print(f"✅ Detected face at ({x}, {y}) with size {w}x{h}")
-            
-            # Expand crop to include full body
-            # Assume body is ~3-4x face height, centered on face
-            body_height = h * 4
-            body_width = w * 2.5
-            
-            # Calculate crop coordinates
-            center_x = x + w // 2
-            center_y = y + h // 2
-            
-            crop_x1 = max(0, int(center_x - body_width // 2))
-            crop_y1 = max(0, int(y - h * 0.5))  # Include some space above head
-            crop_x2 = min(width, int(center_x + body_width // 2))
-            crop_y2 = min(height, int(center_y + body_height // 2))
-            
-            # Crop image
-            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
-            
-            # Save cropped image
-            base, ext = os.path.splitext(image_path)
-            output_path = f"{base}_cropped{ext}"
-            cv2.imwrite(output_path, cropped)
-            
-            print(f"✅ Cropped person image saved to: {output_path}")
-            return output_path
-        
-        # No face detected - try full body detection
-        print("⚠️  No face detected, trying full body detection...")
-        body_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_fullbody.xml'
-        )
-        
-        bodies = body_cascade.detectMultiScale(gray, 1.1, 3)
-        
-        if len(bodies) > 0:
-            # Use largest detected body
-            largest_body = max(bodies, key=lambda b: b[2] * b[3])
-            x, y, w, h = largest_body
-            
-            print(f"✅ Detected body at ({x}, {y}) with size {w}x{h}")
-            
-            # Add padding
-            padding = 20
-            crop_x1 = max(0, x - padding)
-            crop_y1 = max(0, y - padding)
-            crop_x2 = min(width, x + w + padding)
-            crop_y2 = min(height, y + h + padding)
-            
-            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
-            
-            base, ext = os.path.splitext(image_path)
-            output_path = f"{base}_cropped{ext}"
-            cv2.imwrite(output_path, cropped)
-            
-            print(f"✅ Cropped body image saved to: {output_path}")
-            return output_path
-        
-        # No person detected - return original image
-        print("⚠️  No person detected, using original image")
-        return image_path
-        
-    except Exception as e:
-        print(f"❌ Error during person detection: {e}")
-        import traceback
-        traceback.print_exc()
-        return image_path
+# Expire and quota-bound everything written to outputs/ (see artifact_store.py)
+artifact_store.store.start_sweeper()
 
-def create_video_from_image(image_path, duration=4):
-    """Create a short video with dynamic movements from a static image."""
-    try:
-        import imageio
-        
-        # Load the image
-        img = Image.open(image_path)
-        w, h = img.size
-        
-        # Create frames with multiple dynamic effects
-        fps = 30
-        total_frames = int(duration * fps)
-        frames = []
-        
-        for i in range(total_frames):
-            t = i / total_frames
-            
-            # Effect 1: Zoom (1.0 to 1.2)
-            zoom = 1.0 + (t * 0.2)
-            
-            # Effect 2: Pan (subtle left-right movement)
-            pan_x = int(20 * np.sin(t * 2 * np.pi))
-            
-            # Effect 3: Tilt (subtle up-down movement)
-            tilt_y = int(15 * np.sin(t * 3 * np.pi))
-            
-            # Effect 4: Rotation (subtle rotation, max 3 degrees)
-            rotation_angle = 3 * np.sin(t * 2 * np.pi)
-            
-            # Apply rotation first
-            rotated = img.rotate(rotation_angle, resample=Image.Resampling.BICUBIC, expand=False)
-            
-            # Calculate crop box for zoom effect with pan and tilt
-            new_w = int(w / zoom)
-            new_h = int(h / zoom)
-            left = (w - new_w) // 2 + pan_x
-            top = (h - new_h) // 2 + tilt_y
-            
-            # Ensure crop box is within bounds
-            left = max(0, min(left, w - new_w))
-            top = max(0, min(top, h - new_h))
-            
-            # Crop and resize
-            cropped = rotated.crop((left, top, left + new_w, top + new_h))
-            zoomed = cropped.resize((w, h), Image.Resampling.LANCZOS)
-            
-            # Effect 5: Brightness variation for dynamic feel
-            enhancer = ImageEnhance.Brightness(zoomed)
-            enhanced = enhancer.enhance(1.0 + (t * 0.15))
-            
-            # Effect 6: Slight contrast boost
-            contrast_enhancer = ImageEnhance.Contrast(enhanced)
-            final_frame = contrast_enhancer.enhance(1.0 + (t * 0.1))
-            
-            frames.append(np.array(final_frame))
-        
-        # Save as video
-        output_path = os.path.join(OUTPUT_DIR, f"tryon_video_{os.getpid()}.mp4")
-        imageio.mimsave(output_path, frames, fps=fps, codec='libx264', quality=8)
-        
-        return output_path
-    except Exception as e:
-        print(f"Error creating video: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+# Per-client rate limits and a global cap on in-flight Space calls (see admission.py)
+tryon_admission = admission.AdmissionController()
+
+# Try-on latency model learned from past calls, for status ETAs and admission (see eta.py)
+tryon_eta = eta.EtaEstimator()
+try:
+    print(f"⏱️  ETA model loaded {tryon_eta.load()} recorded try-ons")
+except Exception as e:
+    print(f"⚠️  Could not load try-on latency history: {e}")
+
+def expected_tryon():
+    """ETA features of a try-on about to start: the Space it would go to, inputs not yet known."""
+    return eta.features(spaces.choose().src, tryon_service.TRYON_OPTIONS["denoise_steps"])
+
+def choose_tier(requested_tier):
+    """(tier, degraded) to render at now, from the admission queue and recent Space latency (see quality.py)."""
+    return quality.choose(requested_tier, tryon_admission.queued, spaces.recent_p95())
+
+def rejected_response(rejected):
+    """Fast 429/503 for a request that was not admitted."""
+    response = jsonify(rejected.body())
+    response.status_code = rejected.status
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
 
 @app.route('/api/tryon', methods=['POST'])
 def tryon():
     """API endpoint for virtual try-on."""
+    try:
+        requested_tier = quality.requested(request.form.get('quality'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    client_id = admission.client_key(request.headers, request.remote_addr)
+    klass = scheduler.classify(request.headers, request.cookies)
+    try:
+        with metrics.span("tryon.admission"):
+            tryon_admission.admit(client_id, klass, tryon_eta.predict(expected_tryon()))
+    except admission.Rejected as rejected:
+        return rejected_response(rejected)
+    
+    start = time.perf_counter()
+    if request.form.get('stream', 'false').lower() == 'true':
+        # The stream releases the slot when it closes
+        return _stream_tryon(start, requested_tier)
+    try:
+        return _run_tryon(requested_tier)
+    finally:
+        tryon_admission.release(time.perf_counter() - start)
+
+def _stream_tryon(start, requested_tier):
+    """
+    stream=true: NDJSON status lines while the Space works, then a result (or error) line.
+    A client that disconnects (closed tab, retry) cancels the Space job within a poll interval.
+    """
+    person_file = request.files.get('person_image')
+    garment_file = request.files.get('garment_image')
+    description = request.form.get('description', 'Stylish outfit')
+    generate_video = request.form.get('generate_video', 'false').lower() == 'true'
+    image_format = image_output.negotiate(request.headers.get('Accept'), request.form.get('output_format'))
+    person_path, garment_path = tryon_service.upload_paths()
+    paths = [person_path, garment_path]
+    
+    def close():
+        tryon_service.remove_files(paths)
+        tryon_admission.release(time.perf_counter() - start)
+    
+    if not person_file or not garment_file:
+        close()
+        return jsonify({'error': 'Both person and garment images are required'}), 400
+    try:
+        with metrics.span("tryon.save_uploads"):
+            person_file.save(person_path)
+            garment_file.save(garment_path)
+        with metrics.span("tryon.ingest"):
+            image_ingest.prepare_upload(person_path)
+            image_ingest.prepare_upload(garment_path)
+    except image_ingest.ImageRejected as rejected:
+        close()
+        return jsonify({'error': str(rejected)}), rejected.status
+    
+    trace = slow_requests.current()
+    
+    def generate():
+        with slow_requests.attach(trace):
+            try:
+                yield tryon_service.stream_line({'type': 'status', 'stage': 'preparing',
+                                                 **tryon_eta.estimate(expected_tryon())})
+                last = None
+                # Closed along with this generator when the client disconnects, which cancels the Space job
+                with closing(_render(person_path, garment_path, description, requested_tier, paths,
+                                     preview=True)) as render:
+                    while True:
+                        try:
+                            update = next(render)
+                        except StopIteration as rendered:
+                            result_image_path, quality_fields = rendered.value
+                            break
+                        if update.get('type') == 'preview':
+                            yield tryon_service.stream_line(update)
+                            continue
+                        # Unchanged updates still write a byte: writing is how a disconnect is noticed
+                        yield tryon_service.stream_line({'type': 'status', **update}) if update != last else b"\n"
+                        last = update
+                yield tryon_service.stream_line({'type': 'status', 'stage': 'encoding'})
+                response_data = tryon_service.build_response(result_image_path, generate_video, image_format)
+                yield tryon_service.stream_line({'type': 'result', **response_data, **quality_fields})
+            except Exception as e:
+                print(f"❌ Error during try-on: {e}")
+                yield tryon_service.stream_line(tryon_service.stream_error(str(e)))
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Runs after the generator is closed (and its Space job cancelled), even if it never started
+    response.call_on_close(close)
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _run_tryon(requested_tier):
     try:
         # Get uploaded files
         person_file = request.files.get('person_image')
@@ -236,93 +287,46 @@ def tryon():
         if not person_file or not garment_file:
             return jsonify({'error': 'Both person and garment images are required'}), 400
         
-        # Save uploaded files temporarily
-        person_path = os.path.join(OUTPUT_DIR, f'person_{os.getpid()}.jpg')
-        garment_path = os.path.join(OUTPUT_DIR, f'garment_{os.getpid()}.jpg')
-        
-        person_file.save(person_path)
-        garment_file.save(garment_path)
+        # Save uploaded files temporarily (unique per request: concurrent requests share the process)
+        person_path, garment_path = tryon_service.upload_paths()
         
-        # AUTO-CROP PERSON FROM IMAGE
-        print("🔍 Detecting and cropping person from uploaded image...")
-        cropped_person_path = detect_and_crop_person(person_path)
+        with metrics.span("tryon.save_uploads"):
+            person_file.save(person_path)
+            garment_file.save(garment_path)
         
-        # Prepare the person image dict for Gradio API
-        person_image_dict = {
-            "background": handle_file(cropped_person_path),
-            "layers": [],
-            "composite": None
-        }
-        
-        # Call the IDM-VTON API
+        # Reject oversized or non-image uploads from their headers, then decode to working size
+        try:
+            with metrics.span("tryon.ingest"):
+                image_ingest.prepare_upload(person_path)
+                image_ingest.prepare_upload(garment_path)
+        except image_ingest.ImageRejected as rejected:
+            tryon_service.remove_files([person_path, garment_path])
+            return jsonify({'error': str(rejected)}), rejected.status
+        
+        # Crop the person and call the IDM-VTON API, unless this tier was rendered before
+        paths = [person_path, garment_path]
         try:
-            result = client.predict(
-                dict=person_image_dict,
-                garm_img=handle_file(garment_path),
-                garment_des=description,
-                is_checked=True,
-                is_checked_crop=True,  # Enable garment cropping for better fit
-                denoise_steps=40,  # Maximum allowed value for best quality
-                seed=42,
-                api_name="/tryon"
-            )
+            result_image_path, quality_fields = _rendered(_render(person_path, garment_path, description,
+                                                                  requested_tier, paths))
         except Exception as api_error:
             error_msg = str(api_error)
             print(f"❌ Hugging Face API Error: {error_msg}")
-            
-            # Check if it's a timeout error
-            if "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-                return jsonify({
-                    'error': 'The AI model is taking longer than expected to respond.',
-                    'details': 'The Hugging Face API is experiencing slow response times. This usually happens when the model is cold-starting or under heavy load.',
-                    'suggestion': 'Please try again in a few moments. The model should be faster on subsequent requests.',
-                    'tip': 'Adding a Hugging Face token may provide better reliability and priority access.'
-                }), 504
-            # Check if it's a quota/authentication error
-            elif "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                return jsonify({
-                    'error': 'API quota limit reached. Please add a Hugging Face token to your .env file.',
-                    'details': 'Get a free token at https://huggingface.co/settings/tokens',
-                    'instructions': 'Add HF_TOKEN=your_token to .env file and restart the server'
-                }), 429
-            elif "upstream" in error_msg.lower():
-                return jsonify({
-                    'error': 'The AI model is currently unavailable or overloaded. Please try again in a few moments.',
-                    'details': error_msg,
-                    'suggestion': 'Consider adding a Hugging Face token for better reliability'
-                }), 503
-            else:
+            tryon_service.remove_files(paths)
+            mapped = tryon_service.space_error_response(error_msg)
+            if mapped is None:
                 raise  # Re-raise if it's a different error
+            body, status = mapped
+            return jsonify(body), status
         
-        result_image_path = result[0]
-        
-        # Convert result image to base64
-        with open(result_image_path, 'rb') as f:
-            image_data = f.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-        
-        response_data = {
-            'image': f'data:image/png;base64,{image_base64}',
-            'status': 'success'
-        }
-        
-        # Generate video if requested
-        if generate_video:
-            video_path = create_video_from_image(result_image_path, duration=4)
-            if video_path:
-                with open(video_path, 'rb') as f:
-                    video_data = f.read()
-                    video_base64 = base64.b64encode(video_data).decode('utf-8')
-                response_data['video'] = f'data:video/mp4;base64,{video_base64}'
+        image_format = image_output.negotiate(request.headers.get('Accept'), request.form.get('output_format'))
+        response_data = tryon_service.build_response(result_image_path, generate_video, image_format)
         
         # Clean up temporary files
-        try:
-            os.remove(person_path)
-            os.remove(garment_path)
-        except:
-            pass
+        tryon_service.remove_files(paths)
         
-        return jsonify(response_data)
+        response = jsonify({**response_data, **quality_fields})
+        response.headers['Vary'] = 'Accept'
+        return response
         
     except Exception as e:
         print(f"❌ Error during try-on: {e}")
@@ -330,6 +334,240 @@ def tryon():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def _render(person_path, garment_path, description, requested_tier, paths, preview=False):
+    """
+    The try-on at the tier chosen for requested_tier, from the result cache when that tier (or a
+    better one) was rendered before. Yields Space job status updates (after a 'preview' stream
+    line with the local overlay, if preview is set and the Space is called) and returns (result
+    path, quality response fields). Temporary files it creates are added to paths.
+    """
+    tier, degraded = choose_tier(requested_tier)
+    inputs = quality.input_key(person_path, garment_path, description)
+    hit = quality.cached(inputs, tier)
+    if hit is not None:
+        served, result_image_path = hit
+        return result_image_path, quality.describe(requested_tier, served, degraded and served != quality.BEST_TIER,
+                                                   True)
+    
+    print("🔍 Detecting and cropping person from uploaded image...")
+    with metrics.span("tryon.detect_and_crop_person"):
+        crop = locate_and_crop_person(person_path)
+    cropped_person_path = crop.path
+    paths.append(cropped_person_path)
+    if preview:
+        line = tryon_service.preview_line(crop, garment_path)
+        if line is not None:
+            yield line
+    with _space_job(cropped_person_path, garment_path, description, tier) as job:
+        yield from job.updates()
+        result_image_path = quality.store(inputs, tier, job.result()[0])
+    upgrade = quality.wants_upgrade(tier) and _schedule_upgrade(inputs, cropped_person_path, garment_path,
+                                                                description)
+    return result_image_path, quality.describe(requested_tier, tier, degraded, False, upgrade, inputs)
+
+def _rendered(render):
+    """Run a _render() to completion without watching its status updates."""
+    while True:
+        try:
+            next(render)
+        except StopIteration as rendered:
+            return rendered.value
+
+# Background re-renders of lower-tier results at the best tier; each holds a spare admission slot
+_upgrades = ThreadPoolExecutor(max_workers=tryon_admission.max_inflight, thread_name_prefix="tier-upgrade")
+
+def _schedule_upgrade(inputs, cropped_person_path, garment_path, description):
+    """Re-render at the best tier if a Space slot is spare; True if the upgrade URL will fill in."""
+    if not tryon_admission.try_acquire():
+        return False
+    try:
+        if not quality.claim_upgrade(inputs):
+            tryon_admission.release()
+            return True  # already rendering for an earlier request
+        copies = quality.work_copies(cropped_person_path, garment_path)
+    except Exception as e:
+        # The try-on itself succeeded; it just won't get an upgrade
+        print(f"⚠️  Could not schedule upgrade: {e}")
+        tryon_admission.release()
+        quality.abandon_upgrade(inputs, "failed")
+        return False
+    _upgrades.submit(_run_upgrade, inputs, copies, description)
+    return True
+
+def _run_upgrade(inputs, copies, description):
+    try:
+        with metrics.span("tryon.upgrade"):
+            result_image_path = _predict(*copies, description, tier=quality.BEST_TIER)
+        quality.store(inputs, quality.BEST_TIER, result_image_path)
+        metrics.inc(quality.UPGRADE_METRIC, result="rendered")
+    except Exception as e:
+        print(f"⚠️  Background upgrade failed: {e}")
+        quality.abandon_upgrade(inputs, "failed")
+    finally:
+        tryon_admission.release()
+        tryon_service.remove_files(copies)
+
+@contextmanager
+def _space_job(cropped_person_path, garment_path, description, tier):
+    """Submit IDM-VTON's /tryon at a quality tier to the healthiest Space as a cancellable job (see space_jobs.py)."""
+    # Prepare the person image dict for Gradio API
+    person_image_dict = {
+        "background": handle_file(cropped_person_path),
+        "layers": [],
+        "composite": None
+    }
+    
+    # Covers uploading the inputs to the Space, its queue and the inference itself
+    with metrics.span("tryon.space_predict"), spaces.use() as space:
+        with space_jobs.SpaceJob.submit(
+            space_client(space.src),
+            tracker=tryon_eta.track(eta.features(space.src, quality.TIERS[tier], cropped_person_path, garment_path)),
+            dict=person_image_dict,
+            garm_img=handle_file(garment_path),
+            garment_des=description,
+            api_name="/tryon",
+            **quality.options(tier)
+        ) as job:
+            yield job
+
+def _predict(cropped_person_path, garment_path, description, cancelled=None, tier=quality.BEST_TIER):
+    """
+    Run IDM-VTON's /tryon on the Space and return the local path of the result image.
+    Setting `cancelled` (a threading.Event) cancels the Space job and raises JobCancelled.
+    """
+    if cancelled is not None and cancelled.is_set():
+        raise space_jobs.JobCancelled("Try-on cancelled")
+    with _space_job(cropped_person_path, garment_path, description, tier) as job:
+        for _ in job.updates(cancelled):
+            pass
+        return job.result()[0]
+
+@app.route('/api/tryon/batch', methods=['POST'])
+def tryon_batch():
+    """
+    Try several garments on one person photo. The person is cropped once, garments run
+    concurrently (TRYON_BATCH_CONCURRENCY at a time) and each result is streamed back as
+    an NDJSON line as soon as it finishes, followed by a final 'done' line.
+    """
+    person_file = request.files.get('person_image')
+    garment_files = request.files.getlist('garment_images')
+    if not person_file or not garment_files:
+        return jsonify({'error': 'A person image and at least one garment image are required'}), 400
+    if len(garment_files) > tryon_service.MAX_BATCH_GARMENTS:
+        return jsonify({'error': f'At most {tryon_service.MAX_BATCH_GARMENTS} garments per batch'}), 400
+    
+    descriptions = request.form.getlist('descriptions')
+    default_description = request.form.get('description', 'Stylish outfit')
+    generate_video = request.form.get('generate_video', 'false').lower() == 'true'
+    image_format = image_output.negotiate(request.headers.get('Accept'), request.form.get('output_format'))
+    try:
+        requested_tier = quality.requested(request.form.get('quality'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    client_id = admission.client_key(request.headers, request.remote_addr)
+    klass = scheduler.classify(request.headers, request.cookies)
+    try:
+        # Every garment is a Space call, so the batch pays one token per garment
+        tryon_admission.check_rate(client_id, cost=len(garment_files))
+    except admission.Rejected as rejected:
+        return rejected_response(rejected)
+    
+    person_path, garment_paths = tryon_service.batch_upload_paths(len(garment_files))
+    cropped_person_path = None
+    try:
+        with metrics.span("tryon.save_uploads"):
+            person_file.save(person_path)
+            for garment_file, garment_path in zip(garment_files, garment_paths):
+                garment_file.save(garment_path)
+        with metrics.span("tryon.ingest"):
+            for path in [person_path] + garment_paths:
+                image_ingest.prepare_upload(path)
+        # Crop once for the whole batch
+        with metrics.span("tryon.detect_and_crop_person"):
+            cropped_person_path = detect_and_crop_person(person_path)
+    except image_ingest.ImageRejected as rejected:
+        tryon_service.remove_files([person_path, cropped_person_path] + garment_paths)
+        return jsonify({'error': str(rejected)}), rejected.status
+    
+    # One tier for the whole batch; no background upgrades (a batch is already many Space calls)
+    tier, degraded = choose_tier(requested_tier)
+    
+    def run_one(index):
+        description = descriptions[index] if index < len(descriptions) else default_description
+        inputs = quality.input_key(person_path, garment_paths[index], description)
+        hit = quality.cached(inputs, tier)
+        if hit is not None:
+            served, result_image_path = hit
+            return {'type': 'result', 'index': index,
+                    **tryon_service.build_response(result_image_path, generate_video, image_format),
+                    **quality.describe(requested_tier, served, degraded and served != quality.BEST_TIER, True)}
+        try:
+            with metrics.span("tryon.admission"):
+                tryon_admission.acquire(client_id, klass, tryon_eta.predict(expected_tryon()))
+        except admission.Rejected as rejected:
+            return {'type': 'error', 'index': index, 'status': rejected.status,
+                    'retry_after': rejected.retry_after, **rejected.body()}
+        start = time.perf_counter()
+        try:
+            result_image_path = quality.store(inputs, tier, _predict(cropped_person_path, garment_paths[index],
+                                                                     description, cancelled, tier))
+            return {'type': 'result', 'index': index,
+                    **tryon_service.build_response(result_image_path, generate_video, image_format),
+                    **quality.describe(requested_tier, tier, degraded, False)}
+        except space_jobs.JobCancelled:
+            return tryon_service.batch_error(index, 'Cancelled', 499)
+        except Exception as e:
+            print(f"❌ Batch try-on {index} failed: {e}")
+            return tryon_service.batch_error(index, str(e))
+        finally:
+            tryon_admission.release(time.perf_counter() - start)
+    
+    # Set when the client goes away: running garments cancel their Space jobs
+    cancelled = threading.Event()
+    
+    trace = slow_requests.current()
+    
+    def generate():
+        with slow_requests.attach(trace):
+            start = time.perf_counter()
+            failed = 0
+            pool = ThreadPoolExecutor(max_workers=min(tryon_service.BATCH_CONCURRENCY, len(garment_paths)))
+            try:
+                # Each worker gets a copy of this request's context so its stage timings are recorded
+                futures = [pool.submit(contextvars.copy_context().run, slow_requests.traced(run_one, trace), index)
+                           for index in range(len(garment_paths))]
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=tryon_service.STREAM_KEEPALIVE_SECONDS,
+                                         return_when=FIRST_COMPLETED)
+                    if not done:
+                        yield b"\n"  # writing is how a disconnect is noticed
+                    for future in done:
+                        line = future.result()
+                        failed += line['type'] == 'error'
+                        yield tryon_service.stream_line(line)
+                yield tryon_service.stream_line({'type': 'done', 'garments': len(garment_paths), 'failed': failed,
+                                                'elapsed_ms': round((time.perf_counter() - start) * 1000)})
+            finally:
+                # Also runs if the client disconnects mid-stream: drop garments that haven't started
+                # and cancel the ones that have
+                cancelled.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+                tryon_service.remove_files([person_path, cropped_person_path] + garment_paths)
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _order_response(order, replayed):
+    """JSON response for a Razorpay order, flagging idempotent replays."""
+    response = jsonify(order)
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @app.route('/api/create-order', methods=['POST'])
 def create_order():
     """Create a Razorpay order."""
@@ -347,9 +585,21 @@ def create_order():
             'payment_capture': 1  # Auto-capture payment
         }
         
-        order = razorpay_client.order.create(data=order_data)
-        return jsonify(order)
-        
+        # Only dedupe when the client tells us which cart this is
+        fingerprint = cart_hash(amount, currency, data.get('items'), data.get('customerDetails'))
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key and data.get('items'):
+            idempotency_key = fingerprint
+        
+        order, replayed = payment_gateway.create_order(order_data, idempotency_key=idempotency_key,
+                                                       fingerprint=fingerprint)
+        return _order_response(order, replayed)
+        
+    except IdempotencyKeyReused as e:
+        return jsonify({'error': str(e)}), 422
+    except PaymentGatewayError as e:
+        print(f"Payment gateway error creating order: {e}")
+        return jsonify({'error': 'Payment service is not responding. Please try again.', 'details': str(e)}), 504
     except Exception as e:
         print(f"Error creating order: {e}")
         return jsonify({'error': str(e)}), 500
@@ -373,8 +623,8 @@ def verify_payment():
             'razorpay_signature': razorpay_signature
         }
         
-        # The library's utility function verifies the signature
-        razorpay_client.utility.verify_payment_signature(params_dict)
+        # The library's utility function verifies the signature; the order is then marked paid
+        payment_gateway.verify_payment_signature(params_dict)
         
         return jsonify({'status': 'success', 'message': 'Payment verified successfully'})
         
@@ -384,6 +634,48 @@ def verify_payment():
         print(f"Error verifying payment: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/webhooks/razorpay', methods=['POST'])
+def razorpay_webhook():
+    """Receive Razorpay webhooks: verify, queue and acknowledge immediately."""
+    body = request.get_data()
+    signature = request.headers.get('X-Razorpay-Signature', '')
+    
+    if not webhooks.verify_signature(body, signature):
+        return jsonify({'error': 'Invalid webhook signature'}), 400
+    
+    # Razorpay redelivers on timeouts; the event id makes redeliveries no-ops
+    queued = webhooks.enqueue_event(body, request.headers.get('X-Razorpay-Event-Id'))
+    return jsonify({'status': 'queued' if queued else 'duplicate'})
+
+@app.route('/api/admin/reconcile', methods=['GET', 'POST'])
+@require_admin
+def reconcile_payments():
+    """Start a payment reconciliation run (POST) or fetch the latest report (GET)."""
+    if request.method == 'GET':
+        return jsonify(reconciliation.status())
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        since = reconciliation.parse_date(data['since']) if data.get('since') is not None else None
+        until = reconciliation.parse_date(data['until']) if data.get('until') is not None else None
+        workers = reconciliation.parse_workers(data.get('workers', reconciliation.RECONCILE_WORKERS))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid reconciliation parameters: {e}'}), 400
+    if since is not None and until is not None and since >= until:
+        return jsonify({'error': "'since' must be before 'until'"}), 400
+    started = reconciliation.start_background(payment_gateway, since=since, until=until, workers=workers)
+    if not started:
+        return jsonify({'error': 'A reconciliation run is already in progress'}), 409
+    return jsonify({'status': 'started'}), 202
+
+@app.route('/api/admin/spaces', methods=['GET'])
+@require_admin
+def space_health():
+    """Per-Space availability, latency and ETA model; ?history=true adds the probe/request time series."""
+    return jsonify({**spaces.stats(history=request.args.get('history') == 'true'), 'eta': tryon_eta.stats()})
+
 @app.route('/api/create-order-cod', methods=['POST'])
 def create_order_cod():
     """Create a Cash on Delivery order."""
@@ -447,15 +739,26 @@ def create_order_online():
             }
         }
         
-        order = razorpay_client.order.create(data=order_data)
-        
-        # Store order details (in production, save to database)
-        print(f"Online Order created: {order['id']}")
-        print(f"Customer: {customer_details.get('fullName')}")
-        print(f"Amount: ₹{amount/100}")
-        
-        return jsonify(order)
-        
+        # Retries of the same checkout (same cart, same customer) get the same order back
+        fingerprint = cart_hash(amount, currency, items, customer_details)
+        idempotency_key = request.headers.get('Idempotency-Key') or fingerprint
+        order, replayed = payment_gateway.create_order(order_data, idempotency_key=idempotency_key,
+                                                       fingerprint=fingerprint)
+        
+        if replayed:
+            print(f"Online Order reused for retried checkout: {order['id']}")
+        else:
+            print(f"Online Order created: {order['id']}")
+            print(f"Customer: {customer_details.get('fullName')}")
+            print(f"Amount: ₹{amount/100}")
+        
+        return _order_response(order, replayed)
+        
+    except IdempotencyKeyReused as e:
+        return jsonify({'error': str(e)}), 422
+    except PaymentGatewayError as e:
+        print(f"Payment gateway error creating online order: {e}")
+        return jsonify({'error': 'Payment service is not responding. Please try again.', 'details': str(e)}), 504
     except Exception as e:
         print(f"Error creating online order: {e}")
         return jsonify({'error': str(e)}), 500
@@ -465,6 +768,87 @@ def health():
     """Health check endpoint."""
     return jsonify({'status': 'ok', 'message': 'Verse Virtual Try-On API is running'})
 
+@app.route('/api/tryon/results/<result_key>', methods=['GET'])
+def tryon_result(result_key):
+    """
+    A stored try-on result by key (the 'upgrade' URL of a lower-tier response), encoded per Accept.
+    202 while its background render is still running.
+    """
+    result = quality.get_result(result_key)
+    if result is not None and quality.pending(result):
+        response = jsonify({'status': 'pending', 'tier': result['tier']})
+        response.status_code = 202
+        response.headers['Retry-After'] = '5'
+        return response
+    if result is None or not result['artifact_path'] or not os.path.exists(result['artifact_path']):
+        return jsonify({'error': 'Result not found'}), 404
+    artifact_store.store.touch(result['artifact_path'])
+    image_bytes, mime_type = image_output.encode(result['artifact_path'],
+                                                 image_output.negotiate(request.headers.get('Accept'),
+                                                                        request.args.get('format')))
+    response = Response(image_bytes, mimetype=mime_type)
+    # Keys cover the inputs and the tier's options, so a stored result never changes; it's a customer photo
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Quality-Tier'] = result['tier']
+    return response
+
+@app.route('/api/prerendered', methods=['GET'])
+def prerendered_looks():
+    """Catalog looks rendered ahead of time by prerender.py (?garment=<file name> to filter)."""
+    looks = prerender.list_looks(request.args.get('garment'))
+    return jsonify({'looks': [{
+        'id': look['look_id'],
+        'garment': look['garment'],
+        'model': look['model'],
+        'url': f"/api/prerendered/{look['look_id']}",
+    } for look in looks]})
+
+@app.route('/api/prerendered/<look_id>', methods=['GET'])
+def prerendered_image(look_id):
+    """A pre-rendered look as an image, encoded per Accept like try-on results; never calls the Space."""
+    look = prerender.get_look(look_id)
+    if look is None or not os.path.exists(look['artifact_path']):
+        return jsonify({'error': 'Look not pre-rendered'}), 404
+    artifact_store.store.touch(look['artifact_path'])
+    image_bytes, mime_type = image_output.encode(look['artifact_path'],
+                                                 image_output.negotiate(request.headers.get('Accept'),
+                                                                        request.args.get('format')))
+    response = Response(image_bytes, mimetype=mime_type)
+    # Look ids change whenever the garment, model or try-on options do
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage and request latency histograms with p50/p95/p99."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+@require_admin
+def debug_profile():
+    """
+    Profile the live process for ?seconds=N (max 60), sampling at ?hz=N (max 1000).
+    mode=sample (default) returns flamegraph collapsed stacks across all threads;
+    mode=cprofile returns a pstats report of requests started during the window.
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        hz = float(request.args.get('hz', 200))
+    except ValueError:
+        return jsonify({'error': 'seconds and hz must be numbers'}), 400
+    if not (math.isfinite(seconds) and math.isfinite(hz)) or seconds <= 0 or hz <= 0:
+        return jsonify({'error': 'seconds and hz must be positive numbers'}), 400
+    seconds = min(seconds, profiling.MAX_PROFILE_SECONDS)
+    hz = min(hz, profiling.MAX_SAMPLE_HZ)
+    mode = request.args.get('mode', 'sample')
+    if mode not in ('sample', 'cprofile'):
+        return jsonify({'error': 'mode must be sample or cprofile'}), 400
+    
+    print(f"🔬 Capturing {mode} profile for {seconds}s...")
+    return Response(profiling.capture_profile(seconds, mode=mode, hz=hz), mimetype='text/plain')
+
 @app.route('/api/size-recommend', methods=['POST'])
 def size_recommend():
     """AI-powered size recommendation endpoint."""
@@ -604,7 +988,7 @@ if __name__ == '__main__':
     print("🚀 Starting Verse Virtual Try-On API Server...")
     print("📍 API will be available at: http://localhost:7860")
     print("🔧 Virtual Try-On endpoint: /api/tryon")
-    print("💳 Payment endpoints: /api/create-order, /api/verify-payment")
+    print("💳 Payment endpoints: /api/create-order, /api/verify-payment, /api/webhooks/razorpay")
     print("🤖 AI endpoints: /api/size-recommend, /api/style-chat, /api/track-order")
     print("\n✨ Server is ready! Press Ctrl+C to stop.\n")
     
@@ -3,10 +3,20 @@ from gradio_client import Client, handle_file
 import os
 from PIL import Image, ImageFilter, ImageEnhance
 import numpy as np
+import io
 import tempfile
+from image_utils import create_video_from_image, apply_custom_background, locate_and_crop_person, render_overlay_preview
+import image_ingest
+import artifact_store
+import space_jobs
+import eta
+import quality
+import tryon_service
+import speculation
 
 # Initialize the client
-client = Client("yisol/IDM-VTON")
+TRYON_SPACE = os.getenv("TRYON_SPACE", "yisol/IDM-VTON")
+client = Client(TRYON_SPACE, download_files=artifact_store.DOWNLOAD_DIR)
 
 GARMENT_DIR = "garments"
 BACKGROUND_DIR = "backgrounds"
@@ -15,6 +25,16 @@ OUTPUT_DIR = "outputs"
 for dir_path in [GARMENT_DIR, BACKGROUND_DIR, OUTPUT_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
+# Expire and quota-bound everything written to outputs/ (see artifact_store.py)
+artifact_store.store.start_sweeper()
+
+# Learns try-on latency so the status can say how long is left (see eta.py)
+tryon_eta = eta.EtaEstimator()
+try:
+    tryon_eta.load()
+except Exception as e:
+    print(f"⚠️  Could not load try-on latency history: {e}")
+
 def get_garments():
     """Load all images from the garments directory."""
     garments = []
@@ -33,249 +53,120 @@ def get_backgrounds():
                 backgrounds.append(os.path.join(BACKGROUND_DIR, file))
     return backgrounds
 
-def create_video_from_image(image_path, duration=4):
-    """Create a short video with dynamic movements from a static image."""
-    try:
-        import imageio
-        from PIL import ImageDraw
-        
-        # Load the image
-        img = Image.open(image_path)
-        w, h = img.size
-        
-        # Create frames with multiple dynamic effects
-        fps = 30
-        total_frames = int(duration * fps)
-        frames = []
-        
-        for i in range(total_frames):
-            t = i / total_frames
-            
-            # Effect 1: Zoom (1.0 to 1.2)
-            zoom = 1.0 + (t * 0.2)
-            
-            # Effect 2: Pan (subtle left-right movement)
-            pan_x = int(20 * np.sin(t * 2 * np.pi))
-            
-            # Effect 3: Tilt (subtle up-down movement)
-            tilt_y = int(15 * np.sin(t * 3 * np.pi))
-            
-            # Effect 4: Rotation (subtle rotation, max 3 degrees)
-            rotation_angle = 3 * np.sin(t * 2 * np.pi)
-            
-            # Apply rotation first
-            rotated = img.rotate(rotation_angle, resample=Image.Resampling.BICUBIC, expand=False)
-            
-            # Calculate crop box for zoom effect with pan and tilt
-            new_w = int(w / zoom)
-            new_h = int(h / zoom)
-            left = (w - new_w) // 2 + pan_x
-            top = (h - new_h) // 2 + tilt_y
-            
-            # Ensure crop box is within bounds
-            left = max(0, min(left, w - new_w))
-            top = max(0, min(top, h - new_h))
-            
-            # Crop and resize
-            cropped = rotated.crop((left, top, left + new_w, top + new_h))
-            zoomed = cropped.resize((w, h), Image.Resampling.LANCZOS)
-            
-            # Effect 5: Brightness variation for dynamic feel
-            enhancer = ImageEnhance.Brightness(zoomed)
-            enhanced = enhancer.enhance(1.0 + (t * 0.15))
-            
-            # Effect 6: Slight contrast boost
-            contrast_enhancer = ImageEnhance.Contrast(enhanced)
-            final_frame = contrast_enhancer.enhance(1.0 + (t * 0.1))
-            
-            frames.append(np.array(final_frame))
-        
-        # Save as video
-        output_path = os.path.join(OUTPUT_DIR, f"tryon_video_{os.getpid()}.mp4")
-        imageio.mimsave(output_path, frames, fps=fps, codec='libx264', quality=8)
-        
-        return output_path
-    except Exception as e:
-        print(f"Error creating video: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+def _status_text(update):
+    """Status line for a Space job update (see space_jobs.describe)."""
+    if update["stage"] == "queued":
+        position = update.get("queue_position")
+        text = f"⏳ Waiting in the model's queue (#{position})" if position else "⏳ Waiting in the model's queue"
+        if update.get("eta"):
+            text += f", about {update['eta']:.0f}s"
+        return text
+    if update["stage"] == "processing":
+        text = "🎨 Generating your try-on..."
+        if "progress" in update:
+            text += f" {update['progress']:.0%}"
+        if update.get("eta"):
+            text += f" (about {update['eta']:.0f}s left)"
+        return text
+    return "📤 Sending images to the model..."
 
-def apply_custom_background(result_image_path, background_path):
-    """Apply a custom background to the result image."""
-    try:
-        if not background_path:
-            return result_image_path
-        
-        # Load images
-        result = Image.open(result_image_path).convert("RGBA")
-        background = Image.open(background_path).convert("RGBA")
-        
-        # Resize background to match result
-        background = background.resize(result.size, Image.Resampling.LANCZOS)
-        
-        # Simple edge detection to create a rough mask
-        # Convert to grayscale for edge detection
-        gray = result.convert('L')
-        edges = gray.filter(ImageFilter.FIND_EDGES)
-        
-        # Create a simple mask based on the result image
-        # This is a simplified approach - ideally we'd use the mask from IDM-VTON
-        # For now, we'll just blend the images
-        blended = Image.blend(background.convert("RGB"), result.convert("RGB"), alpha=0.7)
-        
-        output_path = os.path.join(OUTPUT_DIR, f"bg_result_{os.getpid()}.png")
-        blended.save(output_path)
-        
-        return output_path
-    except Exception as e:
-        print(f"Error applying background: {e}")
-        return result_image_path
+def _submit_tryon(crop, inputs):
+    """Submit the IDM-VTON job for a cropped person (clicked and speculative try-ons alike)."""
+    return space_jobs.SpaceJob.submit(
+        client,
+        tracker=tryon_eta.track(eta.features(TRYON_SPACE, quality.TIERS[inputs.tier], crop.path, inputs.garment)),
+        dict={"background": handle_file(crop.path), "layers": [], "composite": None},
+        garm_img=handle_file(inputs.garment),
+        garment_des=inputs.description,
+        api_name="/tryon",
+        **quality.options(inputs.tier)  # denoise steps by tier; garment cropping on for a better fit
+    )
 
-def detect_and_crop_person(image_path):
-    """
-    Detect person in image and crop to show only the person.
-    Uses OpenCV face detection and estimates body area.
-    Returns path to cropped image, or original if no person detected.
-    """
-    try:
-        import cv2
-        
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            print("⚠️  Could not read image, using original")
-            return image_path
-        
-        height, width = img.shape[:2]
-        
-        # Try face detection first (most reliable for person photos)
-        face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) > 0:
-            # Found face(s) - use the largest one
-            largest_face = max(faces, key=lambda f: f[2] * f[3])
-            x, y, w, h = largest_face
-            
-            print(f"✅ Detected face at ({x}, {y}) with size {w}x{h}")
-            
-            # Expand crop to include full body
-            # Assume body is ~3-4x face height, centered on face
-            body_height = h * 4
-            body_width = w * 2.5
-            
-            # Calculate crop coordinates
-            center_x = x + w // 2
-            center_y = y + h // 2
-            
-            crop_x1 = max(0, int(center_x - body_width // 2))
-            crop_y1 = max(0, int(y - h * 0.5))  # Include some space above head
-            crop_x2 = min(width, int(center_x + body_width // 2))
-            crop_y2 = min(height, int(center_y + body_height // 2))
-            
-            # Crop image
-            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
-            
-            # Save cropped image
-            base, ext = os.path.splitext(image_path)
-            output_path = f"{base}_cropped{ext}"
-            cv2.imwrite(output_path, cropped)
-            
-            print(f"✅ Cropped person image saved to: {output_path}")
-            return output_path
-        
-        # No face detected - try full body detection
-        print("⚠️  No face detected, trying full body detection...")
-        body_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_fullbody.xml'
-        )
-        
-        bodies = body_cascade.detectMultiScale(gray, 1.1, 3)
-        
-        if len(bodies) > 0:
-            # Use largest detected body
-            largest_body = max(bodies, key=lambda b: b[2] * b[3])
-            x, y, w, h = largest_body
-            
-            print(f"✅ Detected body at ({x}, {y}) with size {w}x{h}")
-            
-            # Add padding
-            padding = 20
-            crop_x1 = max(0, x - padding)
-            crop_y1 = max(0, y - padding)
-            crop_x2 = min(width, x + w + padding)
-            crop_y2 = min(height, y + h + padding)
-            
-            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
-            
-            base, ext = os.path.splitext(image_path)
-            output_path = f"{base}_cropped{ext}"
-            cv2.imwrite(output_path, cropped)
-            
-            print(f"✅ Cropped body image saved to: {output_path}")
-            return output_path
-        
-        # No person detected - return original image
-        print("⚠️  No person detected, using original image")
-        return image_path
-        
-    except Exception as e:
-        print(f"❌ Error during person detection: {e}")
-        import traceback
-        traceback.print_exc()
-        return image_path
+# Starts the crop (and, with spare capacity, the Space job) once a photo and garment are chosen
+speculator = speculation.Speculator(_submit_tryon, preview=tryon_service.LOCAL_PREVIEW)
 
-def tryon(person_image, garment_image, description, background_image, generate_video):
+def speculate(person_image, garment_image, description, tier, request: gr.Request):
+    if person_image and garment_image:
+        speculator.speculate(request.session_hash,
+                             speculation.Inputs(person_image, garment_image, description, tier))
+
+def tryon(person_image, garment_image, description, background_image, generate_video, tier=quality.BEST_TIER,
+          progress=gr.Progress(), request: gr.Request = None):
     if not person_image or not garment_image:
-        return None, None, "❌ Please upload both person and garment images"
+        yield None, None, "❌ Please upload both person and garment images"
+        return
     
-    print(f"Processing Verse Virtual Try-On for: {description}")
+    # Header-only check: refuse decompression bombs and non-images before decoding anything
+    try:
+        image_ingest.probe(person_image)
+        image_ingest.probe(garment_image)
+        if background_image:
+            image_ingest.probe(background_image)
+    except image_ingest.ImageRejected as e:
+        raise gr.Error(str(e))
     
-    # AUTO-CROP PERSON FROM IMAGE
-    print("🔍 Detecting and cropping person from uploaded image...")
-    cropped_person_image = detect_and_crop_person(person_image)
+    print(f"Processing Verse Virtual Try-On for: {description}")
     
-    person_image_dict = {
-        "background": handle_file(cropped_person_image),
-        "layers": [],
-        "composite": None
-    }
+    # Pick up the work speculation already did for these exact inputs, if any
+    inputs = speculation.Inputs(person_image, garment_image, description, tier)
+    speculated = speculator.claim(request.session_hash if request else None, inputs)
+    prepared = None
+    if speculated is not None:
+        try:
+            prepared = speculated.prepared.result()
+        except Exception:
+            pass  # redone below, where errors surface normally
+    
+    if prepared is not None:
+        crop, preview = prepared
+    else:
+        # AUTO-CROP PERSON FROM IMAGE
+        print("🔍 Detecting and cropping person from uploaded image...")
+        yield None, None, "🔍 Finding you in the photo..."
+        crop = locate_and_crop_person(person_image)
+        preview = (render_overlay_preview(crop.path, garment_image, crop.torso)
+                   if tryon_service.LOCAL_PREVIEW else None)
+    
+    # Rough local overlay to look at until the real result replaces it
+    if preview is not None:
+        yield Image.open(io.BytesIO(preview)), None, "👀 Quick preview - rendering the full try-on..."
     
     try:
-        result = client.predict(
-            dict=person_image_dict,
-            garm_img=handle_file(garment_image),
-            garment_des=description,
-            is_checked=True,
-            is_checked_crop=True,  # Enable garment cropping for perfect fit
-            denoise_steps=50,  # Optimal quality for best fitting
-            seed=42,
-            api_name="/tryon"
-        )
+        # Submitted as a job and polled, so Cancel or a closed tab cancels it on the Space too:
+        # Gradio closes this generator at the next yield, which leaves the with-block
+        last = None
+        job = speculated.usable_job() if speculated is not None else None
+        with speculator.committed(), (job or _submit_tryon(crop, inputs)) as job:
+            for update in job.updates():
+                if update == last:
+                    yield gr.skip()
+                    continue
+                last = update
+                progress(update.get("progress", 0), desc=_status_text(update))
+                yield gr.skip(), gr.skip(), _status_text(update)
+            result = job.result()
         
         result_image_path = result[0]
         
         # Apply custom background if provided
         if background_image:
             print("Applying custom background...")
+            yield gr.skip(), gr.skip(), "🖼️ Applying your background..."
             result_image_path = apply_custom_background(result_image_path, background_image)
         
         # Generate video if requested
         video_path = None
         if generate_video:
             print("Generating video...")
+            yield result_image_path, None, "🎬 Generating video..."
             video_path = create_video_from_image(result_image_path, duration=4)
             if video_path:
-                return result_image_path, video_path, "✅ Try-on complete with video!"
+                yield result_image_path, video_path, "✅ Try-on complete with video!"
             else:
-                return result_image_path, None, "✅ Try-on complete (video generation failed)"
+                yield result_image_path, None, "✅ Try-on complete (video generation failed)"
+            return
         
-        return result_image_path, None, "✅ Try-on complete!"
+        yield result_image_path, None, "✅ Try-on complete!"
         
     except Exception as e:
         print(f"Error during API call: {e}")
@@ -655,8 +546,11 @@ with gr.Blocks(title="Verse Virtual Try-On") as demo:
             
             gr.Markdown("### 4️⃣ Output Options")
             generate_video_checkbox = gr.Checkbox(label="Generate Video (3-5 seconds)", value=False)
+            quality_radio = gr.Radio(choices=quality.TIER_ORDER, value=quality.BEST_TIER, label="Quality",
+                                     info="Preview is quickest; max takes longest and looks best")
             
             submit_btn = gr.Button("✨ Try On Now", variant="primary", size="lg", elem_classes="verse-button")
+            cancel_btn = gr.Button("✖ Cancel", variant="secondary", size="sm")
         
         with gr.Column(scale=1):
             gr.Markdown("### 🎯 Your Result")
@@ -679,11 +573,20 @@ with gr.Blocks(title="Verse Virtual Try-On") as demo:
     background_gallery.select(update_bg_from_gallery, None, selected_background)
     background_upload.change(update_selected_from_upload, background_upload, selected_background)
 
-    submit_btn.click(
+    tryon_event = submit_btn.click(
         fn=tryon,
-        inputs=[person_input, selected_garment, description_input, selected_background, generate_video_checkbox],
+        inputs=[person_input, selected_garment, description_input, selected_background, generate_video_checkbox,
+                quality_radio],
         outputs=[output_image, output_video, status_text]
     )
+    # Stops the try-on here and cancels its job on the Space
+    cancel_btn.click(fn=None, inputs=None, outputs=None, cancels=[tryon_event])
+    
+    # Optional (TRYON_SPECULATE): start the try-on's work as soon as its inputs are chosen
+    if speculation.SPECULATE:
+        speculation_inputs = [person_input, selected_garment, description_input, quality_radio]
+        for trigger in (person_input.change, selected_garment.change, description_input.blur, quality_radio.change):
+            trigger(speculate, speculation_inputs, None, queue=False, show_progress="hidden")
 
 if __name__ == "__main__":
     # Production configuration for Render.com
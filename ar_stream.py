@@ -0,0 +1,218 @@
+import asyncio
+import io
+import os
+import time
+from typing import Optional, List, Tuple
+
+import anyio
+import cv2
+import numpy as np
+from PIL import Image
+from starlette.websockets import WebSocket
+
+import face_pose
+import image_ingest
+import metrics
+
+# Live AR sessions per worker process, and frames the face detector takes in one forward pass
+AR_MAX_SESSIONS = int(os.getenv("AR_MAX_SESSIONS", "64"))
+AR_MAX_BATCH = int(os.getenv("AR_MAX_BATCH", "16"))
+# How long the first frame of a batch waits for other sessions' frames to join it
+AR_BATCH_WINDOW_MS = float(os.getenv("AR_BATCH_WINDOW_MS", "5"))
+AR_MAX_FRAME_BYTES = int(os.getenv("AR_MAX_FRAME_BYTES", str(512 * 1024)))
+AR_MAX_FRAME_SIDE = int(os.getenv("AR_MAX_FRAME_SIDE", "1280"))
+OUTPUTS = ("points", "pose")
+FRAMES_METRIC = "verse_ar_frames_total"
+BATCHES_METRIC = "verse_ar_batches_total"
+FRAME_METRIC = "verse_ar_frame_seconds"
+
+# WebSocket close codes
+POLICY_VIOLATION = 1008
+SERVER_ERROR = 1011
+TRY_AGAIN_LATER = 1013
+
+
+class DetectionBatcher:
+    """
+    Runs the face detector for every AR session in the process: frames queue up here and
+    go through face_pose.detect_faces together, one forward pass per batch, on a worker
+    thread. A batch closes when it is full or AR_BATCH_WINDOW_MS after its first frame;
+    frames that arrive while it runs form the next one.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.sessions = 0
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        metrics.register_gauge("verse_ar_sessions", lambda: {(): self.sessions}, "Live AR WebSocket sessions")
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    async def detect(self, image: np.ndarray) -> Optional[face_pose.Box]:
+        """The most confident face box in the frame, once its batch has run."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image, future))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if len(self._pending) < AR_MAX_BATCH:
+                await asyncio.sleep(AR_BATCH_WINDOW_MS / 1000)
+            batch, self._pending = self._pending[:AR_MAX_BATCH], self._pending[AR_MAX_BATCH:]
+            if not self._pending:
+                self._wakeup.clear()
+            # Sessions that closed while waiting have cancelled their futures
+            batch = [(image, future) for image, future in batch if not future.done()]
+            if not batch:
+                continue
+            metrics.inc(BATCHES_METRIC)
+            metrics.inc(FRAMES_METRIC, len(batch))
+            try:
+                with metrics.span("ar.detect"):
+                    boxes = await anyio.to_thread.run_sync(face_pose.detect_faces, self.net,
+                                                           [image for image, _ in batch])
+            except Exception as e:
+                print(f"❌ AR face detection failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), box in zip(batch, boxes):
+                if not future.done():
+                    future.set_result(box)
+
+
+def load_detector() -> Optional[DetectionBatcher]:
+    """The process's detection batcher, or None (AR off) when the res10 model files aren't there."""
+    if not (os.path.exists(face_pose.FACE_PROTOTXT) and os.path.exists(face_pose.FACE_MODEL)):
+        return None
+    net = face_pose.load_net()
+    return DetectionBatcher(net) if net is not None else None
+
+
+def _decode(data: bytes) -> np.ndarray:
+    """A compressed (JPEG/PNG/WebP) webcam frame as BGR pixels; raises ValueError if unusable."""
+    if len(data) > AR_MAX_FRAME_BYTES:
+        raise ValueError(f"Frame is larger than {AR_MAX_FRAME_BYTES} bytes")
+    # Size from the header first: a small, highly compressible frame can decode to gigabytes
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            width, height, fmt = header.width, header.height, header.format
+    except Image.DecompressionBombError:
+        raise ValueError(f"Frame is larger than {AR_MAX_FRAME_SIDE}px; send a smaller one")
+    except (OSError, SyntaxError, ValueError):
+        raise ValueError("Frame is not a JPEG, PNG or WebP image")
+    if fmt not in image_ingest.ALLOWED_FORMATS:
+        raise ValueError("Frame is not a JPEG, PNG or WebP image")
+    if max(width, height) > AR_MAX_FRAME_SIDE:
+        raise ValueError(f"Frame is larger than {AR_MAX_FRAME_SIDE}px; send a smaller one")
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Frame is not a JPEG, PNG or WebP image")
+    return image
+
+
+def _message(frame: int, image: np.ndarray, box: Optional[face_pose.Box], pose, output: str) -> dict:
+    h, w = image.shape[:2]
+    message = {"type": "pose", "frame": frame, "size": [w, h], "face": pose is not None}
+    if pose is None:
+        return message
+    message["box"] = list(box)
+    if output == "pose":
+        message["rvec"] = [round(float(v), 5) for v in pose[0].reshape(-1)]
+        message["tvec"] = [round(float(v), 3) for v in pose[1].reshape(-1)]
+    else:
+        points = face_pose.project(face_pose.VIRTUAL_OBJECT_3D_POINTS, pose, w, h)
+        message["points"] = [[round(float(x), 1), round(float(y), 1)] for x, y in points]
+    return message
+
+
+async def ar_session(websocket: WebSocket) -> None:
+    """
+    /ws/ar: the browser sends compressed webcam frames as binary messages; each processed
+    frame gets a JSON "pose" message with the glasses' projected 2D points (output=points,
+    the default) or the head pose vectors (output=pose). A session that sends faster than
+    it is served has its stale frames dropped, so replies stay live.
+    """
+    batcher: Optional[DetectionBatcher] = websocket.app.state.ar_detector
+    output = websocket.query_params.get("output", "points")
+    if output not in OUTPUTS:
+        await websocket.close(code=POLICY_VIOLATION, reason=f"output must be one of {', '.join(OUTPUTS)}")
+        return
+    if batcher is None:
+        await websocket.close(code=SERVER_ERROR, reason="AR face detector is not configured")
+        return
+    if batcher.sessions >= AR_MAX_SESSIONS:
+        await websocket.close(code=TRY_AGAIN_LATER, reason="Too many AR sessions; try again shortly")
+        return
+    # Counted before the first await, so concurrent handshakes can't all slip under the cap
+    batcher.sessions += 1
+    try:
+        await websocket.accept()
+        await websocket.send_json({"type": "ready", "output": output,
+                                   "connections": face_pose.VIRTUAL_OBJECT_CONNECTIONS,
+                                   "object_points": face_pose.VIRTUAL_OBJECT_3D_POINTS.tolist()})
+        await _serve_session(websocket, batcher, output)
+    except Exception as e:
+        print(f"⚠️  AR session ended: {e}")
+    finally:
+        batcher.sessions -= 1
+
+
+async def _serve_session(websocket: WebSocket, batcher: DetectionBatcher, output: str) -> None:
+    """Receive frames and answer them until the client disconnects."""
+    # Newest unprocessed frame: (sequence number, bytes, time received)
+    latest: List[Optional[Tuple[int, bytes, float]]] = [None]
+    arrived = asyncio.Event()
+
+    async def receive(cancel_scope) -> None:
+        received = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                continue  # text messages (keepalives) carry no frame
+            received += 1
+            latest[0] = (received, message["bytes"], time.perf_counter())
+            arrived.set()
+        cancel_scope.cancel()
+
+    async def serve() -> None:
+        pose = None
+        while True:
+            await arrived.wait()
+            arrived.clear()
+            frame, data, received_at = latest[0]
+            latest[0] = None
+            try:
+                image = await anyio.to_thread.run_sync(_decode, data, limiter=websocket.app.state.cpu_limiter)
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "frame": frame, "error": str(e)})
+                continue
+            box = await batcher.detect(image)
+            h, w = image.shape[:2]
+            if box is None:
+                pose = None
+            else:
+                # The previous pose is a good starting point while the face stays in view
+                pose = face_pose.solve_pose(face_pose.landmarks_from_box(*box), w, h, pose)
+            await websocket.send_json(_message(frame, image, box, pose, output))
+            metrics.observe(FRAME_METRIC, time.perf_counter() - received_at, output=output)
+
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(receive, tasks.cancel_scope)
+        tasks.start_soon(serve)
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Tuple
+
+import metrics
+
+OUTPUT_DIR = "outputs"
+# Total disk budget for everything under outputs/; the sweeper evicts least recently used files above it
+ARTIFACT_QUOTA_MB = float(os.getenv("ARTIFACT_QUOTA_MB", "2048"))
+# Default lifetime of stored artifacts, and of Space downloads (only needed until the response is built)
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "3600"))
+ARTIFACT_DOWNLOAD_TTL_SECONDS = float(os.getenv("ARTIFACT_DOWNLOAD_TTL_SECONDS", "900"))
+# Pre-rendered catalog looks (prerender.py) are expensive to redo, so they live much longer
+PRERENDER_TTL_SECONDS = float(os.getenv("PRERENDER_TTL_SECONDS", str(30 * 86400)))
+ARTIFACT_SWEEP_INTERVAL = float(os.getenv("ARTIFACT_SWEEP_INTERVAL", "60"))
+# Quota eviction stops once usage is back under this fraction of the quota
+LOW_WATERMARK = 0.9
+
+# Kinds live in their own top-level directory. "scratch" is per-request temporary files at the
+# top level (uploads, crops), "tmp" is producers' work files, "downloads" is gradio_client's cache.
+KIND_TTLS = {
+    "video": ARTIFACT_TTL_SECONDS,
+    "background": ARTIFACT_TTL_SECONDS,
+    "results": ARTIFACT_TTL_SECONDS,  # try-on results by quality tier (quality.py)
+    "prerender": PRERENDER_TTL_SECONDS,
+    "downloads": ARTIFACT_DOWNLOAD_TTL_SECONDS,
+    "tmp": ARTIFACT_TTL_SECONDS,
+    "scratch": ARTIFACT_TTL_SECONDS,
+}
+# In-flight requests' inputs and work files: a try-on can hold them for minutes while the Space
+# runs, so only their TTL removes them, never quota pressure
+QUOTA_EXEMPT_KINDS = {"scratch", "tmp"}
+EVICTIONS_METRIC = "verse_artifact_evictions_total"
+SWEEP_METRIC = "verse_artifact_sweep_seconds"
+DOWNLOAD_DIR = os.path.join(OUTPUT_DIR, "downloads")
+
+
+class ArtifactStore:
+    """
+    Generated files under outputs/, stored content-addressed at <kind>/<sha[:2]>/<sha><ext>.
+    Each file expires after its TTL (last use = mtime), and a background sweeper keeps the
+    whole directory under a size quota by evicting the least recently used files first
+    (other than in-flight work files, QUOTA_EXEMPT_KINDS, which still count towards it).
+    """
+
+    def __init__(self, root: str = OUTPUT_DIR, quota_bytes: int = int(ARTIFACT_QUOTA_MB * 1024 * 1024),
+                 ttls: Optional[Dict[str, float]] = None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.ttls = dict(ttls or KIND_TTLS)
+        self.usage: Dict[str, Tuple[int, int]] = {}
+        self._expires: Dict[str, float] = {}  # per-artifact TTL overrides, by path
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def scratch_path(self, ext: str) -> str:
+        """Unique path under tmp/ for a producer to write to before put_file()."""
+        directory = os.path.join(self.root, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{uuid.uuid4().hex}{ext}")
+
+    def put_file(self, src: str, kind: str, ttl: Optional[float] = None) -> str:
+        """Move src into the store and return its content-addressed path (deduplicated)."""
+        if kind not in self.ttls:
+            raise ValueError(f"Unknown artifact kind: {kind}")
+        digest = hashlib.sha256()
+        with open(src, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        directory = os.path.join(self.root, kind, sha[:2])
+        os.makedirs(directory, exist_ok=True)
+        dest = os.path.join(directory, sha + os.path.splitext(src)[1].lower())
+        if os.path.exists(dest):
+            os.remove(src)
+            self.touch(dest)
+        else:
+            os.replace(src, dest)
+        if ttl is not None:
+            with self._lock:
+                self._expires[dest] = time.time() + ttl
+        return dest
+
+    def touch(self, path: str) -> None:
+        """Mark an artifact as used now (LRU order and TTL both count from the last use)."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def sweep(self) -> Dict[str, int]:
+        """Delete expired artifacts, then least recently used ones while over quota."""
+        start = time.perf_counter()
+        now = time.time()
+        files = self._scan()
+        removed = {"ttl": 0, "quota": 0}
+        live = []
+        with self._lock:
+            expires = dict(self._expires)
+        for path, kind, size, mtime in files:
+            if expires.get(path, mtime + self.ttls[kind]) <= now:
+                if self._remove(path, kind, "ttl"):
+                    removed["ttl"] += 1
+                    continue
+            live.append((path, kind, size, mtime))
+
+        total = sum(size for _, _, size, _ in live)
+        if total > self.quota_bytes:
+            live.sort(key=lambda entry: entry[3])
+            target = self.quota_bytes * LOW_WATERMARK
+            kept = []
+            for path, kind, size, mtime in live:
+                if total > target and kind not in QUOTA_EXEMPT_KINDS and self._remove(path, kind, "quota"):
+                    total -= size
+                    removed["quota"] += 1
+                else:
+                    kept.append((path, kind, size, mtime))
+            live = kept
+
+        usage: Dict[str, Tuple[int, int]] = {kind: (0, 0) for kind in self.ttls}
+        for _, kind, size, _ in live:
+            count, used = usage[kind]
+            usage[kind] = (count + 1, used + size)
+        live_paths = {path for path, _, _, _ in live}
+        with self._lock:
+            self.usage = usage
+            self._expires = {p: t for p, t in self._expires.items() if p in live_paths}
+        metrics.observe(SWEEP_METRIC, time.perf_counter() - start)
+        return removed
+
+    def _scan(self) -> List[Tuple[str, str, int, float]]:
+        """(path, kind, size, mtime) for every file under the root."""
+        files = []
+        if not os.path.isdir(self.root):
+            return files
+        for entry in os.scandir(self.root):
+            if entry.is_file(follow_symlinks=False):
+                files.append(self._stat(entry.path, "scratch"))
+            elif entry.is_dir(follow_symlinks=False) and entry.name in self.ttls:
+                for directory, _, names in os.walk(entry.path):
+                    files.extend(self._stat(os.path.join(directory, name), entry.name) for name in names)
+        return [f for f in files if f is not None]
+
+    def _stat(self, path: str, kind: str) -> Optional[Tuple[str, str, int, float]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None  # removed by its request (or another worker) mid-scan
+        return path, kind, st.st_size, st.st_mtime
+
+    def _remove(self, path: str, kind: str, reason: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            print(f"⚠️  Could not evict artifact {path}: {e}")
+            return False
+        metrics.inc(EVICTIONS_METRIC, kind=kind, reason=reason)
+        if kind == "downloads":
+            # gradio_client keeps one directory per download
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        return True
+
+    def start_sweeper(self, interval: float = ARTIFACT_SWEEP_INTERVAL) -> None:
+        """Sweep now and then every interval seconds on a daemon thread (once per process)."""
+        with self._lock:
+            if self._sweeper is not None or interval <= 0:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, args=(interval,),
+                                             name="artifact-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_forever(self, interval: float) -> None:
+        while True:
+            try:
+                removed = self.sweep()
+                if removed["ttl"] or removed["quota"]:
+                    print(f"🧹 Evicted {removed['ttl']} expired and {removed['quota']} over-quota artifacts")
+            except Exception as e:
+                print(f"⚠️  Artifact sweep failed: {e}")
+            time.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            usage = dict(self.usage)
+        return {
+            "quota_bytes": self.quota_bytes,
+            "used_bytes": sum(used for _, used in usage.values()),
+            "by_kind": {kind: {"files": count, "bytes": used} for kind, (count, used) in usage.items()},
+        }
+
+
+store = ArtifactStore()
+metrics.register_gauge("verse_artifact_bytes", lambda: {(("kind", k),): u[1] for k, u in store.usage.items()},
+                       "Bytes under outputs/ by artifact kind, as of the last sweep")
+metrics.register_gauge("verse_artifact_files", lambda: {(("kind", k),): u[0] for k, u in store.usage.items()},
+                       "Files under outputs/ by artifact kind, as of the last sweep")
+metrics.register_gauge("verse_artifact_quota_bytes", lambda: {(): store.quota_bytes},
+                       "Disk quota enforced on outputs/")
@@ -0,0 +1,587 @@
+"""
+Production entry point: the API as an ASGI app served by uvicorn.
+
+    uvicorn asgi_server:app --host 0.0.0.0 --port 7860 --workers 1
+    python asgi_server.py            # same, using PORT / WEB_CONCURRENCY
+
+/api/tryon is async-native: the minutes-long Space wait is a coroutine on the
+event loop (see async_space.py), so one worker holds hundreds of waits, and only
+the CPU-bound crop/encode steps borrow a thread. /ws/ar streams live AR head
+poses over a WebSocket (see ar_stream.py). Every other route is the Flask app
+from api_server.py, served on a bounded thread pool.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional, Tuple
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, Mount, WebSocketRoute, request_response
+
+import admission
+import ar_stream
+import eta
+import image_ingest
+import image_output
+import metrics
+import quality
+import scheduler
+import space_pool
+import traffic_capture
+import tryon_service
+from api_server import (app as flask_app, slow_requests, traffic, tryon_admission, tryon_eta, expected_tryon,
+                        choose_tier, spaces, HF_TOKEN)
+from async_space import AsyncSpaceClient, SpaceError
+from image_utils import detect_and_crop_person, locate_and_crop_person
+
+# Threads serving the Flask routes (payments, Gemini, admin) per worker process
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "32"))
+# Threads for CPU-bound try-on steps (person crop, base64/video encode) per worker process
+TRYON_CPU_THREADS = int(os.getenv("TRYON_CPU_THREADS", "4"))
+# Seconds to wait for the Space before answering 504
+SPACE_TIMEOUT = float(os.getenv("SPACE_TIMEOUT", "300"))
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# nginx's status for a request the client abandoned
+CLIENT_CLOSED_REQUEST = 499
+
+TRYON_ROUTE = "/api/tryon"
+TRYON_BATCH_ROUTE = "/api/tryon/batch"
+AR_ROUTE = "/ws/ar"
+
+def _save_upload(upload: UploadFile, path: str) -> None:
+    upload.file.seek(0)
+    with open(path, "wb") as f:
+        while chunk := upload.file.read(1024 * 1024):
+            f.write(chunk)
+
+async def _in_thread(fn: Callable, *args, limiter: Optional[anyio.CapacityLimiter] = None):
+    """anyio.to_thread.run_sync, sampled and profiled as part of the calling request."""
+    return await anyio.to_thread.run_sync(slow_requests.traced(fn), *args, limiter=limiter)
+
+def _check_content_length(request: Request) -> Optional[JSONResponse]:
+    """400 for a malformed Content-Length, 413 for one over the upload limit, else None."""
+    try:
+        length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        return JSONResponse({'error': 'Invalid Content-Length header'}, status_code=400)
+    if length > MAX_UPLOAD_BYTES:
+        return JSONResponse({'error': 'Upload too large (max 50MB)'}, status_code=413)
+    return None
+
+def _capture_fields(request: Request, form) -> dict:
+    """The request side of a traffic-capture record; reads the uploads, so call before closing the form."""
+    return {
+        "request_bytes": int(request.headers.get("content-length", 0)),
+        "content_type": "multipart/form-data",
+        "headers": [name for name in traffic_capture.TRACKED_HEADERS if name in request.headers],
+        "files": [traffic_capture.file_info(field, value.file, value.content_type, value.filename)
+                  for field, value in form.multi_items() if isinstance(value, UploadFile)],
+        "form": traffic_capture.sanitize({field: value for field, value in form.multi_items()
+                                          if isinstance(value, str)}),
+    }
+
+def _capture(request: Request, route: str, status: int, duration: float, fields: dict,
+             response_bytes: Optional[int] = None) -> None:
+    """Traffic-capture record for the async try-on routes (the Flask hook doesn't see them)."""
+    record = traffic_capture.base_record(route, request.method, status, duration, path=request.url.path)
+    record.update({**fields, "response_bytes": response_bytes})
+    traffic.write(record)
+
+async def _tryon(request: Request, form, on_status: Callable[[dict], None],
+                 on_preview: Optional[Callable[[dict], None]] = None) -> Tuple[dict, int]:
+    """
+    The try-on itself; returns the JSON body and status, reporting progress to on_status and,
+    before calling the Space, a local overlay preview line to on_preview.
+    """
+    person_file = form.get('person_image')
+    garment_file = form.get('garment_image')
+    description = form.get('description', 'Stylish outfit')
+    generate_video = str(form.get('generate_video', 'false')).lower() == 'true'
+
+    if not isinstance(person_file, UploadFile) or not isinstance(garment_file, UploadFile):
+        return {'error': 'Both person and garment images are required'}, 400
+    try:
+        requested_tier = quality.requested(form.get('quality'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    state = request.app.state
+    person_path, garment_path = tryon_service.upload_paths()
+    cropped_person_path = result_image_path = None
+    try:
+        with metrics.span("tryon.save_uploads"):
+            await _in_thread(_save_upload, person_file, person_path, limiter=state.cpu_limiter)
+            await _in_thread(_save_upload, garment_file, garment_path, limiter=state.cpu_limiter)
+
+        # Reject oversized or non-image uploads from their headers, then decode to working size
+        try:
+            with metrics.span("tryon.ingest"):
+                await _in_thread(image_ingest.prepare_upload, person_path, limiter=state.cpu_limiter)
+                await _in_thread(image_ingest.prepare_upload, garment_path, limiter=state.cpu_limiter)
+        except image_ingest.ImageRejected as rejected:
+            return {'error': str(rejected)}, rejected.status
+
+        on_status({'stage': 'preparing', **tryon_eta.estimate(expected_tryon())})
+        tier, degraded = choose_tier(requested_tier)
+        inputs = await _in_thread(quality.input_key, person_path, garment_path, description, limiter=state.cpu_limiter)
+        hit = await _in_thread(quality.cached, inputs, tier)
+        if hit is not None:
+            # This tier (or a better one) was rendered before: no crop, no Space call
+            served, stored_path = hit
+            quality_fields = quality.describe(requested_tier, served, degraded and served != quality.BEST_TIER, True)
+        else:
+            with metrics.span("tryon.detect_and_crop_person"):
+                crop = await _in_thread(locate_and_crop_person, person_path, limiter=state.cpu_limiter)
+            cropped_person_path = crop.path
+            if on_preview is not None:
+                line = await _in_thread(tryon_service.preview_line, crop, garment_path, limiter=state.cpu_limiter)
+                if line is not None:
+                    on_preview(line)
+
+            # Covers uploading the inputs to the Space, its queue and the inference itself
+            try:
+                with metrics.span("tryon.space_predict"), spaces.use() as space:
+                    tracker = tryon_eta.track(eta.features(space.src, quality.TIERS[tier], cropped_person_path,
+                                                           garment_path))
+                    result_image_path = await state.spaces[space.src].tryon(
+                        cropped_person_path, garment_path, description, tryon_service.OUTPUT_DIR,
+                        on_status=lambda update: on_status(tracker.observe(update)), **quality.options(tier))
+                # Recording the latency is a small SQLite write; keep it off the event loop
+                await _in_thread(tracker.finish)
+            except SpaceError as api_error:
+                error_msg = str(api_error)
+                print(f"❌ Hugging Face API Error: {error_msg}")
+                return tryon_service.space_error_response(error_msg) or ({'error': error_msg}, 502)
+
+            stored_path = await _in_thread(quality.store, inputs, tier, result_image_path)
+            result_image_path = None  # moved into the store
+            upgrade = quality.wants_upgrade(tier) and await _schedule_upgrade(
+                request, inputs, cropped_person_path, garment_path, description)
+            quality_fields = quality.describe(requested_tier, tier, degraded, False, upgrade, inputs)
+
+        on_status({'stage': 'encoding'})
+        image_format = image_output.negotiate(request.headers.get('accept'), form.get('output_format'))
+        response_data = await _in_thread(tryon_service.build_response, stored_path,
+                                         generate_video, image_format, limiter=state.cpu_limiter)
+        return {**response_data, **quality_fields}, 200
+    finally:
+        tryon_service.remove_files([person_path, garment_path, cropped_person_path, result_image_path])
+
+async def _schedule_upgrade(request: Request, inputs: str, cropped_person_path: str, garment_path: str,
+                            description: str) -> bool:
+    """Re-render at the best tier on a spare Space slot, as a background task; True if one is on its way."""
+    if not tryon_admission.try_acquire():
+        return False
+    try:
+        if not await anyio.to_thread.run_sync(quality.claim_upgrade, inputs):
+            tryon_admission.release()
+            return True  # already rendering for an earlier request
+        copies = await anyio.to_thread.run_sync(quality.work_copies, cropped_person_path, garment_path)
+    except Exception as e:
+        # The try-on itself succeeded; it just won't get an upgrade
+        print(f"⚠️  Could not schedule upgrade: {e}")
+        tryon_admission.release()
+        await anyio.to_thread.run_sync(quality.abandon_upgrade, inputs, "failed")
+        return False
+    upgrades = request.app.state.upgrades
+    task = asyncio.ensure_future(_run_upgrade(request.app.state, inputs, copies, description))
+    upgrades.add(task)
+    task.add_done_callback(upgrades.discard)
+    return True
+
+async def _run_upgrade(state, inputs: str, copies: Tuple[str, str], description: str) -> None:
+    cropped_person_path, garment_path = copies
+    result_image_path = None
+    try:
+        with metrics.span("tryon.upgrade"), spaces.use() as space:
+            result_image_path = await state.spaces[space.src].tryon(
+                cropped_person_path, garment_path, description, tryon_service.OUTPUT_DIR,
+                **quality.options(quality.BEST_TIER))
+        await anyio.to_thread.run_sync(quality.store, inputs, quality.BEST_TIER, result_image_path)
+        result_image_path = None
+        metrics.inc(quality.UPGRADE_METRIC, result="rendered")
+    except Exception as e:
+        print(f"⚠️  Background upgrade failed: {e}")
+        await anyio.to_thread.run_sync(quality.abandon_upgrade, inputs, "failed")
+    finally:
+        tryon_admission.release()
+        tryon_service.remove_files([*copies, result_image_path])
+
+async def _until_disconnected(request: Request) -> None:
+    # The body has been read, so the next message is the client going away
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _tryon_unless_disconnected(request: Request, form) -> Tuple[dict, int]:
+    """_tryon, cancelled along with its Space call if the client disconnects first."""
+    outcome = ({'error': 'Client closed the request'}, CLIENT_CLOSED_REQUEST)
+    error = None
+    async with anyio.create_task_group() as tg:
+        async def run():
+            nonlocal outcome, error
+            try:
+                outcome = await _tryon(request, form, on_status=lambda update: None)
+            except Exception as e:
+                error = e  # raised below as-is, not wrapped in an ExceptionGroup
+            tg.cancel_scope.cancel()
+
+        async def watch():
+            await _until_disconnected(request)
+            tg.cancel_scope.cancel()
+
+        tg.start_soon(run)
+        tg.start_soon(watch)
+    if error is not None:
+        raise error
+    return outcome
+
+def _stream_tryon(request: Request, form, start: float, held_start: float) -> StreamingResponse:
+    """
+    stream=true: NDJSON status lines while the try-on runs, then a result (or error) line.
+    The try-on runs as its own task, which the stream cancels when the client goes away;
+    that cancels the Space call upstream too. The task releases the admission slot.
+    """
+    updates: asyncio.Queue = asyncio.Queue()
+    trace = slow_requests.current()
+
+    async def run():
+        status = 500
+        try:
+            body, status = await _tryon(request, form,
+                                        on_status=lambda update: updates.put_nowait({'type': 'status', **update}),
+                                        on_preview=updates.put_nowait)
+            updates.put_nowait({'type': 'result', **body} if status == 200 else
+                               {'type': 'error', 'status': status, **body})
+        except asyncio.CancelledError:
+            status = CLIENT_CLOSED_REQUEST
+            raise
+        except Exception as e:
+            print(f"❌ Error during try-on: {e}")
+            updates.put_nowait(tryon_service.stream_error(str(e), 500))
+        finally:
+            updates.put_nowait(None)
+            tryon_admission.release(time.perf_counter() - held_start)
+            duration = time.perf_counter() - start
+            metrics.observe(metrics.HTTP_METRIC, duration, route=TRYON_ROUTE, method=request.method, status=status)
+            slow_requests.end(trace, TRYON_ROUTE, request.method, status, duration)
+            if traffic.wants(TRYON_ROUTE):
+                fields = await anyio.to_thread.run_sync(_capture_fields, request, form)
+                await anyio.to_thread.run_sync(_capture, request, TRYON_ROUTE, status, duration, fields)
+            await form.close()
+
+    task = asyncio.ensure_future(run())
+
+    async def stream():
+        finished = False
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(updates.get(), tryon_service.STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b"\n"  # writing is how a disconnect is noticed
+                    continue
+                if line is None:
+                    finished = True
+                    break
+                yield tryon_service.stream_line(line)
+        finally:
+            # Also runs if the client disconnects mid-stream; a finished task is only recording the request
+            if not finished:
+                task.cancel()
+            # Not gather(): cancelling it would re-cancel the task while it cancels the Space call
+            await asyncio.wait([task])
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson',
+                             headers={'Vary': 'Accept', 'X-Accel-Buffering': 'no'})
+
+async def tryon(request: Request) -> Response:
+    """Async virtual try-on: same contract as the Flask /api/tryon."""
+    if request.method != "POST":
+        return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+    rejected_length = _check_content_length(request)
+    if rejected_length is not None:
+        return rejected_length
+
+    start = time.perf_counter()
+    metrics.begin_request()
+    # The event loop is shared, so only the request's to_thread work is sampled and profiled
+    slow_requests.begin(own_thread=False)
+    form = None
+    try:
+        client_id = admission.client_key(request.headers, request.client.host if request.client else None)
+        # Order lookup is a small SQLite read; keep it off the event loop anyway
+        klass = await _in_thread(scheduler.classify, request.headers, request.cookies)
+        try:
+            with metrics.span("tryon.admission"):
+                await tryon_admission.admit_async(client_id, klass, tryon_eta.predict(expected_tryon()))
+        except admission.Rejected as rejected:
+            # Shed before reading the upload body
+            response = JSONResponse(rejected.body(), status_code=rejected.status,
+                                    headers={'Retry-After': str(rejected.retry_after)})
+        else:
+            held_start = time.perf_counter()
+            streaming = False
+            try:
+                form = await request.form(max_files=4, max_part_size=MAX_UPLOAD_BYTES)
+                if str(form.get('stream', 'false')).lower() == 'true':
+                    # The stream's task releases the slot, records and captures the request and closes the form
+                    streaming = True
+                    return _stream_tryon(request, form, start, held_start)
+                body, status = await _tryon_unless_disconnected(request, form)
+                response = JSONResponse(body, status_code=status, headers={'Vary': 'Accept'})
+            finally:
+                if not streaming:
+                    tryon_admission.release(time.perf_counter() - held_start)
+    except Exception as e:
+        print(f"❌ Error during try-on: {e}")
+        import traceback
+        traceback.print_exc()
+        response = JSONResponse({'error': str(e)}, status_code=500)
+
+    duration = time.perf_counter() - start
+    metrics.observe(metrics.HTTP_METRIC, duration, route=TRYON_ROUTE, method=request.method,
+                    status=response.status_code)
+    slow_requests.end(slow_requests.current(), TRYON_ROUTE, request.method, response.status_code, duration)
+    if form is not None:
+        if traffic.wants(TRYON_ROUTE):
+            fields = await anyio.to_thread.run_sync(_capture_fields, request, form)
+            await anyio.to_thread.run_sync(_capture, request, TRYON_ROUTE, response.status_code, duration, fields,
+                                           len(response.body))
+        await form.close()
+    return response
+
+async def _batch_item(request: Request, index: int, space: space_pool.SpaceHealth, person_ref: str,
+                      garment_path: str, description: str, generate_video: bool, image_format: str,
+                      client_id: str, klass: str, semaphore: asyncio.Semaphore,
+                      inputs: str, requested_tier: str, tier: str, degraded: bool) -> dict:
+    """One garment of a batch: its own admission slot, Space call and encoded result line."""
+    state = request.app.state
+    async with semaphore:
+        hit = await _in_thread(quality.cached, inputs, tier)
+        if hit is not None:
+            served, stored_path = hit
+            response_data = await _in_thread(tryon_service.build_response, stored_path,
+                                             generate_video, image_format, limiter=state.cpu_limiter)
+            return {'type': 'result', 'index': index, **response_data,
+                    **quality.describe(requested_tier, served, degraded and served != quality.BEST_TIER, True)}
+        try:
+            with metrics.span("tryon.admission"):
+                await tryon_admission.acquire_async(client_id, klass, tryon_eta.predict(expected_tryon()))
+        except admission.Rejected as rejected:
+            return {'type': 'error', 'index': index, 'status': rejected.status,
+                    'retry_after': rejected.retry_after, **rejected.body()}
+        held_start = time.perf_counter()
+        result_image_path = None
+        try:
+            with metrics.span("tryon.space_predict"), spaces.use(space):
+                # Only the garment is uploaded: the person was uploaded once for the whole batch
+                tracker = tryon_eta.track(eta.features(space.src, quality.TIERS[tier], garment_path))
+                result_image_path = await state.spaces[space.src].tryon(
+                    None, garment_path, description, tryon_service.OUTPUT_DIR, person_ref=person_ref,
+                    **quality.options(tier))
+            await _in_thread(tracker.finish)
+            stored_path = await _in_thread(quality.store, inputs, tier, result_image_path)
+            result_image_path = None  # moved into the store
+            response_data = await _in_thread(tryon_service.build_response, stored_path,
+                                             generate_video, image_format, limiter=state.cpu_limiter)
+            return {'type': 'result', 'index': index, **response_data,
+                    **quality.describe(requested_tier, tier, degraded, False)}
+        except Exception as e:
+            print(f"❌ Batch try-on {index} failed: {e}")
+            return tryon_service.batch_error(index, str(e))
+        finally:
+            tryon_admission.release(time.perf_counter() - held_start)
+            tryon_service.remove_files([result_image_path])
+
+async def tryon_batch(request: Request) -> Response:
+    """Async /api/tryon/batch: same NDJSON stream contract as the Flask route."""
+    if request.method != "POST":
+        return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+    rejected_length = _check_content_length(request)
+    if rejected_length is not None:
+        return rejected_length
+
+    start = time.perf_counter()
+    metrics.begin_request()
+    slow_requests.begin(own_thread=False)
+    trace = slow_requests.current()
+    state = request.app.state
+    fields = None  # traffic-capture fields, read along with the form
+
+    async def record(status: int, response_bytes: Optional[int] = None) -> None:
+        """Slow-request log and traffic capture, once the batch's work is done."""
+        duration = time.perf_counter() - start
+        slow_requests.end(trace, TRYON_BATCH_ROUTE, request.method, status, duration)
+        if fields is not None:
+            await anyio.to_thread.run_sync(_capture, request, TRYON_BATCH_ROUTE, status, duration, fields,
+                                           response_bytes)
+
+    async def finish(response: Response) -> Response:
+        metrics.observe(metrics.HTTP_METRIC, time.perf_counter() - start, route=TRYON_BATCH_ROUTE,
+                        method=request.method, status=response.status_code)
+        if not isinstance(response, StreamingResponse):
+            await record(response.status_code, len(response.body))  # the stream records itself when done
+        return response
+
+    def rejected_response(rejected: admission.Rejected) -> JSONResponse:
+        return JSONResponse(rejected.body(), status_code=rejected.status,
+                            headers={'Retry-After': str(rejected.retry_after)})
+
+    client_id = admission.client_key(request.headers, request.client.host if request.client else None)
+    klass = await _in_thread(scheduler.classify, request.headers, request.cookies)
+    try:
+        # Shed before reading the upload body: the first garment's token now, the rest once they're counted
+        await tryon_admission.check_rate_async(client_id)
+    except admission.Rejected as rejected:
+        return await finish(rejected_response(rejected))
+
+    form = await request.form(max_files=tryon_service.MAX_BATCH_GARMENTS + 1, max_part_size=MAX_UPLOAD_BYTES)
+    if traffic.wants(TRYON_BATCH_ROUTE):
+        # Read for capture now: the form is closed once the uploads are saved
+        fields = await anyio.to_thread.run_sync(_capture_fields, request, form)
+    person_file = form.get('person_image')
+    garment_files = [value for value in form.getlist('garment_images') if isinstance(value, UploadFile)]
+    descriptions = [str(value) for value in form.getlist('descriptions')]
+    default_description = str(form.get('description', 'Stylish outfit'))
+    generate_video = str(form.get('generate_video', 'false')).lower() == 'true'
+    image_format = image_output.negotiate(request.headers.get('accept'), form.get('output_format'))
+
+    if not isinstance(person_file, UploadFile) or not garment_files:
+        await form.close()
+        return await finish(JSONResponse({'error': 'A person image and at least one garment image are required'},
+                                         status_code=400))
+    try:
+        requested_tier = quality.requested(form.get('quality'))
+    except ValueError as e:
+        await form.close()
+        return await finish(JSONResponse({'error': str(e)}, status_code=400))
+    if len(garment_files) > 1:
+        try:
+            # Every garment is a Space call, so the batch pays one token per garment
+            await tryon_admission.check_rate_async(client_id, cost=len(garment_files) - 1)
+        except admission.Rejected as rejected:
+            await form.close()
+            return await finish(rejected_response(rejected))
+
+    person_path, garment_paths = tryon_service.batch_upload_paths(len(garment_files))
+    cropped_person_path = None
+    try:
+        with metrics.span("tryon.save_uploads"):
+            for upload, path in zip([person_file] + garment_files, [person_path] + garment_paths):
+                await _in_thread(_save_upload, upload, path, limiter=state.cpu_limiter)
+        await form.close()
+        with metrics.span("tryon.ingest"):
+            for path in [person_path] + garment_paths:
+                await _in_thread(image_ingest.prepare_upload, path, limiter=state.cpu_limiter)
+        garment_descriptions = [descriptions[index] if index < len(descriptions) else default_description
+                                for index in range(len(garment_paths))]
+        inputs = [await _in_thread(quality.input_key, person_path, garment_path, description, limiter=state.cpu_limiter)
+                  for garment_path, description in zip(garment_paths, garment_descriptions)]
+        # Crop and upload the person once for the whole batch
+        with metrics.span("tryon.detect_and_crop_person"):
+            cropped_person_path = await _in_thread(detect_and_crop_person, person_path, limiter=state.cpu_limiter)
+        # The uploaded person only exists on that Space, so the whole batch stays on it
+        space = spaces.choose()
+        person_ref = await state.spaces[space.src].upload_input(cropped_person_path)
+    except image_ingest.ImageRejected as rejected:
+        tryon_service.remove_files([person_path, cropped_person_path] + garment_paths)
+        return await finish(JSONResponse({'error': str(rejected)}, status_code=rejected.status))
+    except SpaceError as api_error:
+        tryon_service.remove_files([person_path, cropped_person_path] + garment_paths)
+        body, status = tryon_service.space_error_response(str(api_error)) or ({'error': str(api_error)}, 502)
+        return await finish(JSONResponse(body, status_code=status))
+
+    # One tier for the whole batch; no background upgrades (a batch is already many Space calls)
+    tier, degraded = choose_tier(requested_tier)
+    semaphore = asyncio.Semaphore(tryon_service.BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(_batch_item(request, index, space, person_ref, garment_path, garment_descriptions[index],
+                                          generate_video, image_format, client_id, klass, semaphore,
+                                          inputs[index], requested_tier, tier, degraded))
+        for index, garment_path in enumerate(garment_paths)
+    ]
+
+    async def stream():
+        failed = 0
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=tryon_service.STREAM_KEEPALIVE_SECONDS,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    yield b"\n"
+                for task in done:
+                    line = task.result()
+                    failed += line['type'] == 'error'
+                    yield tryon_service.stream_line(line)
+            yield tryon_service.stream_line({'type': 'done', 'garments': len(tasks), 'failed': failed,
+                                            'elapsed_ms': round((time.perf_counter() - start) * 1000)})
+        finally:
+            # Also runs if the client disconnects mid-stream
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            tryon_service.remove_files([person_path, cropped_person_path] + garment_paths)
+            await record(200)
+
+    return await finish(StreamingResponse(stream(), media_type='application/x-ndjson',
+                                          headers={'Vary': 'Accept', 'X-Accel-Buffering': 'no'}))
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.cpu_limiter = anyio.CapacityLimiter(TRYON_CPU_THREADS)
+    app.state.spaces = {src: AsyncSpaceClient(src, hf_token=HF_TOKEN, timeout=SPACE_TIMEOUT)
+                        for src in spaces.sources}
+    # Background best-tier upgrades in flight (see _schedule_upgrade)
+    app.state.upgrades = set()
+    # Face detection for live AR sessions, batched across them (None without the model files)
+    app.state.ar_detector = await anyio.to_thread.run_sync(ar_stream.load_detector)
+    if app.state.ar_detector is not None:
+        app.state.ar_detector.start()
+    roots = ", ".join(space.root for space in app.state.spaces.values())
+    print(f"🚀 Async try-on bound to {roots} ({TRYON_CPU_THREADS} CPU threads, {WSGI_THREADS} WSGI threads)")
+    try:
+        yield
+    finally:
+        for task in app.state.upgrades:
+            task.cancel()
+        if app.state.upgrades:
+            await asyncio.wait(app.state.upgrades)
+        if app.state.ar_detector is not None:
+            await app.state.ar_detector.aclose()
+        for space in app.state.spaces.values():
+            await space.aclose()
+
+# Flask-CORS only covers the Flask routes, so the async route gets its own (same permissive policy)
+tryon_endpoint = CORSMiddleware(request_response(tryon), allow_origins=["*"], allow_methods=["*"],
+                                allow_headers=["*"])
+tryon_batch_endpoint = CORSMiddleware(request_response(tryon_batch), allow_origins=["*"], allow_methods=["*"],
+                                      allow_headers=["*"])
+
+app = Starlette(
+    routes=[
+        Route(TRYON_ROUTE, tryon_endpoint),
+        Route(TRYON_BATCH_ROUTE, tryon_batch_endpoint),
+        WebSocketRoute(AR_ROUTE, ar_stream.ar_session),
+        Mount("/", WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 7860))
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    print(f"🚀 Starting Verse API (ASGI) on http://0.0.0.0:{port} with {workers} worker(s)")
+    uvicorn.run("asgi_server:app", host='0.0.0.0', port=port, workers=workers, timeout_keep_alive=75)
@@ -0,0 +1,194 @@
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Callable
+
+import anyio
+import httpx
+
+import metrics
+from space_jobs import CANCELLED_METRIC
+
+class SpaceError(Exception):
+    """The Space rejected, failed or timed out a prediction."""
+
+def resolve_space_url(src: str) -> str:
+    """'yisol/IDM-VTON' -> 'https://yisol-idm-vton.hf.space'; full URLs are used as-is."""
+    if src.startswith(("http://", "https://")):
+        return src.rstrip("/")
+    subdomain = src.replace("/", "-").replace("_", "-").replace(".", "-").lower()
+    return f"https://{subdomain}.hf.space"
+
+def _file_data(server_path: str) -> Dict[str, Any]:
+    return {"path": server_path, "meta": {"_type": "gradio.FileData"}}
+
+class AsyncSpaceClient:
+    """
+    Minimal asyncio client for a Gradio Space's REST API (upload, /call/<api> + SSE results).
+    A waiting prediction costs one coroutine and one pooled connection instead of a thread.
+    """
+
+    def __init__(self, src: str, hf_token: str = "", timeout: float = 300.0, connect_timeout: float = 60.0,
+                 max_connections: int = 1000):
+        self.root = resolve_space_url(src)
+        self.timeout = timeout
+        headers = {"Authorization": f"Bearer {hf_token}"} if hf_token else {}
+        # The read timeout only bounds gaps between SSE events; the Space sends heartbeats while queued
+        self.http = httpx.AsyncClient(
+            base_url=self.root, headers=headers, follow_redirects=True,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=64),
+        )
+        self._config: Optional[Dict[str, Any]] = None
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def config(self) -> Dict[str, Any]:
+        """The Space's /config, read once."""
+        if self._config is None:
+            response = await self.http.get("/config")
+            response.raise_for_status()
+            self._config = response.json()
+        return self._config
+
+    async def api_prefix(self) -> str:
+        """'/gradio_api' on Gradio 5+, '' on Gradio 4."""
+        return (await self.config()).get("api_prefix", "")
+
+    async def fn_index(self, api_name: str) -> int:
+        """Index of the named endpoint, which /cancel needs."""
+        name = api_name.lstrip("/")
+        for i, dependency in enumerate((await self.config()).get("dependencies", [])):
+            if dependency.get("api_name") == name:
+                return dependency.get("id", i)
+        raise LookupError(f"The Space has no {api_name} endpoint")
+
+    async def upload(self, paths: List[str]) -> List[str]:
+        """Upload local files to the Space and return their server-side paths."""
+        prefix = await self.api_prefix()
+        files = []
+        for path in paths:
+            data = await anyio.to_thread.run_sync(_read_bytes, path)
+            files.append(("files", (os.path.basename(path), data, "application/octet-stream")))
+        response = await self.http.post(f"{prefix}/upload", files=files)
+        response.raise_for_status()
+        return response.json()
+
+    async def predict(self, api_name: str, data: List[Any]) -> List[Any]:
+        """
+        Queue a call and wait for its 'complete' event; raises SpaceError on 'error'.
+        If the caller is cancelled (client disconnect, timeout) the call is cancelled upstream too.
+        """
+        prefix = await self.api_prefix()
+        endpoint = f"{prefix}/call/{api_name.lstrip('/')}"
+        # Our own session hash, so the call can be cancelled
+        session_hash = uuid.uuid4().hex
+        response = await self.http.post(endpoint, json={"data": data, "session_hash": session_hash})
+        response.raise_for_status()
+        event_id = response.json()["event_id"]
+
+        event = None
+        try:
+            async with self.http.stream("GET", f"{endpoint}/{event_id}") as stream:
+                stream.raise_for_status()
+                async for line in stream.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:") and event in ("complete", "error"):
+                        payload = line[len("data:"):].strip()
+                        if event == "error":
+                            message = json.loads(payload) if payload and payload != "null" else None
+                            raise SpaceError(message or "upstream error: the Space failed without a message")
+                        return json.loads(payload)
+        except anyio.get_cancelled_exc_class():
+            with anyio.CancelScope(shield=True):
+                await self.cancel(api_name, event_id, session_hash)
+            raise
+        raise SpaceError("upstream connection closed before the prediction completed")
+
+    async def cancel(self, api_name: str, event_id: str, session_hash: str) -> None:
+        """Drop a queued call from the Space's queue, or stop it if running (Gradio 4.29+; best effort)."""
+        try:
+            with anyio.fail_after(10):
+                response = await self.http.post(f"{await self.api_prefix()}/cancel", json={
+                    "fn_index": await self.fn_index(api_name),
+                    "session_hash": session_hash,
+                    "event_id": event_id,
+                })
+                response.raise_for_status()
+        except (httpx.HTTPError, TimeoutError, LookupError) as e:
+            print(f"⚠️  Could not cancel Space call {event_id}: {e}")
+        metrics.inc(CANCELLED_METRIC, reason="cancelled")
+
+    async def download(self, file_data: Dict[str, Any], dest_dir: str) -> str:
+        """Stream a result file from the Space into dest_dir and return its local path."""
+        url = file_data.get("url") or f"{await self.api_prefix()}/file={file_data['path']}"
+        ext = os.path.splitext(file_data.get("path") or "")[1] or ".png"
+        dest = os.path.join(dest_dir, f"result_{uuid.uuid4().hex}{ext}")
+        async with self.http.stream("GET", url) as stream:
+            stream.raise_for_status()
+            async with await anyio.open_file(dest, "wb") as f:
+                async for chunk in stream.aiter_bytes():
+                    await f.write(chunk)
+        return dest
+
+    async def upload_input(self, path: str) -> str:
+        """Upload one input ahead of time (e.g. a person photo reused across tryon() calls)."""
+        with self._space_errors():
+            with anyio.fail_after(self.timeout):
+                with metrics.span("space.upload"):
+                    return (await self.upload([path]))[0]
+
+    async def tryon(self, person_path: Optional[str], garment_path: str, description: str, dest_dir: str,
+                    person_ref: Optional[str] = None,
+                    on_status: Optional[Callable[[Dict[str, Any]], None]] = None, **options) -> str:
+        """
+        Run IDM-VTON's /tryon and return the local path of the result image.
+        person_ref is a server path from upload_input(); person_path is then not uploaded again.
+        on_status gets stage updates (the REST API reports no queue position or model progress).
+        """
+        report = on_status or (lambda update: None)
+        with self._space_errors():
+            with anyio.fail_after(self.timeout):
+                report({"stage": "submitting"})
+                with metrics.span("space.upload"):
+                    if person_ref is None:
+                        person_ref, garment = await self.upload([person_path, garment_path])
+                    else:
+                        garment, = await self.upload([garment_path])
+                report({"stage": "processing"})
+                with metrics.span("space.predict"):
+                    outputs = await self.predict("/tryon", [
+                        {"background": _file_data(person_ref), "layers": [], "composite": None},
+                        _file_data(garment),
+                        description,
+                        options["is_checked"],
+                        options["is_checked_crop"],
+                        options["denoise_steps"],
+                        options["seed"],
+                    ])
+                with metrics.span("space.download"):
+                    return await self.download(outputs[0], dest_dir)
+
+    @contextmanager
+    def _space_errors(self):
+        """Translate timeouts and HTTP failures into SpaceError messages tryon_service knows."""
+        try:
+            yield
+        except TimeoutError:
+            raise SpaceError(f"The Space timed out after {self.timeout:.0f}s")
+        except httpx.TimeoutException as e:
+            raise SpaceError(f"Request to the Space timed out: {e}")
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if status == 429:
+                raise SpaceError("quota exceeded or rate limited by the Space")
+            raise SpaceError(f"upstream returned HTTP {status}")
+        except httpx.TransportError as e:
+            raise SpaceError(f"upstream connect error: {e}")
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
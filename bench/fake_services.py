@@ -0,0 +1,149 @@
+"""
+Local stand-ins for the Gemini and Razorpay HTTP APIs.
+
+    python -m bench.fake_services --port 7862 --gemini-latency 0.8 --razorpay-latency 0.15
+
+Point the API server at it with:
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://127.0.0.1:7862
+    RAZORPAY_BASE_URL=http://127.0.0.1:7862
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+GEMINI_PATH = re.compile(r"^/v1(beta)?/models/[^/:]+:generateContent$")
+
+
+class FakeState:
+    def __init__(self, gemini_latency, razorpay_latency, jitter):
+        self.gemini_latency = gemini_latency
+        self.razorpay_latency = razorpay_latency
+        self.jitter = jitter
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.payments = []
+
+    def sleep(self, latency):
+        if latency > 0:
+            time.sleep(latency * random.lognormvariate(0, self.jitter))
+
+    def create_order(self, data):
+        with self.lock:
+            n = next(self.ids)
+            order = {
+                "id": f"order_fake{n:010d}",
+                "entity": "order",
+                "amount": data.get("amount"),
+                "amount_paid": 0,
+                "amount_due": data.get("amount"),
+                "currency": data.get("currency", "INR"),
+                "receipt": data.get("receipt"),
+                "status": "created",
+                "attempts": 0,
+                "notes": data.get("notes", {}),
+                "created_at": int(time.time()),
+            }
+            self.orders[order["id"]] = order
+            # Every order gets a captured payment so reconciliation has data to page through
+            self.payments.append({
+                "id": f"pay_fake{n:010d}",
+                "entity": "payment",
+                "order_id": order["id"],
+                "amount": order["amount"],
+                "currency": order["currency"],
+                "status": "captured",
+                "method": "upi",
+                "created_at": order["created_at"],
+            })
+            return order
+
+
+def make_handler(state: FakeState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+            return json.loads(raw or b"{}")
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self._body()
+            if GEMINI_PATH.match(path):
+                state.sleep(state.gemini_latency)
+                prompt = " ".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+                return self._json(200, {
+                    "candidates": [{
+                        "content": {"role": "model", "parts": [{"text": f"[stub] {len(prompt)} chars of advice."}]},
+                        "finishReason": "STOP",
+                        "index": 0,
+                    }],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": 8},
+                })
+            if path == "/v1/orders":
+                state.sleep(state.razorpay_latency)
+                return self._json(200, state.create_order(body))
+            self._json(404, {"error": {"code": "BAD_REQUEST_ERROR", "description": f"No route {path}"}})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/v1/payments":
+                state.sleep(state.razorpay_latency)
+                q = {k: int(v[0]) for k, v in parse_qs(url.query).items()}
+                start, end = q.get("from", 0), q.get("to", 2 ** 62)
+                skip, count = q.get("skip", 0), q.get("count", 10)
+                with state.lock:
+                    matching = [p for p in state.payments if start <= p["created_at"] <= end]
+                items = matching[skip:skip + count]
+                return self._json(200, {"entity": "collection", "count": len(items), "items": items})
+            self._json(404, {"error": {"code": "BAD_REQUEST_ERROR", "description": f"No route {url.path}"}})
+
+    return Handler
+
+
+def serve(port, gemini_latency=0.8, razorpay_latency=0.15, jitter=0.25):
+    """Start the fake server in a background thread and return it."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(FakeState(gemini_latency, razorpay_latency, jitter)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini + Razorpay APIs for load tests")
+    parser.add_argument("--port", type=int, default=7862)
+    parser.add_argument("--gemini-latency", type=float, default=0.8)
+    parser.add_argument("--razorpay-latency", type=float, default=0.15)
+    parser.add_argument("--jitter", type=float, default=0.25)
+    args = parser.parse_args()
+
+    serve(args.port, args.gemini_latency, args.razorpay_latency, args.jitter)
+    print(f"🧪 Fake Gemini + Razorpay on http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the yisol/IDM-VTON Space.
+
+Exposes a Gradio /tryon endpoint with the same signature as the real Space,
+so api_server.py and app.py talk to it through gradio_client unchanged
+(TRYON_SPACE=http://127.0.0.1:7861). Latency, queue concurrency and cold
+starts are configurable; no GPU work is done.
+
+    python -m bench.fake_space --port 7861 --latency 8 --concurrency 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import gradio as gr
+
+
+class SpaceBehavior:
+    """Latency model: lognormal inference time plus a cold start after idling."""
+
+    def __init__(self, latency, jitter, cold_start, idle_timeout, error_rate, steps_scale):
+        self.latency = latency
+        self.jitter = jitter
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.error_rate = error_rate
+        self.steps_scale = steps_scale
+        self.last_request = 0.0
+        self.lock = threading.Lock()
+
+    def delay(self, denoise_steps):
+        with self.lock:
+            now = time.monotonic()
+            cold = self.cold_start if now - self.last_request > self.idle_timeout else 0.0
+            self.last_request = now
+        # Inference time grows with the number of denoising steps, like the real model
+        base = self.latency * (denoise_steps / 30.0 if self.steps_scale else 1.0)
+        return cold + base * random.lognormvariate(0, self.jitter)
+
+
+def build_app(behavior: SpaceBehavior, concurrency: int):
+    out_dir = tempfile.mkdtemp(prefix="fake_space_")
+
+    # async so that simulated inference holds no thread: --concurrency alone bounds parallelism
+    async def tryon(dict, garm_img, garment_des, is_checked, is_checked_crop, denoise_steps, seed,
+                    progress=gr.Progress()):
+        steps = max(1, int(denoise_steps or 30))
+        delay = behavior.delay(float(steps))
+        try:
+            # Step through "denoising" so clients see progress and cancellation lands mid-inference
+            for step in range(steps):
+                progress((step, steps), desc="Denoising", unit="steps")
+                await asyncio.sleep(delay / steps)
+        except asyncio.CancelledError:
+            print(f"🛑 Try-on cancelled at step {step}/{steps}", flush=True)
+            raise
+        if random.random() < behavior.error_rate:
+            raise gr.Error("upstream connect error or disconnect/reset before headers")
+
+        # Echo the person photo back as the "try-on result"
+        # (the parameter is called "dict" because the real Space's keyword is)
+        person = dict.get("background") if hasattr(dict, "get") else dict
+        result = os.path.join(out_dir, f"result_{time.time_ns()}.png")
+        if person:
+            shutil.copy(person, result)
+        return result, garm_img
+
+    with gr.Blocks() as demo:
+        person = gr.ImageEditor(type="filepath", image_mode="RGB", label="Human")
+        garment = gr.Image(type="filepath", label="Garment")
+        description = gr.Textbox(label="Description")
+        is_checked = gr.Checkbox(value=True)
+        is_checked_crop = gr.Checkbox(value=False)
+        denoise_steps = gr.Number(value=30)
+        seed = gr.Number(value=42)
+        output = gr.Image(type="filepath", label="Output")
+        masked = gr.Image(type="filepath", label="Masked")
+        button = gr.Button("Try-on")
+        button.click(
+            tryon,
+            inputs=[person, garment, description, is_checked, is_checked_crop, denoise_steps, seed],
+            outputs=[output, masked],
+            api_name="tryon",
+            concurrency_limit=concurrency,
+        )
+    return demo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake IDM-VTON Space for load tests")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--latency", type=float, default=8.0, help="median inference seconds at 30 steps")
+    parser.add_argument("--jitter", type=float, default=0.3, help="lognormal sigma of the latency")
+    parser.add_argument("--concurrency", type=int, default=2, help="requests processed at once; the rest queue")
+    parser.add_argument("--cold-start", type=float, default=0.0, help="extra seconds after an idle period")
+    parser.add_argument("--idle-timeout", type=float, default=300.0, help="idle seconds before a cold start")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing upstream")
+    parser.add_argument("--no-steps-scale", action="store_true", help="ignore denoise_steps in the latency model")
+    args = parser.parse_args()
+
+    behavior = SpaceBehavior(args.latency, args.jitter, args.cold_start, args.idle_timeout,
+                             args.error_rate, not args.no_steps_scale)
+    demo = build_app(behavior, args.concurrency)
+    print(f"🧪 Fake IDM-VTON Space on http://127.0.0.1:{args.port} "
+          f"(latency {args.latency}s, concurrency {args.concurrency})")
+    demo.queue(default_concurrency_limit=args.concurrency, max_size=None).launch(
+        server_name="127.0.0.1", server_port=args.port, show_error=True, share=False,
+        max_threads=max(40, args.concurrency)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Concurrent load generator for every /api/* route of the API server.
+
+    # against a running server
+    python -m bench.loadgen --target http://127.0.0.1:7860 --duration 60 --concurrency 32
+
+    # spin up api_server.py with local fakes, run, and save a baseline
+    python -m bench.loadgen --spawn --duration 60 --save-baseline bench/baselines/default.json
+
+    # fail (exit 1) if p95 or throughput regressed more than 20% against the baseline
+    python -m bench.loadgen --spawn --compare bench/baselines/default.json
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from bench.stack import Stack, ASGI_SERVER_CMD, BENCH_RAZORPAY_SECRET, BENCH_WEBHOOK_SECRET
+
+# Relative request mix; try-on dominates real traffic time even if not request count
+DEFAULT_MIX = {
+    "tryon": 4,
+    "create-order": 2,
+    "create-order-online": 2,
+    "create-order-cod": 1,
+    "verify-payment": 2,
+    "webhooks-razorpay": 2,
+    "size-recommend": 2,
+    "style-chat": 2,
+    "track-order": 2,
+    "gemini-chat": 1,
+    "health": 1,
+}
+
+
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """Noise image with a brighter 'torso' block, encoded as JPEG."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    pixels[height // 4: height * 3 // 4, width // 3: width * 2 // 3] //= 2
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class LoadContext:
+    """Payloads and state shared by all workers (e.g. orders to verify)."""
+
+    def __init__(self, razorpay_secret: str, webhook_secret: str, image_size=(768, 1024)):
+        self.razorpay_secret = razorpay_secret
+        self.webhook_secret = webhook_secret
+        self.person = synthetic_jpeg(*image_size, seed=1)
+        self.garment = synthetic_jpeg(512, 512, seed=2)
+        self.order_ids: List[str] = []
+        self.lock = threading.Lock()
+
+    def remember_order(self, response: httpx.Response):
+        if response.status_code == 200:
+            order_id = response.json().get("id")
+            if order_id:
+                with self.lock:
+                    self.order_ids.append(order_id)
+                    del self.order_ids[:-1000]
+
+    def some_order(self) -> str:
+        with self.lock:
+            return random.choice(self.order_ids) if self.order_ids else f"order_missing{random.randint(0, 9999)}"
+
+
+def _cart(n):
+    return [{"id": f"sku_{random.randint(1, 50)}", "qty": 1} for _ in range(n)]
+
+
+def _customer():
+    uid = random.randint(1, 10 ** 6)
+    return {"fullName": f"Load Test {uid}", "email": f"load{uid}@example.com", "phone": f"9{uid:09d}"}
+
+
+def run_route(route: str, http: httpx.Client, ctx: LoadContext) -> httpx.Response:
+    """Issue one request for a route name from the mix."""
+    if route == "tryon":
+        return http.post("/api/tryon", files={
+            "person_image": ("person.jpg", ctx.person, "image/jpeg"),
+            "garment_image": ("garment.jpg", ctx.garment, "image/jpeg"),
+        }, data={"description": "Load test shirt"})
+    if route == "tryon-batch":
+        # Not in the default mix; run with e.g. --mix tryon-batch=1
+        return http.post("/api/tryon/batch", files=[
+            ("person_image", ("person.jpg", ctx.person, "image/jpeg")),
+        ] + [("garment_images", (f"garment{i}.jpg", ctx.garment, "image/jpeg")) for i in range(3)],
+            data={"description": "Load test shirt"})
+    if route == "create-order":
+        response = http.post("/api/create-order", json={"amount": random.randint(500, 5000) * 100})
+        ctx.remember_order(response)
+        return response
+    if route == "create-order-online":
+        response = http.post("/api/create-order-online", json={
+            "amount": random.randint(500, 5000) * 100, "items": _cart(random.randint(1, 4)),
+            "customerDetails": _customer(),
+        })
+        ctx.remember_order(response)
+        return response
+    if route == "create-order-cod":
+        return http.post("/api/create-order-cod", json={
+            "customerDetails": _customer(), "items": _cart(2), "total": 1999
+        })
+    if route == "verify-payment":
+        order_id = ctx.some_order()
+        payment_id = f"pay_load{random.randint(0, 10 ** 9)}"
+        signature = hmac.new(ctx.razorpay_secret.encode(), f"{order_id}|{payment_id}".encode(),
+                             hashlib.sha256).hexdigest()
+        return http.post("/api/verify-payment", json={
+            "razorpay_order_id": order_id, "razorpay_payment_id": payment_id, "razorpay_signature": signature
+        })
+    if route == "webhooks-razorpay":
+        body = json.dumps({
+            "event": "payment.captured",
+            "payload": {"payment": {"entity": {"id": f"pay_wh{random.randint(0, 10 ** 9)}",
+                                               "order_id": ctx.some_order(), "status": "captured"}}},
+        }).encode()
+        signature = hmac.new(ctx.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        return http.post("/api/webhooks/razorpay", content=body, headers={
+            "X-Razorpay-Signature": signature, "X-Razorpay-Event-Id": f"evt_{random.getrandbits(64):x}",
+            "Content-Type": "application/json",
+        })
+    if route == "size-recommend":
+        return http.post("/api/size-recommend", json={
+            "height": random.randint(150, 195), "weight": random.randint(45, 110),
+            "bodyType": random.choice(["slim", "regular", "broad"]), "fitPreference": "regular",
+        })
+    if route == "style-chat":
+        return http.post("/api/style-chat", json={"question": "What goes with a navy linen shirt?",
+                                                  "productContext": {"title": "Linen Shirt", "color": "navy"}})
+    if route == "track-order":
+        return http.post("/api/track-order", json={"orderId": random.choice(["VERSE001", "VERSE002", "VERSE003"])})
+    if route == "gemini-chat":
+        return http.post("/api/gemini-chat", json={"prompt": "Suggest a summer outfit."})
+    if route == "health":
+        return http.get("/api/health")
+    raise ValueError(f"Unknown route {route}")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def run_load(target: str, duration: float, concurrency: int, mix: Dict[str, float], ctx: LoadContext,
+             timeout: float = 330.0) -> Dict[str, Any]:
+    """Closed-loop load: `concurrency` workers issue requests from the mix until time runs out."""
+    routes = list(mix)
+    weights = [mix[r] for r in routes]
+    results: Dict[str, Dict[str, list]] = {r: {"latencies": [], "errors": [], "statuses": []} for r in routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    with httpx.Client(base_url=target, timeout=timeout, limits=limits) as http:
+        def worker():
+            while time.monotonic() < deadline:
+                route = random.choices(routes, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = run_route(route, http, ctx)
+                    status, error = response.status_code, response.status_code >= 500
+                except httpx.HTTPError as e:
+                    status, error = type(e).__name__, True
+                elapsed = time.perf_counter() - start
+                with lock:
+                    bucket = results[route]
+                    bucket["latencies"].append(elapsed)
+                    bucket["statuses"].append(status)
+                    if error:
+                        bucket["errors"].append(status)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.monotonic() - started
+
+    report = {}
+    for route, bucket in results.items():
+        latencies = sorted(bucket["latencies"])
+        if not latencies:
+            continue
+        statuses: Dict[str, int] = {}
+        for s in bucket["statuses"]:
+            statuses[str(s)] = statuses.get(str(s), 0) + 1
+        report[route] = {
+            "requests": len(latencies),
+            "errors": len(bucket["errors"]),
+            "throughput_rps": round(len(latencies) / wall, 3),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "statuses": statuses,
+        }
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {"target": target, "duration": duration, "concurrency": concurrency, "mix": mix},
+        "wall_seconds": round(wall, 2),
+        "total_rps": round(sum(r["requests"] for r in report.values()) / wall, 3),
+        "routes": report,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n📊 {report['total_rps']} req/s over {report['wall_seconds']}s "
+          f"(concurrency {report['config']['concurrency']})")
+    print(f"{'route':<22}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, r in sorted(report["routes"].items()):
+        print(f"{route:<22}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """List regressions: p95 up or throughput down by more than the tolerance."""
+    regressions = []
+    for route, base in baseline.get("routes", {}).items():
+        now = current["routes"].get(route)
+        if not now:
+            continue
+        if base["p95_ms"] > 0 and now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {base['p95_ms']}ms -> {now['p95_ms']}ms")
+        if base["throughput_rps"] > 0 and now["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {base['throughput_rps']} -> {now['throughput_rps']} req/s")
+        if now["errors"] > base["errors"] and now["errors"] / now["requests"] > 0.01:
+            regressions.append(f"{route}: errors {base['errors']} -> {now['errors']}")
+    return regressions
+
+
+def parse_mix(value: Optional[str]) -> Dict[str, float]:
+    """'tryon=5,health=1' -> {'tryon': 5.0, 'health': 1.0}; empty means the default mix."""
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Verse API")
+    parser.add_argument("--target", default="http://127.0.0.1:7860")
+    parser.add_argument("--spawn", action="store_true", help="start api_server.py with local fakes")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", help="route weights, e.g. tryon=5,health=1")
+    parser.add_argument("--space-latency", type=float, default=8.0, help="fake Space latency (with --spawn)")
+    parser.add_argument("--space-concurrency", type=int, default=2, help="fake Space workers (with --spawn)")
+    parser.add_argument("--asgi", action="store_true", help="spawn asgi_server.py under uvicorn (with --spawn)")
+    parser.add_argument("--razorpay-secret", default=BENCH_RAZORPAY_SECRET)
+    parser.add_argument("--webhook-secret", default=BENCH_WEBHOOK_SECRET)
+    parser.add_argument("--save-baseline", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    ctx = LoadContext(args.razorpay_secret, args.webhook_secret)
+    mix = parse_mix(args.mix)
+
+    stack = None
+    target = args.target
+    if args.spawn:
+        stack = Stack(space_latency=args.space_latency, space_concurrency=args.space_concurrency,
+                      server_cmd=ASGI_SERVER_CMD if args.asgi else None).start()
+        target = stack.url
+    try:
+        report = run_load(target, args.duration, args.concurrency, mix, ctx)
+    finally:
+        if stack:
+            stack.stop()
+
+    print_report(report)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            raise SystemExit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Micro-benchmarks for the image and video hot paths in image_ingest.py and image_utils.py.
+
+Each case (function x input resolution) runs in a fresh subprocess so peak RSS
+and allocations are not polluted by earlier cases.
+
+    python -m bench.micro                                  # all functions, all resolutions
+    python -m bench.micro --only crop,background --sizes webcam,12mp --repeat 5
+    python -m bench.micro --fixtures ~/photos              # also run on real photos
+
+    # store a baseline, then fail (exit 1) on >20% wall-time or memory regressions
+    python -m bench.micro --save-baseline bench/baselines/micro.json
+    python -m bench.micro --compare bench/baselines/micro.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {
+    "webcam": (640, 480),
+    "1080p": (1080, 1920),
+    "12mp": (3024, 4032),
+    "48mp": (6000, 8000),
+}
+FUNCTIONS = ["ingest", "crop", "background", "video"]
+FIXTURE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DEFAULT_BASELINE = os.path.join("bench", "baselines", "micro.json")
+
+
+def synthetic_photo(path: str, width: int, height: int, seed: int = 0) -> None:
+    """Noisy background with a darker 'person' silhouette, saved as a quality-90 JPEG."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(90, 200, (height, width, 3), dtype=np.uint8)
+    cx, top = width // 2, height // 6
+    head = max(8, min(width, height) // 10)
+    yy, xx = np.ogrid[:height, :width]
+    pixels[(xx - cx) ** 2 + (yy - top - head) ** 2 < head ** 2] = (180, 150, 130)
+    pixels[top + 2 * head: height * 9 // 10, cx - 2 * head: cx + 2 * head] //= 2
+    Image.fromarray(pixels).save(path, format="JPEG", quality=90)
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Body of the worker subprocess: time one function on one input."""
+    import metrics
+    import artifact_store
+    import image_ingest
+    import image_utils
+
+    work_dir = tempfile.mkdtemp(prefix="verse_micro_")
+    artifact_store.store.root = work_dir
+    try:
+        source = case.get("fixture")
+        if source:
+            image_path = os.path.join(work_dir, "input" + os.path.splitext(source)[1])
+            shutil.copy(source, image_path)
+        else:
+            image_path = os.path.join(work_dir, "input.jpg")
+            synthetic_photo(image_path, case["width"], case["height"])
+        background_path = os.path.join(work_dir, "background.jpg")
+        if case["function"] == "background":
+            with Image.open(image_path) as img:
+                synthetic_photo(background_path, *img.size, seed=1)
+
+        upload_path = os.path.join(work_dir, "upload.jpg")
+
+        def call():
+            if case["function"] == "ingest":
+                # prepare_upload rewrites in place, so each call gets a fresh copy of the upload
+                shutil.copy(image_path, upload_path)
+                out = image_ingest.prepare_upload(upload_path)
+            elif case["function"] == "crop":
+                out = image_utils.detect_and_crop_person(image_path)
+            elif case["function"] == "background":
+                out = image_utils.apply_custom_background(image_path, background_path)
+            else:
+                out = image_utils.create_video_from_image(image_path, duration=case["video_duration"])
+                if out is None:
+                    raise RuntimeError("create_video_from_image failed (see stdout)")
+            if out and out != image_path and os.path.exists(out):
+                os.remove(out)
+
+        # Import the lazily imported codecs up front so they don't count towards the case's RSS
+        import cv2  # noqa: F401
+        import imageio  # noqa: F401
+        baseline_rss = _max_rss_mb()
+        # One untimed warm-up so cascade files and codec plugins are cached
+        call()
+
+        walls, stages = [], {}
+        for _ in range(case["repeat"]):
+            metrics.begin_request()
+            start = time.perf_counter()
+            call()
+            walls.append(time.perf_counter() - start)
+            totals = {}
+            for name, seconds in metrics.request_stages():
+                totals[name] = totals.get(name, 0.0) + seconds
+            for name, seconds in totals.items():
+                stages.setdefault(name, []).append(seconds)
+        peak_rss = _max_rss_mb()
+
+        # Allocation tracing slows everything down, so it gets its own untimed pass
+        tracemalloc.start()
+        call()
+        _, alloc_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            "wall_ms_median": round(statistics.median(walls) * 1000, 2),
+            "wall_ms_min": round(min(walls) * 1000, 2),
+            "peak_rss_mb": round(max(0.0, peak_rss - baseline_rss), 1),
+            "alloc_peak_mb": round(alloc_peak / (1024 * 1024), 1),
+            "stages_ms": {name: round(statistics.median(values) * 1000, 2) for name, values in sorted(stages.items())},
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_case(case: Dict[str, Any], timeout: float = 1800) -> Dict[str, Any]:
+    """Run one case in a fresh interpreter and return its measurements."""
+    proc = subprocess.run(
+        [sys.executable, "-m", "bench.micro", "--worker", json.dumps(case)],
+        cwd=ROOT, capture_output=True, text=True, timeout=timeout,
+    )
+    # The worker prints its result as the last stdout line; image_utils may print before it
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return {"error": (proc.stderr.strip().splitlines() or ["worker failed"])[-1]}
+    return json.loads(lines[-1])
+
+
+def build_cases(functions: List[str], sizes: List[str], fixtures: Optional[str], repeat: int,
+                video_duration: float, video_max_pixels: int) -> List[Dict[str, Any]]:
+    inputs = [(name, {"width": SIZES[name][0], "height": SIZES[name][1]}) for name in sizes]
+    if fixtures:
+        for file in sorted(os.listdir(fixtures)):
+            if file.lower().endswith(FIXTURE_EXTENSIONS):
+                path = os.path.abspath(os.path.join(fixtures, file))
+                with Image.open(path) as img:
+                    width, height = img.size
+                inputs.append((file, {"width": width, "height": height, "fixture": path}))
+
+    cases = []
+    for function in functions:
+        for label, spec in inputs:
+            case = dict(spec, name=f"{function}@{label}", function=function, repeat=repeat,
+                        video_duration=video_duration)
+            # Rendering 30 fps of 48MP frames needs tens of GB, so big inputs are skipped for video
+            if function == "video" and spec["width"] * spec["height"] > video_max_pixels:
+                case["skip"] = f"over --video-max-pixels ({video_max_pixels})"
+            cases.append(case)
+    return cases
+
+
+def run_suite(cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    results = {}
+    for case in cases:
+        if case.get("skip"):
+            print(f"⏭️  {case['name']}: skipped, {case['skip']}")
+            continue
+        print(f"⏱️  {case['name']} ({case['width']}x{case['height']}, {case['repeat']} runs)...")
+        result = run_case(case)
+        result.update({"width": case["width"], "height": case["height"]})
+        results[case["name"]] = result
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cases": results,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n📊 {'case':<28}{'median ms':>12}{'min ms':>10}{'RSS MB':>9}{'alloc MB':>10}")
+    for name, r in report["cases"].items():
+        if "error" in r:
+            print(f"   {name:<28}❌ {r['error']}")
+            continue
+        print(f"   {name:<28}{r['wall_ms_median']:>12.1f}{r['wall_ms_min']:>10.1f}"
+              f"{r['peak_rss_mb']:>9.1f}{r['alloc_peak_mb']:>10.1f}")
+        for stage, ms in r["stages_ms"].items():
+            print(f"      {stage:<25}{ms:>12.1f}")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """List regressions: median wall time or peak memory up by more than the tolerance."""
+    regressions = []
+    for name, base in baseline.get("cases", {}).items():
+        now = current["cases"].get(name)
+        if not now or "error" in base:
+            continue
+        if "error" in now:
+            regressions.append(f"{name}: now failing ({now['error']})")
+            continue
+        for key, unit in (("wall_ms_median", "ms"), ("peak_rss_mb", "MB"), ("alloc_peak_mb", "MB")):
+            # Ignore sub-millisecond / sub-megabyte noise
+            if base[key] >= 1 and now[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {base[key]}{unit} -> {now[key]}{unit}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the image and video helpers")
+    parser.add_argument("--only", default=",".join(FUNCTIONS), help="functions: ingest,crop,background,video")
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"synthetic inputs: {','.join(SIZES)} (empty for none)")
+    parser.add_argument("--fixtures", help="directory of real photos to benchmark as well")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--video-duration", type=float, default=1.0, help="seconds of video per run")
+    parser.add_argument("--video-max-pixels", type=int, default=1080 * 1920)
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="write the report to this JSON file")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_case(json.loads(args.worker))))
+        return
+
+    functions = [f for f in args.only.split(",") if f]
+    sizes = [s for s in args.sizes.split(",") if s]
+    for name in functions:
+        if name not in FUNCTIONS:
+            parser.error(f"unknown function {name!r}")
+    for name in sizes:
+        if name not in SIZES:
+            parser.error(f"unknown size {name!r}")
+
+    cases = build_cases(functions, sizes, args.fixtures, args.repeat, args.video_duration, args.video_max_pixels)
+    report = run_suite(cases)
+    report["config"] = {"repeat": args.repeat, "video_duration": args.video_duration}
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            raise SystemExit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Re-drive captured production traffic (TRAFFIC_CAPTURE=true, see traffic_capture.py).
+
+Requests are sent open-loop at their original inter-arrival gaps, scaled by --speed,
+with payloads rebuilt deterministically from the sanitized records: uploads become
+synthetic JPEGs of the captured dimensions, redacted strings keep their length,
+and Razorpay signatures are recomputed with the bench secrets.
+
+    # against the local fakes, at 4x the captured rate
+    python -m bench.replay logs/traffic.jsonl logs/traffic.jsonl.1 --spawn --speed 4
+
+    # against a running server, saving / comparing a report like bench.loadgen's
+    python -m bench.replay logs/traffic.jsonl --target http://127.0.0.1:7860 --save-baseline bench/baselines/replay.json
+    python -m bench.replay logs/traffic.jsonl --spawn --compare bench/baselines/replay.json
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List
+
+import httpx
+
+from bench.loadgen import synthetic_jpeg, percentile, print_report, compare
+from bench.stack import Stack, ASGI_SERVER_CMD, BENCH_RAZORPAY_SECRET, BENCH_WEBHOOK_SECRET
+from traffic_capture import load_records
+
+WEBHOOK_ROUTE = "/api/webhooks/razorpay"
+VERIFY_ROUTE = "/api/verify-payment"
+DEFAULT_IMAGE_SIZE = (768, 1024)
+
+
+class ReplayContext:
+    """Deterministic stand-ins for captured inputs, cached by content hash."""
+
+    def __init__(self, razorpay_secret: str, webhook_secret: str):
+        self.razorpay_secret = razorpay_secret
+        self.webhook_secret = webhook_secret
+        self.run_id = f"{random.getrandbits(32):08x}"
+        self._images: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def image(self, info: Dict[str, Any]) -> bytes:
+        """Same hash -> same synthetic image, so repeated uploads stay repeated."""
+        key = info.get("sha256") or info["field"]
+        with self._lock:
+            data = self._images.get(key)
+        if data is None:
+            width = info.get("width") or DEFAULT_IMAGE_SIZE[0]
+            height = info.get("height") or DEFAULT_IMAGE_SIZE[1]
+            data = synthetic_jpeg(width, height, seed=int(hashlib.sha256(key.encode()).hexdigest()[:8], 16))
+            with self._lock:
+                self._images[key] = data
+        return data
+
+
+def restore(value: Any, rng: random.Random) -> Any:
+    """Fill redacted values from traffic_capture.sanitize with same-length placeholders."""
+    if isinstance(value, dict):
+        if "$redacted" in value:
+            length = value.get("len", 8)
+            if value["$redacted"] == "int":
+                return int("9" + "".join(rng.choices("0123456789", k=max(0, length - 1))))
+            return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=length))
+        return {k: restore(v, rng) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore(v, rng) for v in value]
+    return value
+
+
+def build_request(record: Dict[str, Any], index: int, ctx: ReplayContext) -> Dict[str, Any]:
+    """httpx.request() keyword arguments that reproduce a captured record."""
+    rng = random.Random(index)
+    route = record["route"]
+    kwargs: Dict[str, Any] = {"method": record["method"], "url": record.get("path") or route, "headers": {}}
+    if record.get("query"):
+        kwargs["params"] = restore(record["query"], rng)
+    if "Idempotency-Key" in record.get("headers", []):
+        kwargs["headers"]["Idempotency-Key"] = f"replay-{ctx.run_id}-{record.get('body_sha256', index)}"[:64]
+
+    if record.get("files"):
+        # A list, not a dict: batch try-ons repeat the garment_images field
+        kwargs["files"] = [
+            (f["field"], (f"{f['field']}{f.get('ext') or '.jpg'}", ctx.image(f), "image/jpeg"))
+            for f in record["files"]
+        ]
+        kwargs["data"] = restore(record.get("form", {}), rng)
+    elif record.get("form"):
+        kwargs["data"] = restore(record["form"], rng)
+    elif "json" in record:
+        payload = restore(record["json"], rng)
+        if route == VERIFY_ROUTE and isinstance(payload, dict):
+            message = f"{payload.get('razorpay_order_id')}|{payload.get('razorpay_payment_id')}"
+            payload["razorpay_signature"] = hmac.new(ctx.razorpay_secret.encode(), message.encode(),
+                                                     hashlib.sha256).hexdigest()
+        if route == WEBHOOK_ROUTE:
+            body = json.dumps(payload).encode()
+            kwargs["content"] = body
+            kwargs["headers"].update({
+                "Content-Type": "application/json",
+                "X-Razorpay-Signature": hmac.new(ctx.webhook_secret.encode(), body, hashlib.sha256).hexdigest(),
+                "X-Razorpay-Event-Id": f"evt_replay_{ctx.run_id}_{index}",
+            })
+        else:
+            kwargs["json"] = payload
+    return kwargs
+
+
+def replayable(record: Dict[str, Any]) -> bool:
+    """False for parameterized routes captured before paths were recorded: there is no URL to send."""
+    return bool(record.get("path")) or "<" not in record["route"]
+
+
+def run_replay(target: str, records: List[Dict[str, Any]], speed: float, concurrency: int, ctx: ReplayContext,
+               timeout: float = 330.0) -> Dict[str, Any]:
+    """Send every record at (captured offset / speed); `concurrency` caps requests in flight."""
+    results: Dict[str, Dict[str, list]] = {}
+    lock = threading.Lock()
+    lag = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    with httpx.Client(base_url=target, timeout=timeout, limits=limits) as http:
+        def send(index, record, due):
+            start = time.perf_counter()
+            try:
+                response = http.request(**build_request(record, index, ctx))
+                status, error = response.status_code, response.status_code >= 500
+            except httpx.HTTPError as e:
+                status, error = type(e).__name__, True
+            elapsed = time.perf_counter() - start
+            with lock:
+                lag.append(max(0.0, start - due))
+                bucket = results.setdefault(record["route"], {"latencies": [], "errors": [], "statuses": [],
+                                                              "captured": []})
+                bucket["latencies"].append(elapsed)
+                bucket["statuses"].append(status)
+                bucket["captured"].append(record.get("duration_ms", 0) / 1000)
+                if error:
+                    bucket["errors"].append(status)
+
+        t0 = records[0]["ts"] if records else 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for index, record in enumerate(records):
+                due = started + (record["ts"] - t0) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, index, record, due)
+        wall = time.perf_counter() - started
+
+    report = {}
+    for route, bucket in results.items():
+        latencies = sorted(bucket["latencies"])
+        captured = sorted(bucket["captured"])
+        statuses: Dict[str, int] = {}
+        for s in bucket["statuses"]:
+            statuses[str(s)] = statuses.get(str(s), 0) + 1
+        report[route] = {
+            "requests": len(latencies),
+            "errors": len(bucket["errors"]),
+            "throughput_rps": round(len(latencies) / wall, 3),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "captured_p95_ms": round(percentile(captured, 0.95) * 1000, 2),
+            "statuses": statuses,
+        }
+    lag.sort()
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {"target": target, "records": len(records), "speed": speed, "concurrency": concurrency},
+        "wall_seconds": round(wall, 2),
+        "total_rps": round(sum(r["requests"] for r in report.values()) / wall, 3) if wall else 0.0,
+        # How late requests left versus their schedule; large values mean --concurrency is the bottleneck
+        "send_lag_p95_ms": round(percentile(lag, 0.95) * 1000, 2),
+        "routes": report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the Verse API")
+    parser.add_argument("captures", nargs="+", help="traffic JSONL files (e.g. logs/traffic.jsonl*)")
+    parser.add_argument("--target", default="http://127.0.0.1:7860")
+    parser.add_argument("--spawn", action="store_true", help="start api_server.py with local fakes")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 2 = twice the captured rate")
+    parser.add_argument("--concurrency", type=int, default=256, help="max requests in flight")
+    parser.add_argument("--limit", type=int, help="only replay the first N records")
+    parser.add_argument("--routes", help="comma-separated routes to keep, e.g. /api/tryon,/api/health")
+    parser.add_argument("--space-latency", type=float, default=8.0, help="fake Space latency (with --spawn)")
+    parser.add_argument("--space-concurrency", type=int, default=2, help="fake Space workers (with --spawn)")
+    parser.add_argument("--asgi", action="store_true", help="spawn asgi_server.py under uvicorn (with --spawn)")
+    parser.add_argument("--razorpay-secret", default=BENCH_RAZORPAY_SECRET)
+    parser.add_argument("--webhook-secret", default=BENCH_WEBHOOK_SECRET)
+    parser.add_argument("--save-baseline", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    records = load_records(args.captures)
+    if args.routes:
+        keep = set(args.routes.split(","))
+        records = [r for r in records if r["route"] in keep]
+    skipped = sum(1 for r in records if not replayable(r))
+    if skipped:
+        print(f"⚠️  Skipping {skipped} records of parameterized routes captured without their path")
+        records = [r for r in records if replayable(r)]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error("no records to replay")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"🔁 Replaying {len(records)} requests captured over {span:.0f}s at {args.speed}x "
+          f"(~{span / args.speed:.0f}s)")
+
+    ctx = ReplayContext(args.razorpay_secret, args.webhook_secret)
+    stack = None
+    target = args.target
+    if args.spawn:
+        stack = Stack(space_latency=args.space_latency, space_concurrency=args.space_concurrency,
+                      server_cmd=ASGI_SERVER_CMD if args.asgi else None).start()
+        target = stack.url
+    try:
+        report = run_replay(target, records, args.speed, args.concurrency, ctx)
+    finally:
+        if stack:
+            stack.stop()
+
+    print_report(report)
+    print(f"   send lag p95: {report['send_lag_p95_ms']}ms")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            raise SystemExit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Launch the API server wired to local fakes (Space, Gemini, Razorpay).
+
+    python -m bench.stack --space-latency 8 --space-concurrency 2
+
+Used by bench.loadgen --spawn and bench.replay --spawn.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Credentials shared by the server and the load generator so signatures verify
+BENCH_RAZORPAY_KEY_ID = "rzp_test_bench"
+BENCH_RAZORPAY_SECRET = "bench_secret"
+BENCH_WEBHOOK_SECRET = "bench_webhook_secret"
+
+# Server commands; {port} is filled in by Stack
+FLASK_SERVER_CMD = [sys.executable, "api_server.py"]
+ASGI_SERVER_CMD = [sys.executable, "-m", "uvicorn", "asgi_server:app", "--port", "{port}", "--workers", "1"]
+
+
+def wait_for_port(port, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class Stack:
+    """Fake Space + fake Gemini/Razorpay + api_server.py as child processes."""
+
+    def __init__(self, api_port=7870, space_port=7871, services_port=7872, space_latency=8.0,
+                 space_concurrency=2, gemini_latency=0.8, razorpay_latency=0.15, server_cmd=None,
+                 extra_env=None):
+        self.api_port = api_port
+        self.space_port = space_port
+        self.services_port = services_port
+        self.space_args = ["--latency", str(space_latency), "--concurrency", str(space_concurrency)]
+        self.services_args = ["--gemini-latency", str(gemini_latency), "--razorpay-latency", str(razorpay_latency)]
+        self.server_cmd = server_cmd or FLASK_SERVER_CMD
+        self.extra_env = extra_env or {}
+        self.processes = []
+        self.data_dir = tempfile.mkdtemp(prefix="verse_bench_")
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.api_port}"
+
+    def _spawn(self, cmd, name, env=None):
+        # Child output goes to <data_dir>/<name>.log for post-mortems
+        log = open(os.path.join(self.data_dir, f"{name}.log"), "w")
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env or os.environ.copy(), stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(proc)
+        return proc
+
+    def start(self):
+        print(f"🧪 Starting fakes and API server (data in {self.data_dir})...")
+        self._spawn([sys.executable, "-m", "bench.fake_space", "--port", str(self.space_port)] + self.space_args,
+                    "fake_space")
+        self._spawn([sys.executable, "-m", "bench.fake_services", "--port", str(self.services_port)] + self.services_args,
+                    "fake_services")
+        wait_for_port(self.space_port)
+        wait_for_port(self.services_port)
+
+        env = os.environ.copy()
+        env.update({
+            "PORT": str(self.api_port),
+            "TRYON_SPACE": f"http://127.0.0.1:{self.space_port}",
+            "GEMINI_API_KEY": "fake",
+            "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{self.services_port}",
+            "RAZORPAY_BASE_URL": f"http://127.0.0.1:{self.services_port}",
+            "RAZORPAY_KEY_ID": BENCH_RAZORPAY_KEY_ID,
+            "RAZORPAY_KEY_SECRET": BENCH_RAZORPAY_SECRET,
+            "RAZORPAY_WEBHOOK_SECRET": BENCH_WEBHOOK_SECRET,
+            "HF_TOKEN": "",
+            "DATA_DIR": self.data_dir,
+        })
+        env.update(self.extra_env)
+        self._spawn([part.format(port=self.api_port) for part in self.server_cmd], "api_server", env=env)
+        wait_for_port(self.api_port)
+        print(f"✅ Stack ready at {self.url}")
+        return self
+
+    def stop(self):
+        for proc in reversed(self.processes):
+            proc.terminate()
+        for proc in self.processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run api_server.py against local fakes")
+    parser.add_argument("--api-port", type=int, default=7870)
+    parser.add_argument("--space-latency", type=float, default=8.0)
+    parser.add_argument("--space-concurrency", type=int, default=2)
+    parser.add_argument("--asgi", action="store_true", help="serve asgi_server.py with uvicorn instead of Flask")
+    args = parser.parse_args()
+
+    with Stack(api_port=args.api_port, space_latency=args.space_latency, space_concurrency=args.space_concurrency,
+               server_cmd=ASGI_SERVER_CMD if args.asgi else None):
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
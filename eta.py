@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, NamedTuple
+
+import numpy as np
+
+import metrics
+import order_store
+
+# Recorded try-ons replayed into the model at startup, and how long they are kept
+ETA_HISTORY_SAMPLES = int(os.getenv("ETA_HISTORY_SAMPLES", "2000"))
+ETA_HISTORY_DAYS = float(os.getenv("ETA_HISTORY_DAYS", "14"))
+
+# Assumed until a Space has history: seconds per try-on, and per job ahead in its queue
+DEFAULT_RUN_SECONDS = 20.0
+DEFAULT_POSITION_SECONDS = 20.0
+# A Space uses its own model after this many samples, the pooled one before that
+MIN_SPACE_SAMPLES = 5
+# Weight of past samples per new one; ~50 samples of memory, so the model follows a Space that slows down
+FORGETTING = 0.98
+EWMA_ALPHA = 0.1
+REFERENCE_STEPS = 30
+# Progress-based extrapolation is too noisy below this fraction done
+MIN_PROGRESS = 0.1
+ERROR_METRIC = "verse_eta_error_seconds"
+POOLED = "*"
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS tryon_latencies (
+    recorded_at REAL NOT NULL,
+    space TEXT NOT NULL,
+    denoise_steps INTEGER NOT NULL,
+    upload_mb REAL,
+    hour INTEGER NOT NULL,
+    queue_position INTEGER NOT NULL,
+    queue_seconds REAL NOT NULL,
+    total_seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_latencies_recorded ON tryon_latencies(recorded_at);
+""")
+
+
+class Features(NamedTuple):
+    """What a try-on's latency depends on, besides the queue ahead of it."""
+    space: str
+    steps: int
+    upload_mb: Optional[float]  # None before the inputs are known (e.g. at admission)
+    hour: int
+
+
+def features(space: str, steps: int, *upload_paths: Optional[str], now: Optional[float] = None) -> Features:
+    """Features of a try-on sending upload_paths to the Space (none given: size unknown)."""
+    upload_mb = None
+    paths = [p for p in upload_paths if p]
+    if paths:
+        try:
+            upload_mb = sum(os.path.getsize(p) for p in paths) / (1024 * 1024)
+        except OSError:
+            pass
+    return Features(space, int(steps), upload_mb, time.localtime(now).tm_hour)
+
+
+class _Regression:
+    """Recursive least squares with forgetting: seconds ~ a + b * steps + c * upload MB."""
+
+    def __init__(self):
+        self.theta = np.array([DEFAULT_RUN_SECONDS, 0.0, 0.0])
+        self.P = np.eye(3) * 100.0
+        self.samples = 0
+        self.upload_mb = 0.0  # running mean, standing in for unknown sizes
+
+    def _x(self, steps: int, upload_mb: Optional[float]) -> np.ndarray:
+        return np.array([1.0, steps / REFERENCE_STEPS, self.upload_mb if upload_mb is None else upload_mb])
+
+    def predict(self, steps: int, upload_mb: Optional[float]) -> float:
+        return float(self.theta @ self._x(steps, upload_mb))
+
+    def update(self, steps: int, upload_mb: Optional[float], seconds: float) -> None:
+        x = self._x(steps, upload_mb)
+        px = self.P @ x
+        gain = px / (FORGETTING + x @ px)
+        self.theta = self.theta + gain * (seconds - self.theta @ x)
+        self.P = (self.P - np.outer(gain, px)) / FORGETTING
+        # Inputs that never vary (same steps every call) would otherwise let P grow without bound
+        trace = np.trace(self.P)
+        if trace > 1e4:
+            self.P *= 1e4 / trace
+        self.samples += 1
+        if upload_mb is not None:
+            self.upload_mb += (upload_mb - self.upload_mb) / min(self.samples, 50)
+
+
+class EtaEstimator:
+    """
+    Predicts try-on latency from recorded ones. Per Space, a regression on denoise steps and
+    upload size gives the run time, scaled by a learned time-of-day factor; each job ahead in
+    the Space's own queue adds an EWMA of the observed wait per position. Samples are kept in
+    SQLite so a restarted server starts from what it learned.
+    """
+
+    def __init__(self, persist: bool = True):
+        self.persist = persist
+        self.samples = 0
+        self._models: Dict[str, _Regression] = {POOLED: _Regression()}
+        self._position_seconds: Dict[str, float] = {}
+        self._hour_factors = [1.0] * 24
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Replay recent history into the model (and drop expired rows); returns the samples loaded."""
+        if not self.persist:
+            return 0
+        conn = order_store.get_connection()
+        conn.execute("DELETE FROM tryon_latencies WHERE recorded_at < ?",
+                     (time.time() - ETA_HISTORY_DAYS * 86400,))
+        rows = conn.execute("SELECT * FROM tryon_latencies ORDER BY recorded_at DESC LIMIT ?",
+                            (ETA_HISTORY_SAMPLES,)).fetchall()
+        for row in reversed(rows):
+            self._learn(Features(row["space"], row["denoise_steps"], row["upload_mb"], row["hour"]),
+                        row["queue_position"], row["queue_seconds"], row["total_seconds"])
+        return len(rows)
+
+    def _model(self, space: str) -> _Regression:
+        model = self._models.get(space)
+        return model if model is not None and model.samples >= MIN_SPACE_SAMPLES else self._models[POOLED]
+
+    def run_seconds(self, f: Features) -> float:
+        """Submit to finish, not counting time in the Space's queue."""
+        with self._lock:
+            base = self._model(f.space).predict(f.steps, f.upload_mb)
+            return max(1.0, base * self._hour_factors[f.hour])
+
+    def queue_seconds(self, space: str, position: int) -> float:
+        """Expected wait behind `position` jobs in the Space's queue."""
+        with self._lock:
+            return position * self._position_seconds.get(space, DEFAULT_POSITION_SECONDS)
+
+    def predict(self, f: Features, queue_position: int = 0) -> float:
+        """Seconds from submitting to the Space until the result is back."""
+        return self.run_seconds(f) + (self.queue_seconds(f.space, queue_position) if queue_position else 0.0)
+
+    def estimate(self, f: Features, now: Optional[float] = None) -> Dict[str, Any]:
+        """Status fields for a try-on not yet submitted: remaining seconds and completion time."""
+        return _eta_fields(self.predict(f), now or time.time())
+
+    def record(self, f: Features, queue_position: int, queue_seconds: float, total_seconds: float) -> None:
+        """Learn from a finished try-on and keep it for the next restart."""
+        self._learn(f, queue_position, queue_seconds, total_seconds)
+        if self.persist:
+            order_store.get_connection().execute(
+                "INSERT INTO tryon_latencies (recorded_at, space, denoise_steps, upload_mb, hour, "
+                "queue_position, queue_seconds, total_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), f.space, f.steps, f.upload_mb, f.hour, queue_position,
+                 round(queue_seconds, 3), round(total_seconds, 3))
+            )
+
+    def _learn(self, f: Features, queue_position: int, queue_seconds: float, total_seconds: float) -> None:
+        run = max(0.1, total_seconds - queue_seconds)
+        with self._lock:
+            # The hour factor explains what the regression doesn't; the regression sees hour-neutral times
+            base = self._model(f.space).predict(f.steps, f.upload_mb)
+            if base > 0:
+                ratio = min(4.0, max(0.25, run / base))
+                self._hour_factors[f.hour] += EWMA_ALPHA * (ratio - self._hour_factors[f.hour])
+            neutral = run / self._hour_factors[f.hour]
+            self._models.setdefault(f.space, _Regression()).update(f.steps, f.upload_mb, neutral)
+            if f.space != POOLED:
+                self._models[POOLED].update(f.steps, f.upload_mb, neutral)
+            if queue_position > 0:
+                per_position = queue_seconds / queue_position
+                previous = self._position_seconds.get(f.space)
+                self._position_seconds[f.space] = (per_position if previous is None
+                                                   else previous + EWMA_ALPHA * (per_position - previous))
+            self.samples += 1
+
+    def track(self, f: Features) -> "JobEta":
+        """Start timing a try-on that is being submitted now."""
+        return JobEta(self, f)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            spaces = {
+                space: {"samples": model.samples,
+                        "coefficients": {"base": round(float(model.theta[0]), 2),
+                                         "per_reference_steps": round(float(model.theta[1]), 2),
+                                         "per_upload_mb": round(float(model.theta[2]), 2)},
+                        "queue_seconds_per_position": round(self._position_seconds.get(space, DEFAULT_POSITION_SECONDS), 2)}
+                for space, model in self._models.items()
+            }
+            hour_factors = [round(factor, 2) for factor in self._hour_factors]
+        return {"samples": self.samples, "spaces": spaces, "hour_factors": hour_factors}
+
+
+def _eta_fields(remaining: float, now: float) -> Dict[str, Any]:
+    return {"eta": round(remaining), "completes_at": round(now + remaining, 1)}
+
+
+class JobEta:
+    """
+    One try-on's timeline: adds "eta" (seconds left) and "completes_at" (Unix time) to its
+    status updates (see space_jobs.describe) and records its latency once it succeeds.
+    """
+
+    def __init__(self, estimator: EtaEstimator, f: Features):
+        self.estimator = estimator
+        self.features = f
+        self.submitted = time.time()
+        self.predicted = estimator.predict(f)
+        self.queue_position = 0
+        self.queued_at: Optional[float] = None
+        self.processing_at: Optional[float] = None
+        self.finished = False
+
+    def _queue_seconds(self, now: float) -> float:
+        if self.queued_at is None:
+            return 0.0
+        return (self.processing_at or now) - self.queued_at
+
+    def observe(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        stage = update.get("stage")
+        run = self.estimator.run_seconds(self.features)
+        if stage == "queued":
+            if self.queued_at is None:
+                self.queued_at = now
+            position = update.get("queue_position") or 0
+            self.queue_position = max(self.queue_position, position)
+            if position:
+                queue = self.estimator.queue_seconds(self.features.space, position)
+            else:
+                queue = update.get("eta") or 0.0  # the Space's own estimate
+            remaining = queue + run
+        elif stage == "processing":
+            if self.processing_at is None:
+                self.processing_at = now
+            progress = update.get("progress")
+            if progress is not None and progress >= MIN_PROGRESS:
+                elapsed = now - self.processing_at
+                remaining = elapsed * (1 - progress) / progress
+            else:
+                remaining = run - (now - self.submitted - self._queue_seconds(now))
+        else:
+            remaining = run - (now - self.submitted)
+        return {**update, **_eta_fields(max(1.0, remaining), now)}
+
+    def finish(self) -> None:
+        """Record the try-on's latency (once; call only when it succeeded)."""
+        if self.finished:
+            return
+        self.finished = True
+        now = time.time()
+        total = now - self.submitted
+        metrics.observe(ERROR_METRIC, abs(total - self.predicted), space=self.features.space)
+        try:
+            self.estimator.record(self.features, self.queue_position, self._queue_seconds(now), total)
+        except Exception as e:
+            print(f"⚠️  Could not record try-on latency: {e}")
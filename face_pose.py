@@ -0,0 +1,163 @@
+import os
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Head pose from a face box (res10 SSD detector, box-estimated landmarks, solvePnP), shared by
+# the webcam demo (legacy/main.py) and the AR WebSocket endpoint (ar_stream.py).
+# OpenCV DNN face detector files (see legacy/main.py for where to get them)
+FACE_PROTOTXT = os.getenv("AR_FACE_PROTOTXT", "deploy.prototxt")
+FACE_MODEL = os.getenv("AR_FACE_MODEL", "res10_300x300_ssd_iter_140000.caffemodel")
+CONFIDENCE_THRESHOLD = float(os.getenv("AR_FACE_CONFIDENCE", "0.7"))
+# The model expects 300x300 BGR blobs with this mean subtracted
+DNN_INPUT_SIZE = (300, 300)
+DNN_MEAN = (104.0, 177.0, 123.0)
+
+Box = Tuple[int, int, int, int]  # startX, startY, endX, endY in pixels
+
+# Canonical face point coordinates (normalized to a 1x1 face box)
+# We estimate nose, chin, eye corners, and mouth corners.
+CANONICAL_FACE_POINTS = np.array([
+    (0.50, 0.40, 0.0),  # Nose Tip (center)
+    (0.50, 0.90, -0.1), # Chin
+    (0.20, 0.25, 0.0),  # Left Eye Corner
+    (0.80, 0.25, 0.0),  # Right Eye Corner
+    (0.30, 0.70, 0.0),  # Left Mouth Corner
+    (0.70, 0.70, 0.0)   # Right Mouth Corner
+], dtype=np.float32)
+
+# Convert normalized coordinates to arbitrary 3D model space (e.g., mm)
+# The virtual object coordinates must align with this scale.
+# We choose a scale factor and shift the origin to the Nose Tip.
+SCALE_FACTOR = 80.0
+# The 3D model is shifted so the nose tip (index 0) is at (0, 0, 0)
+MODEL_3D_POINTS = CANONICAL_FACE_POINTS * SCALE_FACTOR
+MODEL_3D_POINTS -= MODEL_3D_POINTS[0]
+
+# Define the 3D points of the virtual item (a simple wireframe glasses frame).
+# These points are defined relative to the Nose Tip origin (0,0,0) established above.
+VIRTUAL_OBJECT_3D_POINTS = np.array([
+    # Points defining the frame shape (left lens area)
+    [-45.0, -45.0, 5.0],  # 0: Top-Left
+    [-15.0, -45.0, 5.0],  # 1: Top-Right
+    [-15.0, -65.0, 5.0],  # 2: Bottom-Right
+    [-45.0, -65.0, 5.0],  # 3: Bottom-Left
+
+    # Points defining the right lens area
+    [ 15.0, -45.0, 5.0],  # 4: Top-Left
+    [ 45.0, -45.0, 5.0],  # 5: Top-Right
+    [ 45.0, -65.0, 5.0],  # 6: Bottom-Right
+    [ 15.0, -65.0, 5.0],  # 7: Bottom-Left
+
+    # Connecting bridge
+    [-15.0, -55.0, 5.0],  # 8: Bridge Left
+    [ 15.0, -55.0, 5.0]   # 9: Bridge Right
+], dtype=np.float32)
+
+# Define how the virtual object points are connected (wireframe/lines)
+VIRTUAL_OBJECT_CONNECTIONS = [
+    (0, 1), (1, 2), (2, 3), (3, 0),  # Left Lens Outline
+    (4, 5), (5, 6), (6, 7), (7, 4),  # Right Lens Outline
+    (8, 9)                           # Bridge Connection
+]
+
+
+def load_net(prototxt: str = FACE_PROTOTXT, model: str = FACE_MODEL):
+    """The res10 SSD face detector, or None if its files can't be loaded."""
+    try:
+        return cv2.dnn.readNetFromCaffe(prototxt, model)
+    except Exception as e:
+        print(f"⚠️  Could not load face detector ({prototxt}, {model}): {e}")
+        return None
+
+
+@lru_cache(maxsize=8)
+def get_camera_matrix(width: int, height: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Estimates a simple camera intrinsic matrix.
+    Cached per resolution: it only changes if the camera does. Callers must not modify the arrays.
+    """
+    focal_length = width
+    center = (width / 2, height / 2)
+    camera_matrix = np.array(
+        [[focal_length, 0, center[0]],
+         [0, focal_length, center[1]],
+         [0, 0, 1]], dtype="double"
+    )
+    dist_coeffs = np.zeros((4, 1))
+    return camera_matrix, dist_coeffs
+
+
+def detect_faces(net, images: Sequence[np.ndarray], threshold: float = CONFIDENCE_THRESHOLD) -> List[Optional[Box]]:
+    """
+    The most confident face box in each image (None where there is none above threshold),
+    from one forward pass over all of them.
+    """
+    if not images:
+        return []
+    # blobFromImages resizes each image in the same pass
+    blob = cv2.dnn.blobFromImages(list(images), 1.0, DNN_INPUT_SIZE, DNN_MEAN)
+    net.setInput(blob)
+    detections = net.forward().reshape(-1, 7)  # rows of [image index, class, confidence, x1, y1, x2, y2]
+    boxes: List[Optional[Box]] = []
+    for i, image in enumerate(images):
+        rows = detections[(detections[:, 0] == i) & (detections[:, 2] > threshold)]
+        if len(rows) == 0:
+            boxes.append(None)
+            continue
+        h, w = image.shape[:2]
+        best = rows[np.argmax(rows[:, 2])]
+        startX, startY, endX, endY = (best[3:7] * np.array([w, h, w, h])).astype("int")
+        box = (max(0, int(startX)), max(0, int(startY)), min(w - 1, int(endX)), min(h - 1, int(endY)))
+        # A box squeezed to nothing by the frame edge gives PnP nothing to work with
+        boxes.append(box if box[2] > box[0] and box[3] > box[1] else None)
+    return boxes
+
+
+def landmarks_from_box(startX: float, startY: float, endX: float, endY: float) -> np.ndarray:
+    """
+    Estimates the 6 PnP 2D points from a face bounding box (pixels).
+    This is an approximation for head tracking when detailed landmarks are unavailable.
+    """
+    face_w = endX - startX
+    face_h = endY - startY
+
+    # Order matches MODEL_3D_POINTS: Nose, Chin, Left Eye, Right Eye, Left Mouth, Right Mouth
+    image_points_2d = [(startX + nx * face_w, startY + ny * face_h) for (nx, ny, _) in CANONICAL_FACE_POINTS]
+    return np.array(image_points_2d, dtype="double")
+
+
+def estimate_face_landmarks_from_box(detection: np.ndarray, w: int, h: int) -> np.ndarray:
+    """
+    Estimates the 6 PnP 2D points based on a raw DNN detection row (as from net.forward()).
+    """
+    box = detection[0, 0, 0, 3:7] * np.array([w, h, w, h])
+    (startX, startY, endX, endY) = box.astype("int")
+    return landmarks_from_box(startX, startY, endX, endY)
+
+
+def solve_pose(image_points_2d: np.ndarray, width: int, height: int,
+               guess: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(rvec, tvec) of the face model, starting from the previous frame's pose if given; None if PnP fails."""
+    camera_matrix, dist_coeffs = get_camera_matrix(width, height)
+    if guess is None:
+        # The model is nearly planar, which throws the iterative solver's own initialisation off
+        # (hundreds of pixels of reprojection error); EPnP gives it a sound starting pose
+        success, rvec, tvec = cv2.solvePnP(MODEL_3D_POINTS, image_points_2d, camera_matrix, dist_coeffs,
+                                           flags=cv2.SOLVEPNP_EPNP)
+        if not success:
+            return None
+        guess = (rvec, tvec)
+    success, rvec, tvec = cv2.solvePnP(MODEL_3D_POINTS, image_points_2d, camera_matrix, dist_coeffs,
+                                       guess[0].copy(), guess[1].copy(), useExtrinsicGuess=True,
+                                       flags=cv2.SOLVEPNP_ITERATIVE)
+    return (rvec, tvec) if success else None
+
+
+def project(model_points_3d: np.ndarray, pose: Tuple[np.ndarray, np.ndarray], width: int, height: int) -> np.ndarray:
+    """Image coordinates (N x 2, float) of 3D model points seen from pose."""
+    camera_matrix, dist_coeffs = get_camera_matrix(width, height)
+    image_points_2d, _ = cv2.projectPoints(model_points_3d, pose[0], pose[1], camera_matrix, dist_coeffs)
+    return image_points_2d.reshape(-1, 2)
@@ -2,12 +2,19 @@ import google.generativeai as genai
 import os
 from typing import Optional, Dict, Any
 import json
+import metrics
 
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Alternative API endpoint, e.g. http://127.0.0.1:7862 for the stub in bench/fake_services.py
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
 
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                        client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
     model = genai.GenerativeModel('gemini-pro')
 else:
     model = None
@@ -32,7 +39,8 @@ def call_gemini(prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[s
             full_prompt = f"Context: {json.dumps(context)}\n\n{prompt}"
         
         # Generate response
-        response = model.generate_content(full_prompt)
+        with metrics.span("gemini.generate_content"):
+            response = model.generate_content(full_prompt)
         
         return {
             "response": response.text,
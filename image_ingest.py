@@ -0,0 +1,102 @@
+import os
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+import metrics
+
+# Longest side uploads are decoded to. The Space works at 768x1024, and the person crop
+# needs some headroom above that.
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", "1536"))
+# Decompression-bomb guards, checked against the header before any pixels are decoded
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(64 * 1000 * 1000)))
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "16384"))
+JPEG_QUALITY = 92
+
+# MPO is the multi-frame JPEG some phone cameras write
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+JPEG_FORMATS = {"JPEG", "MPO"}
+EXIF_ORIENTATION = 0x0112
+
+# PIL's own guard (warns above the limit, raises above twice it) backs up ours
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageRejected(ValueError):
+    """Upload is not an image we will decode; carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def probe(path: str) -> Tuple[int, int, str]:
+    """(width, height, format) from the file header only. Raises ImageRejected."""
+    try:
+        with Image.open(path) as img:
+            width, height, fmt = img.width, img.height, img.format
+    except Image.DecompressionBombError:
+        raise ImageRejected(f"Image is too large (max {MAX_IMAGE_PIXELS // 1000000} megapixels)", 413)
+    except (OSError, SyntaxError, ValueError):
+        raise ImageRejected("Could not read image: upload a JPEG, PNG or WebP file", 400)
+    if fmt not in ALLOWED_FORMATS:
+        raise ImageRejected(f"Unsupported image format {fmt}: upload a JPEG, PNG or WebP file", 415)
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE or width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image is too large ({width}x{height}, max {MAX_IMAGE_PIXELS // 1000000} "
+                            f"megapixels and {MAX_IMAGE_SIDE}px per side)", 413)
+    return width, height, fmt
+
+
+def load(path: str, max_side: int = INGEST_MAX_SIDE) -> Image.Image:
+    """
+    Decode an image upright, in RGB, with its longest side at most max_side.
+    JPEGs are decoded at reduced resolution (1/2, 1/4 or 1/8 DCT scaling), so a 48MP
+    photo never exists in memory at full size.
+    """
+    width, height, fmt = probe(path)
+    with Image.open(path) as src:
+        with metrics.span("ingest.decode"):
+            orientation = src.getexif().get(EXIF_ORIENTATION, 1)
+            scale = max(width, height) / max_side
+            if fmt in JPEG_FORMATS and scale >= 2:
+                # draft() picks the largest reduction that keeps at least the requested size
+                src.draft("RGB", (int(width / scale), int(height / scale)))
+            src.load()
+        with metrics.span("ingest.resize"):
+            img = src
+            if max(img.size) > max_side:
+                img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            if orientation != 1:
+                # Applied once, after the resize; the result carries no orientation tag
+                img = ImageOps.exif_transpose(img)
+            img = _flatten(img)
+            # Detach from the file, which the with-block closes
+            return img.copy() if img is src else img
+
+def prepare_upload(path: str, max_side: int = INGEST_MAX_SIDE) -> str:
+    """
+    Validate an uploaded image and rewrite it in place as an upright JPEG at working size.
+    Files that are already small, upright JPEGs are left untouched. Raises ImageRejected.
+    """
+    width, height, fmt = probe(path)
+    if fmt in JPEG_FORMATS and max(width, height) <= max_side:
+        with Image.open(path) as img:
+            if img.getexif().get(EXIF_ORIENTATION, 1) == 1:
+                return path
+    img = load(path, max_side)
+    with metrics.span("ingest.encode"):
+        img.save(path, format="JPEG", quality=JPEG_QUALITY)
+    return path
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB copy, with any transparency composited onto white (product shots are on white)."""
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
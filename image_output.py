@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+from PIL import Image
+
+import metrics
+
+# Encoder settings for try-on results; tuned for photos of people at ~768x1024
+WEBP_QUALITY = int(os.getenv("OUTPUT_WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.getenv("OUTPUT_JPEG_QUALITY", "85"))
+# Memory for encoded variants, shared by all results in the process (0 disables caching)
+VARIANT_CACHE_MB = float(os.getenv("VARIANT_CACHE_MB", "64"))
+
+FORMATS = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+# Without a usable Accept header, JPEG is the smallest format every client decodes
+DEFAULT_FORMAT = "jpeg"
+BYTES_METRIC = "verse_tryon_image_bytes_total"
+CACHE_METRIC = "verse_image_variant_cache_total"
+
+
+def negotiate(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    Pick the result encoding: an explicit output_format wins, otherwise the most
+    preferred of WebP/JPEG/PNG in the Accept header. Wildcards never select PNG.
+    """
+    if requested:
+        requested = requested.strip().lower().replace("jpg", "jpeg")
+        if requested in FORMATS:
+            return requested
+    best, best_q = DEFAULT_FORMAT, 0.0
+    # Ties go to the smaller encoding
+    preference = {"webp": 3, "jpeg": 2, "png": 1}
+    for part in (accept or "").split(","):
+        media, _, params = part.strip().partition(";")
+        media = media.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        fmt = next((f for f, mime in FORMATS.items() if mime == media), None)
+        if fmt is None or q <= 0:
+            continue
+        if q > best_q or (q == best_q and preference[fmt] > preference[best]):
+            best, best_q = fmt, q
+    return best
+
+
+class VariantCache:
+    """LRU of encoded results keyed by (content hash, format), bounded by total bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        metrics.inc(CACHE_METRIC, result="hit" if data is not None else "miss")
+        return data
+
+    def put(self, key: Tuple[str, str], data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+variants = VariantCache(int(VARIANT_CACHE_MB * 1024 * 1024))
+metrics.register_gauge("verse_image_variant_cache_bytes", lambda: {(): variants.bytes},
+                       "Bytes held by the encoded image variant cache")
+
+
+def encode(path: str, fmt: str) -> Tuple[bytes, str]:
+    """Encode the image at path as fmt ('webp', 'jpeg' or 'png'); returns (bytes, MIME type)."""
+    with open(path, "rb") as f:
+        source = f.read()
+    key = (hashlib.sha256(source).hexdigest(), fmt)
+    data = variants.get(key)
+    if data is None:
+        with metrics.span(f"output.encode_{fmt}"):
+            data = _encode(source, fmt)
+        variants.put(key, data)
+    metrics.inc(BYTES_METRIC, len(data), format=fmt)
+    return data, FORMATS[fmt]
+
+
+def _encode(source: bytes, fmt: str) -> bytes:
+    with Image.open(io.BytesIO(source)) as img:
+        if fmt == "png" and img.format == "PNG":
+            return source
+        img.load()
+        out = io.BytesIO()
+        if fmt == "webp":
+            has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+            img.convert("RGBA" if has_alpha else "RGB").save(out, format="WEBP", quality=WEBP_QUALITY, method=4)
+        elif fmt == "jpeg":
+            img.convert("RGB").save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            img.save(out, format="PNG", optimize=False)
+        return out.getvalue()
@@ -0,0 +1,318 @@
+import os
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageEnhance
+
+import artifact_store
+import image_ingest
+import metrics
+
+# Longest side the local overlay preview is drawn at; small enough to render in well under 100ms
+PREVIEW_MAX_SIDE = int(os.getenv("TRYON_PREVIEW_MAX_SIDE", "512"))
+
+Point = Tuple[float, float]
+
+class PersonCrop(NamedTuple):
+    path: str
+    # Estimated torso in the cropped image's pixels: left shoulder, right shoulder, right hip, left hip
+    torso: Optional[Tuple[Point, Point, Point, Point]] = None
+
+def _torso(center_x, shoulder_y, hip_y, shoulder_half, hip_half, width, height):
+    hip_y = min(hip_y, height - 1)
+    def clamp(x):
+        return float(min(max(x, 0), width - 1))
+    return ((clamp(center_x - shoulder_half), float(shoulder_y)), (clamp(center_x + shoulder_half), float(shoulder_y)),
+            (clamp(center_x + hip_half), float(hip_y)), (clamp(center_x - hip_half), float(hip_y)))
+
+def detect_and_crop_person(image_path):
+    """
+    Detect person in image and crop to show only the person.
+    Returns path to cropped image, or original if no person detected.
+    """
+    return locate_and_crop_person(image_path).path
+
+def locate_and_crop_person(image_path):
+    """
+    detect_and_crop_person, also returning where the torso is in the cropped image (PersonCrop).
+    Uses OpenCV face detection and estimates body area; the torso is None if no person was found.
+    """
+    try:
+        import cv2
+        
+        # Read image, decoded straight to working size and upright
+        try:
+            with metrics.span("crop.decode"):
+                img = cv2.cvtColor(np.asarray(image_ingest.load(image_path)), cv2.COLOR_RGB2BGR)
+        except image_ingest.ImageRejected as e:
+            print(f"⚠️  Could not read image ({e}), using original")
+            return PersonCrop(image_path)
+        
+        height, width = img.shape[:2]
+        
+        # Try face detection first (most reliable for person photos)
+        with metrics.span("crop.load_cascade"):
+            face_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            )
+        
+        with metrics.span("crop.detect_face"):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        
+        if len(faces) > 0:
+            # Found face(s) - use the largest one
+            largest_face = max(faces, key=lambda f: f[2] * f[3])
+            x, y, w, h = largest_face
+            
+            print(f"✅ Detected face at ({x}, {y}) with size {w}x{h}")
+            
+            # Expand crop to include full body
+            # Assume body is ~3-4x face height, centered on face
+            body_height = h * 4
+            body_width = w * 2.5
+            
+            # Calculate crop coordinates
+            center_x = x + w // 2
+            center_y = y + h // 2
+            
+            crop_x1 = max(0, int(center_x - body_width // 2))
+            crop_y1 = max(0, int(y - h * 0.5))  # Include some space above head
+            crop_x2 = min(width, int(center_x + body_width // 2))
+            crop_y2 = min(height, int(center_y + body_height // 2))
+            
+            # Crop image
+            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
+            
+            # Save cropped image
+            base, ext = os.path.splitext(image_path)
+            output_path = f"{base}_cropped{ext}"
+            with metrics.span("crop.encode"):
+                cv2.imwrite(output_path, cropped)
+            
+            print(f"✅ Cropped person image saved to: {output_path}")
+            # Proportions of an upright adult: shoulders just below the chin, hips ~2.6 faces lower
+            chin_y = y + h - crop_y1
+            torso = _torso(center_x - crop_x1, chin_y + 0.3 * h, chin_y + 2.6 * h, 1.1 * w, 0.85 * w,
+                           crop_x2 - crop_x1, crop_y2 - crop_y1)
+            return PersonCrop(output_path, torso)
+        
+        # No face detected - try full body detection
+        print("⚠️  No face detected, trying full body detection...")
+        with metrics.span("crop.load_cascade"):
+            body_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_fullbody.xml'
+            )
+        
+        with metrics.span("crop.detect_body"):
+            bodies = body_cascade.detectMultiScale(gray, 1.1, 3)
+        
+        if len(bodies) > 0:
+            # Use largest detected body
+            largest_body = max(bodies, key=lambda b: b[2] * b[3])
+            x, y, w, h = largest_body
+            
+            print(f"✅ Detected body at ({x}, {y}) with size {w}x{h}")
+            
+            # Add padding
+            padding = 20
+            crop_x1 = max(0, x - padding)
+            crop_y1 = max(0, y - padding)
+            crop_x2 = min(width, x + w + padding)
+            crop_y2 = min(height, y + h + padding)
+            
+            cropped = img[crop_y1:crop_y2, crop_x1:crop_x2]
+            
+            base, ext = os.path.splitext(image_path)
+            output_path = f"{base}_cropped{ext}"
+            with metrics.span("crop.encode"):
+                cv2.imwrite(output_path, cropped)
+            
+            print(f"✅ Cropped body image saved to: {output_path}")
+            torso = _torso(x + w / 2 - crop_x1, y + 0.18 * h - crop_y1, y + 0.5 * h - crop_y1, 0.3 * w, 0.22 * w,
+                           crop_x2 - crop_x1, crop_y2 - crop_y1)
+            return PersonCrop(output_path, torso)
+        
+        # No person detected - return original image
+        print("⚠️  No person detected, using original image")
+        return PersonCrop(image_path)
+        
+    except Exception as e:
+        print(f"❌ Error during person detection: {e}")
+        import traceback
+        traceback.print_exc()
+        return PersonCrop(image_path)
+
+def _default_torso(width, height):
+    # Framing of a typical upper-body shot, for photos where no person was detected
+    return _torso(width / 2, 0.22 * height, 0.62 * height, 0.3 * width, 0.24 * width, width, height)
+
+def _fit(img, max_side):
+    import cv2
+    h, w = img.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return img, scale
+
+def render_overlay_preview(person_path, garment_path, torso=None, max_side=PREVIEW_MAX_SIDE):
+    """
+    Rough local try-on preview shown while the Space renders the real one: the garment is
+    warped onto the torso (from locate_and_crop_person) with a perspective transform and
+    blended through a feathered mask. Returns JPEG bytes, or None if it can't be drawn.
+    """
+    try:
+        import cv2
+        
+        with metrics.span("preview.decode"):
+            person = cv2.imread(person_path, cv2.IMREAD_COLOR)
+            garment = cv2.imread(garment_path, cv2.IMREAD_COLOR)
+            if person is None or garment is None:
+                return None
+            person, scale = _fit(person, max_side)
+            garment, _ = _fit(garment, max_side)
+        height, width = person.shape[:2]
+        if torso is None:
+            quad = np.float32(_default_torso(width, height))
+        else:
+            quad = np.float32(torso) * scale
+        # Sleeves reach past the shoulders: widen the target around the torso's centre line
+        center_x = quad[:, 0].mean()
+        quad[:, 0] = center_x + (quad[:, 0] - center_x) * 1.25
+        
+        with metrics.span("preview.mask"):
+            # Product shots sit on a plain background: whatever differs from the border colour is garment
+            border = np.concatenate([garment[0], garment[-1], garment[:, 0], garment[:, -1]])
+            background = np.median(border, axis=0)
+            distance = np.abs(garment.astype(np.int16) - background.astype(np.int16)).max(axis=2)
+            mask = (distance > 30).astype(np.uint8) * 255
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+            ys, xs = np.nonzero(mask)
+            if len(xs) < 0.02 * mask.size:
+                # No clear background (a worn or full-bleed garment photo): use all of it
+                mask[:] = 255
+                x0, y0, x1, y1 = 0, 0, garment.shape[1] - 1, garment.shape[0] - 1
+            else:
+                x0, y0, x1, y1 = xs.min(), ys.min(), xs.max(), ys.max()
+        
+        with metrics.span("preview.warp"):
+            source = np.float32([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+            matrix = cv2.getPerspectiveTransform(source, quad)
+            warped = cv2.warpPerspective(garment, matrix, (width, height), flags=cv2.INTER_LINEAR)
+            alpha = cv2.warpPerspective(mask, matrix, (width, height), flags=cv2.INTER_LINEAR)
+            alpha = cv2.GaussianBlur(alpha, (0, 0), max(1.0, width / 200))
+            alpha = alpha.astype(np.float32)[..., None] * (0.9 / 255)
+            blended = (person * (1 - alpha) + warped * alpha).astype(np.uint8)
+        
+        with metrics.span("preview.encode"):
+            ok, encoded = cv2.imencode(".jpg", blended, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        return encoded.tobytes() if ok else None
+    except Exception as e:
+        print(f"⚠️  Could not render overlay preview: {e}")
+        return None
+
+def create_video_from_image(image_path, duration=4):
+    """Create a short video with dynamic movements from a static image."""
+    try:
+        import imageio
+        
+        # Load the image
+        with metrics.span("video.decode"):
+            img = Image.open(image_path)
+            img.load()
+        w, h = img.size
+        
+        # Create frames with multiple dynamic effects
+        fps = 30
+        total_frames = int(duration * fps)
+        frames = []
+        
+        with metrics.span("video.render_frames"):
+            for i in range(total_frames):
+                t = i / total_frames
+            
+                # Effect 1: Zoom (1.0 to 1.2)
+                zoom = 1.0 + (t * 0.2)
+            
+                # Effect 2: Pan (subtle left-right movement)
+                pan_x = int(20 * np.sin(t * 2 * np.pi))
+            
+                # Effect 3: Tilt (subtle up-down movement)
+                tilt_y = int(15 * np.sin(t * 3 * np.pi))
+            
+                # Effect 4: Rotation (subtle rotation, max 3 degrees)
+                rotation_angle = 3 * np.sin(t * 2 * np.pi)
+            
+                # Apply rotation first
+                rotated = img.rotate(rotation_angle, resample=Image.Resampling.BICUBIC, expand=False)
+            
+                # Calculate crop box for zoom effect with pan and tilt
+                new_w = int(w / zoom)
+                new_h = int(h / zoom)
+                left = (w - new_w) // 2 + pan_x
+                top = (h - new_h) // 2 + tilt_y
+            
+                # Ensure crop box is within bounds
+                left = max(0, min(left, w - new_w))
+                top = max(0, min(top, h - new_h))
+            
+                # Crop and resize
+                cropped = rotated.crop((left, top, left + new_w, top + new_h))
+                zoomed = cropped.resize((w, h), Image.Resampling.LANCZOS)
+            
+                # Effect 5: Brightness variation for dynamic feel
+                enhancer = ImageEnhance.Brightness(zoomed)
+                enhanced = enhancer.enhance(1.0 + (t * 0.15))
+            
+                # Effect 6: Slight contrast boost
+                contrast_enhancer = ImageEnhance.Contrast(enhanced)
+                final_frame = contrast_enhancer.enhance(1.0 + (t * 0.1))
+            
+                frames.append(np.array(final_frame))
+        
+        # Save as video
+        output_path = artifact_store.store.scratch_path(".mp4")
+        with metrics.span("video.encode"):
+            imageio.mimsave(output_path, frames, fps=fps, codec='libx264', quality=8)
+        
+        return artifact_store.store.put_file(output_path, "video")
+    except Exception as e:
+        print(f"Error creating video: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def apply_custom_background(result_image_path, background_path):
+    """Apply a custom background to the result image."""
+    try:
+        if not background_path:
+            return result_image_path
+        
+        # Load images
+        with metrics.span("background.decode"):
+            result = Image.open(result_image_path).convert("RGBA")
+            # Uploaded backgrounds can be full-size photos: decode them near the result's size
+            background = image_ingest.load(background_path, max_side=max(result.size)).convert("RGBA")
+        
+        with metrics.span("background.blend"):
+            # Resize background to match result
+            background = background.resize(result.size, Image.Resampling.LANCZOS)
+            
+            # Simple edge detection to create a rough mask
+            # Convert to grayscale for edge detection
+            gray = result.convert('L')
+            edges = gray.filter(ImageFilter.FIND_EDGES)
+            
+            # Create a simple mask based on the result image
+            # This is a simplified approach - ideally we'd use the mask from IDM-VTON
+            # For now, we'll just blend the images
+            blended = Image.blend(background.convert("RGB"), result.convert("RGB"), alpha=0.7)
+        
+        output_path = artifact_store.store.scratch_path(".png")
+        with metrics.span("background.encode"):
+            blended.save(output_path)
+        
+        return artifact_store.store.put_file(output_path, "background")
+    except Exception as e:
+        print(f"Error applying background: {e}")
+        return result_image_path
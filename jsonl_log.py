@@ -0,0 +1,26 @@
+import json
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Any
+
+
+class JsonlLog:
+    """Append-only JSONL file with size-based rotation (path, path.1, path.2, ...)."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # RotatingFileHandler gives us thread-safe writes and rotation for free
+        self._logger = logging.getLogger(f"verse.jsonl.{os.path.abspath(path)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                          encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._logger.info(json.dumps(record, default=str, separators=(",", ":")))
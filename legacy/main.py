@@ -1,7 +1,19 @@
- Core imports for video processing, 3D math, and machine learning
+# Core imports for video processing, 3D math, and machine learning
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
 import cv2
 import numpy as np
-import time
+
+# The face model, virtual object and pose math live in face_pose.py at the repository root,
+# shared with the server's AR WebSocket endpoint
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_pose import (VIRTUAL_OBJECT_3D_POINTS, VIRTUAL_OBJECT_CONNECTIONS, detect_faces, get_camera_matrix,
+                       landmarks_from_box, load_net, solve_pose)
 
 # --- 1. SETUP AND INITIALIZATION ---
 
@@ -12,6 +24,7 @@ MODEL_PATH = "res10_300x300_ssd_iter_140000.caffemodel" # The pre-trained weight
 
 # We will try to load the model. If it fails, we assume we need to
 # download or simplify the detection step, but standard OpenCV packages usually handle this.
+net = None
 try:
     net = cv2.dnn.readNetFromCaffe(PROTOTXT_PATH, MODEL_PATH)
 except Exception:
@@ -20,74 +33,19 @@ except Exception:
     print("Please ensure 'deploy.prototxt' and 'res10_300x300_ssd_iter_140000.caffemodel' are available.")
     # For now, we will proceed, but detection won't work without them.
 
-# Pre-defined indices for key face points (used for PnP)
-# Since DNN detection only gives a bounding box, we will ESTIMATE the location
-# of 6 canonical points based on the bounding box geometry for PnP.
-# This is a simplification but allows the 3D projection logic to work.
-
-# Canonical face point coordinates (normalized to a 1x1 face box)
-# We estimate nose, chin, eye corners, and mouth corners.
-CANONICAL_FACE_POINTS = np.array([
-    (0.50, 0.40, 0.0),  # Nose Tip (center)
-    (0.50, 0.90, -0.1), # Chin
-    (0.20, 0.25, 0.0),  # Left Eye Corner
-    (0.80, 0.25, 0.0),  # Right Eye Corner
-    (0.30, 0.70, 0.0),  # Left Mouth Corner
-    (0.70, 0.70, 0.0)   # Right Mouth Corner
-], dtype=np.float32)
-
-# Convert normalized coordinates to arbitrary 3D model space (e.g., mm)
-# The virtual object coordinates (Section 2) must align with this scale.
-# We choose a scale factor and shift the origin to the Nose Tip.
-SCALE_FACTOR = 80.0
-# The 3D model is shifted so the nose tip (index 0) is at (0, 0, 0)
-MODEL_3D_POINTS = CANONICAL_FACE_POINTS * SCALE_FACTOR
-MODEL_3D_POINTS -= MODEL_3D_POINTS[0]
-
-# --- 2. VIRTUAL 3D OBJECT DEFINITION (Glasses/Cuboid) ---
-
-# Define the 3D points of the virtual item (a simple wireframe glasses frame).
-# These points are defined relative to the Nose Tip origin (0,0,0) established above.
-VIRTUAL_OBJECT_3D_POINTS = np.array([
-    # Points defining the frame shape (left lens area)
-    [-45.0, -45.0, 5.0],  # 0: Top-Left
-    [-15.0, -45.0, 5.0],  # 1: Top-Right
-    [-15.0, -65.0, 5.0],  # 2: Bottom-Right
-    [-45.0, -65.0, 5.0],  # 3: Bottom-Left
-    
-    # Points defining the right lens area
-    [ 15.0, -45.0, 5.0],  # 4: Top-Left
-    [ 45.0, -45.0, 5.0],  # 5: Top-Right
-    [ 45.0, -65.0, 5.0],  # 6: Bottom-Right
-    [ 15.0, -65.0, 5.0],  # 7: Bottom-Left
-    
-    # Connecting bridge
-    [-15.0, -55.0, 5.0],  # 8: Bridge Left
-    [ 15.0, -55.0, 5.0]   # 9: Bridge Right
-], dtype=np.float32)
-
-# Define how the virtual object points are connected (wireframe/lines)
-VIRTUAL_OBJECT_CONNECTIONS = [
-    (0, 1), (1, 2), (2, 3), (3, 0),  # Left Lens Outline
-    (4, 5), (5, 6), (6, 7), (7, 4),  # Right Lens Outline
-    (8, 9)                           # Bridge Connection
-]
-
-# --- 3. HELPER FUNCTIONS ---
-
-def get_camera_matrix(width, height):
-    """
-    Estimates a simple camera intrinsic matrix.
-    """
-    focal_length = width
-    center = (width / 2, height / 2)
-    camera_matrix = np.array(
-        [[focal_length, 0, center[0]],
-         [0, focal_length, center[1]],
-         [0, 0, 1]], dtype="double"
-    )
-    dist_coeffs = np.zeros((4, 1))
-    return camera_matrix, dist_coeffs
+# Pipeline tuning for a steady 30fps on a laptop CPU
+TARGET_FPS = 30
+DETECT_EVERY_N_FRAMES = 5    # the DNN runs on every Nth frame; optical flow tracks the face in between
+FRAME_QUEUE_SIZE = 2         # captured frames waiting for the main loop; older ones are dropped
+CONFIDENCE_THRESHOLD = 0.7
+MIN_TRACKED_FEATURES = 6     # fewer surviving flow points than this and the face counts as lost
+
+# Headless video mode (--video): shards per worker process, and temporal smoothing of the face track
+SHARDS_PER_WORKER = 4        # smaller shards even out the load when some frame ranges are slower
+SMOOTHING_WINDOW = 5         # frames in the centred moving average over each landmark
+MAX_GAP_FRAMES = 3           # missed detections this short are interpolated instead of dropping the overlay
+
+# --- 2. HELPER FUNCTIONS ---
 
 def project_and_draw(image, model_points_3d, connections, rvec, tvec, camera_matrix, dist_coeffs, color=(0, 255, 0), thickness=2):
     """
@@ -103,30 +61,146 @@ def project_and_draw(image, model_points_3d, connections, rvec, tvec, camera_mat
     
     return image
 
-def estimate_face_landmarks_from_box(detection, w, h):
+def detect_face(image):
     """
-    Estimates the 6 required PnP 2D points based on the bounding box returned by the DNN.
-    This is an approximation for head tracking when detailed landmarks are unavailable.
+    Runs the DNN on a frame and returns the most confident face box (startX, startY, endX, endY),
+    or None if there is no face above CONFIDENCE_THRESHOLD (or no model).
+    """
+    if net is None:
+        return None
+    return detect_faces(net, [image], CONFIDENCE_THRESHOLD)[0]
+
+
+# --- 3. PIPELINE STAGES ---
+
+class LatestFrameQueue:
+    """
+    Bounded queue that drops its oldest item when full, so a slow consumer always
+    gets a recent frame instead of working through a backlog of stale ones.
+    """
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next item (raises queue.Empty after timeout)."""
+        return self._queue.get(timeout=timeout)
+
+    def get_latest(self):
+        """The newest item, discarding any older ones; None if the queue is empty."""
+        item = None
+        while True:
+            try:
+                newer = self._queue.get_nowait()
+            except queue.Empty:
+                return item
+            if item is not None:
+                self.dropped += 1
+            item = newer
+
+
+class CaptureThread(threading.Thread):
+    """Reads and mirrors webcam frames as fast as the camera delivers them."""
+
+    def __init__(self, cap, frames):
+        super().__init__(name="capture", daemon=True)
+        self.cap = cap
+        self.frames = frames
+        self.stopped = threading.Event()
+
+    def run(self):
+        frame_id = 0
+        while not self.stopped.is_set():
+            success, image = self.cap.read()
+            if not success:
+                time.sleep(0.005)
+                continue
+            frame_id += 1
+            self.frames.put((frame_id, cv2.flip(image, 1)))
+
+
+class DetectorThread(threading.Thread):
+    """
+    Runs the DNN off the display loop: it takes the latest frame submitted and posts the
+    face box it finds, so a slow forward pass delays the next detection, not the video.
+    """
+
+    def __init__(self):
+        super().__init__(name="detector", daemon=True)
+        self.requests = LatestFrameQueue(1)
+        self.results = LatestFrameQueue(1)
+        self.stopped = threading.Event()
+
+    def submit(self, frame_id, image):
+        self.requests.put((frame_id, image))
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                frame_id, image = self.requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.results.put((frame_id, detect_face(image)))
+
+
+class FaceTracker:
+    """
+    Follows the face between detections with sparse optical flow: corners inside the last
+    face box are tracked frame to frame (Lucas-Kanade), and the similarity transform they
+    agree on moves the 6 PnP landmarks.
     """
-    box = detection[0, 0, 0, 3:7] * np.array([w, h, w, h])
-    (startX, startY, endX, endY) = box.astype("int")
-    
-    # Normalize face box dimensions to 0-1 for easy mapping
-    face_w = endX - startX
-    face_h = endY - startY
-    
-    # Map normalized canonical points (0-1) to actual pixel coordinates (startX:endX, startY:endY)
-    image_points_2d = []
-    
-    # Order matches MODEL_3D_POINTS: Nose, Chin, Left Eye, Right Eye, Left Mouth, Right Mouth
-    for (nx, ny, _) in CANONICAL_FACE_POINTS:
-        # x_pixel = startX + nx * face_width
-        # y_pixel = startY + ny * face_height
-        x_pixel = startX + int(nx * face_w)
-        y_pixel = startY + int(ny * face_h)
-        image_points_2d.append((x_pixel, y_pixel))
 
-    return np.array(image_points_2d, dtype="double")
+    def __init__(self):
+        self.prev_gray = None
+        self.features = None
+        self.landmarks = None
+
+    def reset(self, gray, box):
+        startX, startY, endX, endY = box
+        mask = np.zeros_like(gray)
+        mask[startY:endY, startX:endX] = 255
+        self.features = cv2.goodFeaturesToTrack(gray, maxCorners=40, qualityLevel=0.01, minDistance=5, mask=mask)
+        self.landmarks = landmarks_from_box(startX, startY, endX, endY)
+        self.prev_gray = gray
+        if self.features is None or len(self.features) < MIN_TRACKED_FEATURES:
+            self.features = None  # a textureless box can't be tracked; wait for the next detection
+        return self.landmarks
+
+    def clear(self):
+        self.features = None
+        self.landmarks = None
+
+    def update(self, gray):
+        """The landmarks moved to this frame, or None once the face is lost."""
+        if self.features is None:
+            return self.landmarks  # untrackable box: hold it until the next detection
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.features, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        self.prev_gray = gray
+        good = status.reshape(-1) == 1
+        if good.sum() < MIN_TRACKED_FEATURES:
+            self.clear()
+            return None
+        matrix, _ = cv2.estimateAffinePartial2D(self.features[good], moved[good], method=cv2.RANSAC)
+        if matrix is None:
+            self.clear()
+            return None
+        self.features = moved[good].reshape(-1, 1, 2)
+        self.landmarks = cv2.transform(self.landmarks.reshape(-1, 1, 2), matrix).reshape(-1, 2)
+        return self.landmarks
 
 
 # --- 4. MAIN APPLICATION LOOP ---
@@ -134,95 +208,259 @@ def estimate_face_landmarks_from_box(detection, w, h):
 def virtual_try_on_app():
     """
     Main function to run the OpenCV DNN-based virtual try-on application.
+    Capture and detection run in their own threads; this loop tracks, solves the pose and
+    draws every frame, always taking the newest captured frame.
     """
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         print("Error: Could not open webcam. Check camera connection or permissions.")
         return
+    cap.set(cv2.CAP_PROP_FPS, TARGET_FPS)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # don't let the driver queue up old frames either
+
+    frames = LatestFrameQueue(FRAME_QUEUE_SIZE)
+    capture = CaptureThread(cap, frames)
+    detector = DetectorThread()
+    tracker = FaceTracker()
+    capture.start()
+    detector.start()
+
+    pTime = time.time()
+    fps = 0.0
+    pose = None  # (rvec, tvec) of the previous frame, the starting guess for the next solve
+    frames_seen = 0
+
+    try:
+        while True:
+            try:
+                frame_id, image = frames.get(timeout=1.0)
+            except queue.Empty:
+                if not capture.is_alive():
+                    break
+                continue
+            latest = frames.get_latest()
+            if latest is not None:
+                frame_id, image = latest
+            frames_seen += 1
+
+            h, w = image.shape[:2]
+            camera_matrix, dist_coeffs = get_camera_matrix(w, h)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+            # 1. Ask for a fresh detection every Nth frame (and constantly while no face is tracked)
+            if frames_seen % DETECT_EVERY_N_FRAMES == 0 or tracker.features is None:
+                detector.submit(frame_id, image)
+
+            # 2. A finished detection re-anchors the tracker; otherwise optical flow carries it
+            detection = detector.results.get_latest()
+            if detection is not None:
+                _, box = detection
+                if box is None:
+                    tracker.clear()
+                    image_points_2d = None
+                else:
+                    image_points_2d = tracker.reset(gray, box)
+            else:
+                image_points_2d = tracker.update(gray)
 
-    pTime = 0
-    CONFIDENCE_THRESHOLD = 0.7
+            # 3. Use PnP to estimate the pose, starting from the last one while the face is tracked
+            pose = None if image_points_2d is None else solve_pose(image_points_2d, w, h, pose)
 
-    while cap.isOpened():
+            # 4. Project the virtual object and draw it
+            if pose is not None:
+                image = project_and_draw(
+                    image,
+                    VIRTUAL_OBJECT_3D_POINTS,
+                    VIRTUAL_OBJECT_CONNECTIONS,
+                    pose[0],
+                    pose[1],
+                    camera_matrix,
+                    dist_coeffs,
+                    color=(0, 255, 0), # Green glasses frame
+                    thickness=3
+                )
+
+            # 5. Display FPS (smoothed) and how many stale frames were skipped
+            cTime = time.time()
+            if cTime != pTime:
+                fps = 0.9 * fps + 0.1 * (1 / (cTime - pTime)) if fps else 1 / (cTime - pTime)
+            pTime = cTime
+            cv2.putText(image, f'FPS: {int(fps)}  dropped: {frames.dropped}', (20, 40),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+            # 6. Display the final image
+            cv2.imshow('3D Virtual Try-On (OpenCV DNN) (Press Q to Exit)', image)
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        capture.stopped.set()
+        detector.stopped.set()
+        capture.join(timeout=1.0)
+        cap.release()
+        cv2.destroyAllWindows()
+
+# --- 5. HEADLESS VIDEO MODE ---
+
+# Each worker process loads its own DNN (see _init_video_worker)
+_worker_net = None
+
+def _init_video_worker(prototxt, model):
+    global _worker_net
+    # One OpenCV thread per process: the pool provides the parallelism, and oversubscribed
+    # cores would stop throughput from scaling with them
+    cv2.setNumThreads(1)
+    _worker_net = load_net(prototxt, model)
+
+def _track_frame_range(video_path, start, end, detect_every):
+    """
+    Face landmarks for frames [start, end) of a video: (start, [6x2 list or None per frame]).
+    Detects on every `detect_every`-th frame of the range and tracks with optical flow in between.
+    """
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    tracker = FaceTracker()
+    track = []
+    for offset in range(end - start):
         success, image = cap.read()
         if not success:
+            break
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if offset % detect_every == 0 or tracker.landmarks is None:
+            box = detect_faces(_worker_net, [image], CONFIDENCE_THRESHOLD)[0] if _worker_net is not None else None
+            if box is None:
+                tracker.clear()
+                landmarks = None
+            else:
+                landmarks = tracker.reset(gray, box)
+        else:
+            landmarks = tracker.update(gray)
+        track.append(None if landmarks is None else np.asarray(landmarks).tolist())
+    cap.release()
+    return start, track
+
+def smooth_track(track, window=SMOOTHING_WINDOW, max_gap=MAX_GAP_FRAMES):
+    """
+    Temporal smoothing of per-frame landmarks (each a 6x2 array or None): short gaps between
+    detections are filled by linear interpolation, then every run of frames with a face gets a
+    centred moving average, which removes detector jitter without lagging behind the face.
+    """
+    track = [None if points is None else np.asarray(points, dtype="double") for points in track]
+    # Fill short gaps
+    i = 0
+    while i < len(track):
+        if track[i] is not None:
+            i += 1
+            continue
+        gap_end = i
+        while gap_end < len(track) and track[gap_end] is None:
+            gap_end += 1
+        if 0 < i and gap_end < len(track) and gap_end - i <= max_gap:
+            before, after = track[i - 1], track[gap_end]
+            for j in range(i, gap_end):
+                t = (j - i + 1) / (gap_end - i + 1)
+                track[j] = before + (after - before) * t
+        i = gap_end
+    # Centred moving average within each run
+    smoothed = list(track)
+    half = window // 2
+    i = 0
+    while i < len(track):
+        if track[i] is None:
+            i += 1
             continue
+        run_end = i
+        while run_end < len(track) and track[run_end] is not None:
+            run_end += 1
+        run = np.stack(track[i:run_end])
+        cumulative = np.concatenate([np.zeros((1,) + run.shape[1:]), np.cumsum(run, axis=0)])
+        for k in range(len(run)):
+            lo, hi = max(0, k - half), min(len(run), k + half + 1)
+            smoothed[i + k] = (cumulative[hi] - cumulative[lo]) / (hi - lo)
+        i = run_end
+    return smoothed
 
-        image = cv2.flip(image, 1)
-        h, w = image.shape[:2]
-        
-        camera_matrix, dist_coeffs = get_camera_matrix(w, h)
-        
-        # 2. Prepare image for DNN (Deep Neural Network)
-        # The model expects a 300x300 BGR blob
-        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
-
-        # 3. Detect Face
-        if 'net' in locals():
-            net.setInput(blob)
-            detections = net.forward()
-        else:
-            detections = [] # Skip detection if model failed to load
-
-        
-        # 4. Process Detection Results
-        if len(detections) > 0:
-            # Loop over the detections
-            for i in range(0, detections.shape[2]):
-                confidence = detections[0, 0, i, 2]
-
-                # Filter out weak detections
-                if confidence > CONFIDENCE_THRESHOLD:
-                    
-                    # Estimate the 6 canonical face points from the detected bounding box
-                    image_points_2d = estimate_face_landmarks_from_box(detections[0, 0, i:i+1], w, h)
-                    
-                    # 5. Use PnP to estimate the pose
-                    (success, rvec, tvec) = cv2.solvePnP(
-                        MODEL_3D_POINTS, 
-                        image_points_2d, 
-                        camera_matrix, 
-                        dist_coeffs, 
-                        flags=cv2.SOLVEPNP_ITERATIVE
-                    )
-
-                    # 6. Project the virtual object and draw it
-                    if success:
-                        image = project_and_draw(
-                            image, 
-                            VIRTUAL_OBJECT_3D_POINTS, 
-                            VIRTUAL_OBJECT_CONNECTIONS, 
-                            rvec, 
-                            tvec, 
-                            camera_matrix, 
-                            dist_coeffs, 
-                            color=(0, 255, 0), # Green glasses frame
-                            thickness=3
-                        )
-                        
-                        # Optionally draw the bounding box for debugging
-                        # box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                        # (startX, startY, endX, endY) = box.astype("int")
-                        # cv2.rectangle(image, (startX, startY), (endX, endY), (0, 0, 255), 2)
-
-
-        # 7. Display FPS
-        cTime = time.time()
-        if cTime != pTime:
-            fps = 1 / (cTime - pTime)
-        else:
-            fps = 0
-        pTime = cTime
-        cv2.putText(image, f'FPS: {int(fps)}', (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        
-        # 8. Display the final image
-        cv2.imshow('3D Virtual Try-On (OpenCV DNN) (Press Q to Exit)', image)
-
-        if cv2.waitKey(5) & 0xFF == ord('q'):
-            break
+def process_video(video_path, output_path, workers=None, detect_every=1, codec="mp4v",
+                  prototxt=PROTOTXT_PATH, model=MODEL_PATH):
+    """
+    Renders the glasses overlay onto a recorded video without a window.
+    Frame ranges are tracked in parallel by a process pool (one DNN per process), the merged
+    face track is smoothed, and the output is written frame by frame as the input is re-read.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
 
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open video '{video_path}'.")
+        return False
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or TARGET_FPS
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     cap.release()
-    cv2.destroyAllWindows()
+    if total <= 0:
+        print(f"Error: '{video_path}' reports no frames.")
+        return False
+    if load_net(prototxt, model) is None:
+        return False  # every frame would come out without an overlay
+
+    # 1. Track shards of the video in parallel
+    workers = workers or os.cpu_count() or 1
+    shard_count = min(total, workers * SHARDS_PER_WORKER)
+    bounds = np.linspace(0, total, shard_count + 1).astype(int)
+    track = [None] * total
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_video_worker,
+                             initargs=(prototxt, model)) as pool:
+        futures = [pool.submit(_track_frame_range, video_path, int(start), int(end), detect_every)
+                   for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        done = 0
+        for future in as_completed(futures):
+            start, shard = future.result()
+            track[start:start + len(shard)] = shard
+            done += len(shard)
+            print(f"Tracked {done}/{total} frames")
+    tracked_in = time.time() - started
+
+    # 2. Merge: smooth the face track, then solve each frame's pose from the previous one
+    smoothed = smooth_track(track)
+    poses = []
+    pose = None
+    for points in smoothed:
+        pose = None if points is None else solve_pose(points, w, h, pose)
+        poses.append(pose)
+
+    # 3. Draw and encode, streaming frames from input to output
+    started = time.time()
+    camera_matrix, dist_coeffs = get_camera_matrix(w, h)
+    cap = cv2.VideoCapture(video_path)
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, (w, h))
+    if not writer.isOpened():
+        print(f"Error: Could not open '{output_path}' for writing with codec {codec}.")
+        cap.release()
+        return False
+    written = 0
+    try:
+        for pose in poses:
+            success, image = cap.read()
+            if not success:
+                break
+            if pose is not None:
+                image = project_and_draw(image, VIRTUAL_OBJECT_3D_POINTS, VIRTUAL_OBJECT_CONNECTIONS,
+                                         pose[0], pose[1], camera_matrix, dist_coeffs, color=(0, 255, 0),
+                                         thickness=3)
+            writer.write(image)
+            written += 1
+    finally:
+        cap.release()
+        writer.release()
+    encoded_in = time.time() - started
+
+    faces = sum(1 for pose in poses if pose is not None)
+    print(f"Wrote {written} frames to {output_path} (face in {faces}); "
+          f"tracking {total / max(tracked_in, 1e-6):.0f} fps on {workers} worker(s), "
+          f"encoding {written / max(encoded_in, 1e-6):.0f} fps")
+    return True
 
 if __name__ == '__main__':
     # NOTE: To make this robust, you need to download two files and place them
@@ -230,11 +468,26 @@ if __name__ == '__main__':
     # 1. deploy.prototxt
     # 2. res10_300x300_ssd_iter_140000.caffemodel
     # You can find these by searching "OpenCV DNN Face Detection model files"
+    parser = argparse.ArgumentParser(description="3D Virtual Try-On (OpenCV DNN): live webcam, or a video file with --video")
+    parser.add_argument("--video", help="render the overlay onto this video file instead of the webcam (headless)")
+    parser.add_argument("--output", help="output video path (default: <video>_tryon.mp4)")
+    parser.add_argument("--workers", type=int, default=None, help="tracking processes (default: one per core)")
+    parser.add_argument("--detect-every", type=int, default=1,
+                        help="run the DNN on every Nth frame, tracking with optical flow in between")
+    parser.add_argument("--codec", default="mp4v", help="FourCC of the output video")
+    parser.add_argument("--prototxt", default=PROTOTXT_PATH)
+    parser.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args()
     
     print("--- 3D Virtual Try-On Application (OpenCV DNN) ---")
     print("Requires: opencv-python, numpy")
     print("Requires model files: deploy.prototxt and res10_300x300_ssd_iter_140000.caffemodel")
+    if args.video:
+        output = args.output or os.path.splitext(args.video)[0] + "_tryon.mp4"
+        print("--------------------------------------")
+        sys.exit(0 if process_video(args.video, output, args.workers, max(1, args.detect_every), args.codec,
+                                    args.prototxt, args.model) else 1)
     print("Press 'Q' on the video window to exit.")
     print("--------------------------------------")
     
-    virtual_try_on_app()
\ No newline at end of file
+    virtual_try_on_app()
@@ -0,0 +1,214 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond handlers to 5 minute Space calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+STAGE_METRIC = "verse_stage_duration_seconds"
+STAGE_ERRORS_METRIC = "verse_stage_errors_total"
+HTTP_METRIC = "verse_http_request_duration_seconds"
+
+_registry_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Tuple], "Histogram"] = {}
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_gauges: Dict[str, Callable[[], Dict[Tuple, float]]] = {}
+_help: Dict[str, str] = {
+    STAGE_METRIC: "Time spent in each request pipeline stage",
+    STAGE_ERRORS_METRIC: "Pipeline stages that raised an exception",
+    HTTP_METRIC: "End-to-end HTTP request latency",
+}
+
+# Stage timings of the request being handled in this thread/task
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_stages", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram. Recording is a bisect and three increments."""
+
+    __slots__ = ("counts", "sum", "count", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        """Estimate a quantile by interpolating inside the bucket that contains it."""
+        if counts is None:
+            counts = self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * ((rank - seen) / bucket_count)
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def histogram(name: str, **labels) -> Histogram:
+    """Get (or create) the histogram for a metric name and label set."""
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(key, Histogram())
+    return hist
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    histogram(name, **labels).observe(seconds)
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _registry_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name: str, fn: Callable[[], Dict[Tuple, float]], help_text: str = "") -> None:
+    """
+    Register a gauge computed at scrape time. fn returns {label_tuple: value},
+    where label_tuple is a tuple of (label, value) pairs (empty for no labels).
+    """
+    _gauges[name] = fn
+    if help_text:
+        _help[name] = help_text
+
+
+def begin_request() -> None:
+    """Start collecting stage timings for the current request."""
+    _request_stages.set([])
+
+
+def request_stages() -> List[Tuple[str, float]]:
+    """Stage timings recorded so far for the current request (the live list, once begun)."""
+    stages = _request_stages.get()
+    return stages if stages is not None else []
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block of code as a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc(STAGE_ERRORS_METRIC, stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram(STAGE_METRIC, stage=stage).observe(elapsed)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+
+def timed(stage: str):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_prometheus() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+
+    with _registry_lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    by_name: Dict[str, List] = {}
+    for (name, labels), hist in histograms:
+        by_name.setdefault(name, []).append((labels, hist))
+
+    for name, series in by_name.items():
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        quantile_lines = []
+        for labels, hist in series:
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            for q in QUANTILES:
+                quantile_lines.append(
+                    f"{name}_quantile{_format_labels(labels, (('quantile', q),))} {hist.quantile(q, counts):.6f}"
+                )
+        # p50/p95/p99 pre-computed for dashboards that do not use histogram_quantile()
+        lines.append(f"# HELP {name}_quantile Estimated p50/p95/p99 of {name}")
+        lines.append(f"# TYPE {name}_quantile gauge")
+        lines.extend(quantile_lines)
+
+    counter_names: Dict[str, List] = {}
+    for (name, labels), value in counters:
+        counter_names.setdefault(name, []).append((labels, value))
+    for name, series in counter_names.items():
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in series:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for name, fn in sorted(_gauges.items()):
+        try:
+            values = fn()
+        except Exception as e:
+            print(f"⚠️  Gauge {name} failed: {e}")
+            continue
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in values.items():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+# Local order database (SQLite in WAL mode so readers never block writers)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+ORDERS_DB_PATH = os.getenv("ORDERS_DB_PATH", os.path.join(DATA_DIR, "verse.db"))
+
+# Other modules (webhooks, reconciliation) add their tables via register_schema()
+_SCHEMAS = ["""
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    receipt TEXT,
+    amount INTEGER,
+    currency TEXT,
+    status TEXT NOT NULL,
+    payment_id TEXT,
+    order_json TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    order_id TEXT,
+    claimed_at REAL NOT NULL,
+    fingerprint TEXT
+);
+"""]
+# Columns added after a table was first created: (table, column, declaration)
+_COLUMNS = [("idempotency_keys", "fingerprint", "TEXT")]
+
+_local = threading.local()
+
+
+def register_schema(sql: str) -> None:
+    """Register extra CREATE TABLE statements applied to every new connection."""
+    if sql not in _SCHEMAS:
+        _SCHEMAS.append(sql)
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the order database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != ORDERS_DB_PATH:
+        os.makedirs(os.path.dirname(ORDERS_DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(ORDERS_DB_PATH, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        _local.conn = conn
+        _local.path = ORDERS_DB_PATH
+        _local.schema_count = 0
+    if _local.schema_count < len(_SCHEMAS):
+        for sql in _SCHEMAS[_local.schema_count:]:
+            conn.executescript(sql)
+        if _local.schema_count == 0:
+            _add_missing_columns(conn)
+        _local.schema_count = len(_SCHEMAS)
+    return conn
+
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    """Bring databases created by older versions up to date with _COLUMNS."""
+    for table, column, declaration in _COLUMNS:
+        existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            try:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            except sqlite3.OperationalError:
+                pass  # another process added it first
+
+
+def claim_idempotency_key(key: str, reuse_window: float, stale_after: float,
+                          fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Atomically claim an idempotency key for order creation.
+    Returns {"state": "claimed"} when the caller must create the order,
+    {"state": "existing", "order": {...}} when a reusable order already exists,
+    {"state": "pending"} when another worker is creating it right now,
+    or {"state": "conflict"} when either was for a different request (fingerprint).
+    """
+    conn = get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT k.order_id, k.claimed_at, k.fingerprint, o.status, o.order_json, o.created_at "
+            "FROM idempotency_keys k LEFT JOIN orders o ON o.order_id = k.order_id "
+            "WHERE k.key = ?", (key,)
+        ).fetchone()
+
+        if row is not None:
+            state = None
+            if row["order_id"] is None:
+                if now - row["claimed_at"] < stale_after:
+                    state = {"state": "pending"}
+            elif row["status"] == "created" and now - row["created_at"] < reuse_window:
+                state = {"state": "existing", "order": json.loads(row["order_json"])}
+            if state is not None:
+                if fingerprint and row["fingerprint"] and row["fingerprint"] != fingerprint:
+                    state = {"state": "conflict"}
+                conn.execute("COMMIT")
+                return state
+
+        # No key yet, a stale claim, or the previous order was paid/failed/expired
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency_keys (key, order_id, claimed_at, fingerprint) VALUES (?, NULL, ?, ?)",
+            (key, now, fingerprint)
+        )
+        conn.execute("COMMIT")
+        return {"state": "claimed"}
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def release_idempotency_key(key: str) -> None:
+    """Drop an unfinished claim so a retry can create the order."""
+    get_connection().execute(
+        "DELETE FROM idempotency_keys WHERE key = ? AND order_id IS NULL", (key,)
+    )
+
+
+def record_order(order: Dict[str, Any], idempotency_key: Optional[str] = None) -> None:
+    """Store a freshly created Razorpay order and bind it to its idempotency key."""
+    conn = get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO orders "
+            "(order_id, receipt, amount, currency, status, payment_id, order_json, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'created', NULL, ?, ?, ?)",
+            (order["id"], order.get("receipt"), order.get("amount"), order.get("currency"),
+             json.dumps(order), now, now)
+        )
+        if idempotency_key:
+            conn.execute(
+                "UPDATE idempotency_keys SET order_id = ? WHERE key = ?",
+                (order["id"], idempotency_key)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def update_order_status(order_id: str, status: str, payment_id: Optional[str] = None) -> bool:
+    """Set an order's payment status. Returns False if the order is unknown."""
+    cur = get_connection().execute(
+        "UPDATE orders SET status = ?, payment_id = COALESCE(?, payment_id), updated_at = ? "
+        "WHERE order_id = ?",
+        (status, payment_id, time.time(), order_id)
+    )
+    return cur.rowcount > 0
+
+
+def get_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch a stored order row as a dict."""
+    row = get_connection().execute(
+        "SELECT * FROM orders WHERE order_id = ?", (order_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def list_orders(status: Optional[str] = None) -> List[Dict[str, Any]]:
+    """List stored orders, optionally filtered by status."""
+    conn = get_connection()
+    if status:
+        rows = conn.execute("SELECT * FROM orders WHERE status = ?", (status,)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM orders").fetchall()
+    return [dict(r) for r in rows]
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import order_store
+
+# Connection pool and timeout tuning (override via environment)
+RAZORPAY_BASE_URL = os.getenv("RAZORPAY_BASE_URL", "https://api.razorpay.com")
+RAZORPAY_POOL_SIZE = int(os.getenv("RAZORPAY_POOL_SIZE", "32"))
+RAZORPAY_CONNECT_TIMEOUT = float(os.getenv("RAZORPAY_CONNECT_TIMEOUT", "3.05"))
+RAZORPAY_READ_TIMEOUT = float(os.getenv("RAZORPAY_READ_TIMEOUT", "15"))
+
+# An unpaid order is handed back for the same cart within this window (seconds)
+IDEMPOTENCY_WINDOW = float(os.getenv("RAZORPAY_IDEMPOTENCY_WINDOW", "1800"))
+
+
+class PaymentGatewayError(Exception):
+    """Raised when Razorpay cannot be reached or does not answer in time."""
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an idempotency key comes back with a different cart, amount or customer."""
+
+
+class _PooledRazorpayClient(razorpay.Client):
+    """razorpay.Client that resolves its User-Agent version once instead of on every call."""
+
+    _version = None
+
+    def _get_version(self):
+        if _PooledRazorpayClient._version is None:
+            _PooledRazorpayClient._version = super()._get_version()
+        return _PooledRazorpayClient._version
+
+
+def cart_hash(amount: Any, currency: str, items: Optional[List[Any]] = None,
+              customer: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Stable hash of what is being bought and by whom.
+    Used as the idempotency key so a retried checkout maps to the same order.
+    """
+    customer = customer or {}
+    canonical = {
+        "amount": amount,
+        "currency": currency,
+        "items": sorted(json.dumps(item, sort_keys=True) for item in (items or [])),
+        "customer": {
+            "email": (customer.get("email") or "").strip().lower(),
+            "phone": (customer.get("phone") or "").strip(),
+        },
+    }
+    digest = hashlib.sha256(json.dumps(canonical, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PaymentGateway:
+    """
+    Razorpay wrapper with a keep-alive connection pool, per-call timeouts
+    and idempotent order creation backed by the local order store.
+    """
+
+    def __init__(self, key_id: str, key_secret: str, base_url: str = RAZORPAY_BASE_URL,
+                 pool_size: int = RAZORPAY_POOL_SIZE,
+                 timeout: Tuple[float, float] = (RAZORPAY_CONNECT_TIMEOUT, RAZORPAY_READ_TIMEOUT)):
+        self.timeout = timeout
+
+        session = requests.Session()
+        # Only connection failures are retried: the request never reached Razorpay
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.session = session
+
+        self.client = _PooledRazorpayClient(session=session, auth=(key_id, key_secret),
+                                            base_url=base_url)
+
+    def call(self, stage: str, fn, *args, timeout=None, **kwargs):
+        """Invoke a razorpay client method with the pool's timeout, timed as razorpay.<stage>."""
+        try:
+            with metrics.span(f"razorpay.{stage}"):
+                return fn(*args, timeout=timeout or self.timeout, **kwargs)
+        except requests.Timeout as e:
+            raise PaymentGatewayError(f"Razorpay timed out: {e}") from e
+        except requests.ConnectionError as e:
+            raise PaymentGatewayError(f"Could not reach Razorpay: {e}") from e
+
+    def create_order(self, order_data: Dict[str, Any], idempotency_key: Optional[str] = None,
+                     fingerprint: Optional[str] = None, timeout=None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Create a Razorpay order. With an idempotency key, a retry for the same
+        cart returns the order created the first time instead of a new one.
+        fingerprint (cart_hash of the request) is stored with the key; reusing the key
+        for a different request raises IdempotencyKeyReused instead of replaying.
+        Returns (order, replayed).
+        """
+        if not idempotency_key:
+            order = self.call("order.create", self.client.order.create, data=order_data, timeout=timeout)
+            order_store.record_order(order)
+            return order, False
+
+        timeout = timeout or self.timeout
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+
+        # The order store's claim is the only lock: it serialises same-key creates across
+        # threads and workers without holding anyone up during the Razorpay call
+        deadline = time.monotonic() + read_timeout
+        while True:
+            claim = order_store.claim_idempotency_key(
+                idempotency_key, IDEMPOTENCY_WINDOW, stale_after=read_timeout * 2, fingerprint=fingerprint
+            )
+            if claim["state"] == "conflict":
+                raise IdempotencyKeyReused("Idempotency-Key was already used for a different order")
+            if claim["state"] == "existing":
+                return claim["order"], True
+            if claim["state"] == "claimed":
+                break
+            # Another worker is creating this order; wait for it to land
+            if time.monotonic() > deadline:
+                raise PaymentGatewayError("Order creation for this cart is still in progress")
+            time.sleep(0.05)
+
+        data = dict(order_data)
+        data.setdefault("receipt", idempotency_key[:40])
+        try:
+            order = self.call("order.create", self.client.order.create, data=data, timeout=timeout)
+        except Exception:
+            order_store.release_idempotency_key(idempotency_key)
+            raise
+        order_store.record_order(order, idempotency_key)
+        return order, False
+
+    def verify_payment_signature(self, params: Dict[str, str]) -> None:
+        """Verify a checkout signature and mark the order paid."""
+        with metrics.span("razorpay.verify_signature"):
+            self.client.utility.verify_payment_signature(params)
+        order_store.update_order_status(params["razorpay_order_id"], "paid",
+                                        params.get("razorpay_payment_id"))
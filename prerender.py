@@ -0,0 +1,228 @@
+"""
+Pre-render the curated garment catalog (garments/) on stock model photos, so browsing
+those looks is served from the artifact store and never waits on the Space.
+
+Usage:
+    python prerender.py                              # render every missing look, resumable
+    python prerender.py --concurrency 4 --garments tshirt_white.jpg,hoodie_gray.jpg
+    python prerender.py --force                      # re-render looks already stored
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional, Dict, Any, List
+
+import anyio
+
+import artifact_store
+import image_ingest
+import order_store
+import tryon_service
+from async_space import AsyncSpaceClient
+from image_utils import detect_and_crop_person
+
+GARMENT_DIR = "garments"
+# Stock model photos every catalog garment is rendered on
+MODEL_DIR = os.getenv("PRERENDER_MODEL_DIR", "stock_models")
+# Space calls in flight at once; keep low so pre-rendering doesn't crowd out live try-ons
+PRERENDER_CONCURRENCY = int(os.getenv("PRERENDER_CONCURRENCY", "2"))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS prerendered_looks (
+    look_id TEXT PRIMARY KEY,
+    garment TEXT NOT NULL,
+    model TEXT NOT NULL,
+    artifact_path TEXT NOT NULL,
+    rendered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_looks_garment ON prerendered_looks(garment);
+""")
+
+
+def catalog(directory: str) -> List[str]:
+    """Image files in a catalog directory, sorted by name."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def file_sha(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def look_id(garment_sha: str, model_sha: str) -> str:
+    """Identity of a look: garment and model contents plus the try-on options, so edits re-render."""
+    options = json.dumps(tryon_service.TRYON_OPTIONS, sort_keys=True)
+    return hashlib.sha256(f"{garment_sha}:{model_sha}:{options}".encode()).hexdigest()[:32]
+
+
+def garment_description(path: str) -> str:
+    """'tshirt_white.jpg' -> 'tshirt white'."""
+    return os.path.splitext(os.path.basename(path))[0].replace("_", " ").replace("-", " ")
+
+
+def get_look(look: str) -> Optional[Dict[str, Any]]:
+    row = order_store.get_connection().execute(
+        "SELECT * FROM prerendered_looks WHERE look_id = ?", (look,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def list_looks(garment: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Stored looks, optionally for one garment file name."""
+    conn = order_store.get_connection()
+    if garment:
+        rows = conn.execute("SELECT * FROM prerendered_looks WHERE garment = ? ORDER BY model",
+                            (garment,)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM prerendered_looks ORDER BY garment, model").fetchall()
+    return [dict(row) for row in rows]
+
+
+def _record_look(look: str, garment: str, model: str, artifact_path: str) -> None:
+    order_store.get_connection().execute(
+        "INSERT OR REPLACE INTO prerendered_looks (look_id, garment, model, artifact_path, rendered_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (look, garment, model, artifact_path, time.time())
+    )
+
+
+def plan(garments: List[str], models: List[str], force: bool = False) -> List[Dict[str, Any]]:
+    """Garment x model jobs still to render (all of them with force)."""
+    model_shas = {model: file_sha(model) for model in models}
+    jobs = []
+    for garment in garments:
+        garment_sha = file_sha(garment)
+        for model in models:
+            look = look_id(garment_sha, model_shas[model])
+            stored = get_look(look)
+            if not force and stored and os.path.exists(stored["artifact_path"]):
+                continue  # resumable: rendered by an earlier run
+            jobs.append({"look_id": look, "garment": garment, "model": model})
+    return jobs
+
+
+class _Models:
+    """Crops and uploads each stock model photo once, shared by all its garments."""
+
+    def __init__(self, space: AsyncSpaceClient, limiter: anyio.CapacityLimiter):
+        self.space = space
+        self.limiter = limiter
+        self._refs: Dict[str, str] = {}
+        self._locks: Dict[str, anyio.Lock] = {}
+
+    async def person_ref(self, model: str) -> str:
+        lock = self._locks.setdefault(model, anyio.Lock())
+        async with lock:
+            if model not in self._refs:
+                work_path = _work_copy(model)
+                cropped_path = None
+                try:
+                    await anyio.to_thread.run_sync(image_ingest.prepare_upload, work_path, limiter=self.limiter)
+                    cropped_path = await anyio.to_thread.run_sync(detect_and_crop_person, work_path,
+                                                                  limiter=self.limiter)
+                    self._refs[model] = await self.space.upload_input(cropped_path)
+                finally:
+                    tryon_service.remove_files([work_path, cropped_path])
+            return self._refs[model]
+
+
+def _work_copy(path: str) -> str:
+    """Scratch copy of a catalog image (ingestion rewrites files in place)."""
+    work_path = artifact_store.store.scratch_path(os.path.splitext(path)[1].lower())
+    shutil.copy(path, work_path)
+    return work_path
+
+
+async def render_all(jobs: List[Dict[str, Any]], space: AsyncSpaceClient,
+                     concurrency: int = PRERENDER_CONCURRENCY) -> Dict[str, int]:
+    """Render jobs with at most `concurrency` Space calls in flight; each look is stored as it finishes."""
+    counts = {"rendered": 0, "failed": 0}
+    cpu_limiter = anyio.CapacityLimiter(2)
+    space_limiter = anyio.CapacityLimiter(max(1, concurrency))
+    models = _Models(space, cpu_limiter)
+    total = len(jobs)
+
+    async def render(job: Dict[str, Any]) -> None:
+        garment_name = os.path.basename(job["garment"])
+        model_name = os.path.basename(job["model"])
+        async with space_limiter:
+            garment_path = result_path = None
+            try:
+                garment_path = _work_copy(job["garment"])
+                person_ref = await models.person_ref(job["model"])
+                await anyio.to_thread.run_sync(image_ingest.prepare_upload, garment_path, limiter=cpu_limiter)
+                result_path = await space.tryon(None, garment_path, garment_description(job["garment"]),
+                                                os.path.dirname(garment_path), person_ref=person_ref,
+                                                **tryon_service.TRYON_OPTIONS)
+                stored = await anyio.to_thread.run_sync(artifact_store.store.put_file, result_path, "prerender")
+                result_path = None
+                _record_look(job["look_id"], garment_name, model_name, stored)
+                counts["rendered"] += 1
+                print(f"✅ [{counts['rendered'] + counts['failed']}/{total}] {garment_name} on {model_name}")
+            except Exception as e:
+                # Anything one look raises (a bad Space response, a crop error) fails that look only;
+                # letting it escape would cancel the task group and every other render with it
+                counts["failed"] += 1
+                print(f"❌ [{counts['rendered'] + counts['failed']}/{total}] {garment_name} on {model_name}: {e}")
+            finally:
+                tryon_service.remove_files([garment_path, result_path])
+
+    async with anyio.create_task_group() as tg:
+        for job in jobs:
+            tg.start_soon(render, job)
+    return counts
+
+
+async def prerender(garments: List[str], models: List[str], space_src: str, hf_token: str = "",
+                    concurrency: int = PRERENDER_CONCURRENCY, force: bool = False) -> Dict[str, int]:
+    """Plan and render every missing garment x model look."""
+    jobs = plan(garments, models, force)
+    skipped = len(garments) * len(models) - len(jobs)
+    print(f"🎨 {len(jobs)} looks to render ({skipped} already stored), {concurrency} at a time")
+    if not jobs:
+        return {"rendered": 0, "failed": 0, "skipped": skipped}
+    space = AsyncSpaceClient(space_src, hf_token=hf_token)
+    try:
+        counts = await render_all(jobs, space, concurrency)
+    finally:
+        await space.aclose()
+    return {**counts, "skipped": skipped}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Pre-render catalog garments on stock model photos")
+    parser.add_argument("--garments", help="comma-separated garment file names (default: all of garments/)")
+    parser.add_argument("--models", help="comma-separated model file names (default: all of the model dir)")
+    parser.add_argument("--garment-dir", default=GARMENT_DIR)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--concurrency", type=int, default=PRERENDER_CONCURRENCY, help="Space calls in flight")
+    parser.add_argument("--force", action="store_true", help="re-render looks that are already stored")
+    args = parser.parse_args()
+
+    garments = catalog(args.garment_dir)
+    models = catalog(args.model_dir)
+    if args.garments:
+        keep = set(args.garments.split(","))
+        garments = [g for g in garments if os.path.basename(g) in keep]
+    if args.models:
+        keep = set(args.models.split(","))
+        models = [m for m in models if os.path.basename(m) in keep]
+    if not garments or not models:
+        parser.error(f"need at least one garment in {args.garment_dir}/ and one model photo in {args.model_dir}/")
+
+    counts = anyio.run(prerender, garments, models, os.getenv("TRYON_SPACE", "yisol/IDM-VTON"),
+                       os.getenv("HF_TOKEN", "").strip(), args.concurrency, args.force)
+    print(json.dumps(counts, indent=2))
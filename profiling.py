@@ -0,0 +1,285 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple
+
+import metrics
+from jsonl_log import JsonlLog
+
+# Requests slower than this get their stage breakdown and a profile logged (0 disables)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "60000"))
+SLOW_REQUEST_LOG = os.getenv("SLOW_REQUEST_LOG", os.path.join("logs", "slow_requests.jsonl"))
+SLOW_REQUEST_SAMPLE_HZ = float(os.getenv("SLOW_REQUEST_SAMPLE_HZ", "20"))
+MAX_PROFILE_SECONDS = 60
+MAX_SAMPLE_HZ = 1000
+MAX_STACKS_PER_REQUEST = 500
+
+_labels: Dict[Any, str] = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame's call stack root-first, ';'-separated (flamegraph collapsed format)."""
+    parts = []
+    while frame is not None:
+        parts.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def format_collapsed(stacks: Counter) -> str:
+    """One 'stack count' line per stack, as read by flamegraph.pl and speedscope."""
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+def sample_threads(seconds: float, hz: float = 200.0) -> Counter:
+    """Sample the stacks of every other thread in the process for a number of seconds."""
+    own = threading.get_ident()
+    interval = 1.0 / hz
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                stacks[collapse_stack(frame)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class _RequestProfileSession:
+    """Aggregates per-request cProfile runs for requests started during a capture window."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Optional[pstats.Stats] = None
+
+    def add(self, profile: cProfile.Profile) -> None:
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+
+_cprofile_session: Optional[_RequestProfileSession] = None
+
+
+def cprofile_requests(seconds: float) -> str:
+    """
+    Deterministically profile every request that starts within the window, including its
+    streamed or pooled work that finishes inside it, and return the merged pstats report
+    (sorted by cumulative time).
+    """
+    global _cprofile_session
+    session = _RequestProfileSession()
+    _cprofile_session = session
+    try:
+        time.sleep(seconds)
+    finally:
+        _cprofile_session = None
+
+    if session.stats is None:
+        return "No requests were handled during the capture window.\n"
+    out = io.StringIO()
+    session.stats.stream = out
+    session.stats.sort_stats("cumulative").print_stats(100)
+    return out.getvalue()
+
+
+def capture_profile(seconds: float, mode: str = "sample", hz: float = 200.0) -> str:
+    """Run an on-demand capture. 'sample' returns collapsed stacks, 'cprofile' a pstats report."""
+    seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+    hz = max(1.0, min(float(hz), MAX_SAMPLE_HZ))
+    if mode == "cprofile":
+        return cprofile_requests(seconds)
+    return format_collapsed(sample_threads(seconds, hz))
+
+
+class RequestTrace:
+    """One tracked request: the threads doing its work, their sampled stacks and its stage timings."""
+
+    def __init__(self, stages: List[Tuple[str, float]], own_thread: bool = True):
+        self.stacks: Counter = Counter()
+        # ident -> nesting depth
+        self.threads: Dict[int, int] = {threading.get_ident(): 1} if own_thread else {}
+        self.profile = None
+        self.session: Optional[_RequestProfileSession] = None  # cProfile capture it started in, if any
+        self.stages = stages
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+# Whether this thread is being cProfiled for a request: one profiler per thread at a time
+_thread_profiled = threading.local()
+
+
+def _start_thread_profile() -> Optional[cProfile.Profile]:
+    if getattr(_thread_profiled, "active", False):
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return None  # another profiler is already active in this thread
+    _thread_profiled.active = True
+    return profile
+
+
+def _stop_thread_profile(profile: cProfile.Profile, session: _RequestProfileSession) -> None:
+    profile.disable()
+    _thread_profiled.active = False
+    session.add(profile)
+
+
+class SlowRequestTracker:
+    """
+    Samples the stacks of in-flight requests at a low rate and, for requests slower than the
+    threshold, writes the stage breakdown and profile to a JSONL log. A request is tracked
+    from begin() until end(); work it hands to other threads (a streamed response's generator,
+    a batch's pool) is sampled too while it runs inside attach().
+    Samples of fast requests are simply dropped.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_MS, log_path: str = SLOW_REQUEST_LOG,
+                 hz: float = SLOW_REQUEST_SAMPLE_HZ):
+        self.threshold_ms = threshold_ms
+        self.interval = 1.0 / hz
+        self.log = JsonlLog(log_path) if threshold_ms > 0 else None
+        self._active: Dict[int, RequestTrace] = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.log is not None
+
+    def _ensure_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="slow-request-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for trace in self._active.values():
+                    stacks = trace.stacks
+                    for ident in trace.threads:
+                        frame = frames.get(ident)
+                        if frame is None:
+                            continue
+                        stack = collapse_stack(frame)
+                        if stack in stacks or len(stacks) < MAX_STACKS_PER_REQUEST:
+                            stacks[stack] += 1
+
+    def begin(self, own_thread: bool = True) -> None:
+        """
+        Start tracking the calling request (after metrics.begin_request()). Pass own_thread=False
+        from an event loop: the thread is shared with other requests, so only the work the
+        request hands to attach() is sampled and profiled.
+        """
+        trace = RequestTrace(metrics.request_stages(), own_thread)
+        trace.session = _cprofile_session
+        if trace.session is not None and own_thread:
+            profile = _start_thread_profile()
+            if profile is not None:
+                trace.profile = (trace.session, profile)
+        if not self.enabled and trace.session is None:
+            _current_trace.set(None)  # pooled threads keep the last request's context
+            return
+        _current_trace.set(trace)
+        with self._lock:
+            self._active[id(trace)] = trace
+            if self.enabled:
+                self._ensure_sampler()
+
+    def current(self) -> Optional[RequestTrace]:
+        """The calling request's trace (None if untracked): hand it to end() and attach()."""
+        return _current_trace.get()
+
+    def stop_profile(self, trace: Optional[RequestTrace]) -> None:
+        """
+        Stop the cProfile run begin() started; call from the same thread, when the handler returns.
+        Work done later (a streamed body, a batch's pool) is profiled by attach().
+        """
+        if trace is not None and trace.profile is not None:
+            session, profile = trace.profile
+            trace.profile = None
+            _stop_thread_profile(profile, session)
+
+    @contextmanager
+    def attach(self, trace: Optional[RequestTrace] = None):
+        """
+        Sample the calling thread as part of a request (default: the context's) while inside,
+        and cProfile it too if the request started during a cprofile capture.
+        """
+        trace = trace or _current_trace.get()
+        if trace is None:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            trace.threads[ident] = trace.threads.get(ident, 0) + 1
+        # None when this thread is already profiled (attach() nested in itself or begin())
+        profile = _start_thread_profile() if trace.session is not None else None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                _stop_thread_profile(profile, trace.session)
+            with self._lock:
+                depth = trace.threads.pop(ident, 1) - 1
+                if depth > 0:
+                    trace.threads[ident] = depth
+
+    def traced(self, fn, trace: Optional[RequestTrace] = None):
+        """fn wrapped to run inside attach(), for submitting a request's work to a pool."""
+        trace = trace or _current_trace.get()
+
+        def run(*args, **kwargs):
+            with self.attach(trace):
+                return fn(*args, **kwargs)
+        return run
+
+    def end(self, trace: Optional[RequestTrace], route: str, method: str, status: int, duration: float) -> None:
+        """Stop tracking a request once all its work is done and log it if it was slow."""
+        if trace is None:
+            return
+        with self._lock:
+            if self._active.pop(id(trace), None) is None:
+                return
+        self.stop_profile(trace)
+
+        duration_ms = duration * 1000
+        if not self.enabled or duration_ms < self.threshold_ms:
+            return
+        self.log.write({
+            "ts": time.time(),
+            "route": route,
+            "method": method,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "stages": [{"stage": name, "ms": round(seconds * 1000, 2)} for name, seconds in list(trace.stages)],
+            "profile": {
+                "format": "collapsed",
+                "sample_interval_ms": round(self.interval * 1000, 2),
+                "stacks": dict(trace.stacks.most_common()),
+            },
+        })
+        print(f"🐢 Slow request {method} {route} took {duration_ms:.0f}ms (logged to {self.log.path})")
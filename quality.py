@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional, Dict, Any, Tuple
+
+import artifact_store
+import metrics
+import order_store
+import tryon_service
+
+# Denoise steps per quality tier, cheapest first; IDM-VTON allows at most 40
+TIERS = {
+    "preview": int(os.getenv("TRYON_PREVIEW_STEPS", "20")),
+    "standard": int(os.getenv("TRYON_STANDARD_STEPS", "30")),
+    "max": int(os.getenv("TRYON_MAX_STEPS", "40")),
+}
+TIER_ORDER = list(TIERS)
+BEST_TIER = TIER_ORDER[-1]
+ADAPTIVE = "auto"
+# Tier of requests that don't ask for one ("auto" picks by load)
+DEFAULT_TIER = os.getenv("TRYON_DEFAULT_TIER", ADAPTIVE)
+# Adaptive mode drops one tier when this many try-ons wait for a Space slot, or the recent p95
+# Space call takes longer than this; two tiers at twice either threshold (0 disables a signal)
+DOWNGRADE_QUEUE_DEPTH = int(os.getenv("TRYON_DOWNGRADE_QUEUE", "4"))
+DOWNGRADE_P95_SECONDS = float(os.getenv("TRYON_DOWNGRADE_P95", "60"))
+# Re-render lower-tier results at the best tier in the background while Space slots are idle
+UPGRADE_PREVIEWS = os.getenv("TRYON_UPGRADE_PREVIEWS", "true").lower() == "true"
+# A background upgrade still pending after this long was lost with its worker
+UPGRADE_STALE_SECONDS = 600
+TIER_METRIC = "verse_tryon_tier_total"
+UPGRADE_METRIC = "verse_tryon_upgrades_total"
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS tryon_results (
+    result_key TEXT PRIMARY KEY,
+    tier TEXT NOT NULL,
+    artifact_path TEXT,
+    updated_at REAL NOT NULL
+);
+""")
+
+
+def requested(value: Optional[str]) -> str:
+    """The tier a request asks for (form field 'quality'); raises ValueError for unknown names."""
+    tier = (value or DEFAULT_TIER).strip().lower()
+    if tier != ADAPTIVE and tier not in TIERS:
+        raise ValueError(f"Unknown quality tier '{tier}' (use {ADAPTIVE}, {', '.join(TIER_ORDER)})")
+    return tier
+
+
+def options(tier: str) -> Dict[str, Any]:
+    """IDM-VTON /tryon options for a tier."""
+    return {**tryon_service.TRYON_OPTIONS, "denoise_steps": TIERS[tier]}
+
+
+def choose(tier: str, queued: int, p95: Optional[float]) -> Tuple[str, bool]:
+    """
+    Resolve a requested tier to the one to render and whether it was degraded. Named tiers are
+    honoured; "auto" gets the best tier unless the queue or recent latency says to drop.
+    """
+    if tier != ADAPTIVE:
+        metrics.inc(TIER_METRIC, tier=tier, mode="requested")
+        return tier, False
+    pressure = 0.0
+    if DOWNGRADE_QUEUE_DEPTH > 0:
+        pressure = queued / DOWNGRADE_QUEUE_DEPTH
+    if DOWNGRADE_P95_SECONDS > 0 and p95 is not None:
+        pressure = max(pressure, p95 / DOWNGRADE_P95_SECONDS)
+    drop = 2 if pressure >= 2 else 1 if pressure >= 1 else 0
+    chosen = TIER_ORDER[max(0, len(TIER_ORDER) - 1 - drop)]
+    metrics.inc(TIER_METRIC, tier=chosen, mode=ADAPTIVE)
+    return chosen, drop > 0
+
+
+def input_key(person_path: str, garment_path: str, description: str) -> str:
+    """Identity of a try-on's inputs (after ingestion), shared by all its tiers."""
+    digest = hashlib.sha256()
+    for path in (person_path, garment_path):
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        digest.update(b"\0")
+    digest.update(description.encode())
+    return digest.hexdigest()
+
+
+def result_key(inputs: str, tier: str) -> str:
+    """Cache key of one tier's result: inputs plus that tier's options, so each tier is cached separately."""
+    tier_options = json.dumps(options(tier), sort_keys=True)
+    return hashlib.sha256(f"{inputs}:{tier}:{tier_options}".encode()).hexdigest()[:32]
+
+
+def get_result(key: str) -> Optional[Dict[str, Any]]:
+    row = order_store.get_connection().execute(
+        "SELECT * FROM tryon_results WHERE result_key = ?", (key,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def cached(inputs: str, tier: str) -> Optional[Tuple[str, str]]:
+    """(tier, path) of the best stored result at `tier` or above, if any."""
+    for candidate in reversed(TIER_ORDER[TIER_ORDER.index(tier):]):
+        row = get_result(result_key(inputs, candidate))
+        if row and row["artifact_path"] and os.path.exists(row["artifact_path"]):
+            artifact_store.store.touch(row["artifact_path"])
+            return candidate, row["artifact_path"]
+    return None
+
+
+def store(inputs: str, tier: str, result_path: str) -> str:
+    """Move a rendered result into the artifact store under its tier's key; returns the stored path."""
+    stored = artifact_store.store.put_file(result_path, "results")
+    download_dir = os.path.dirname(os.path.abspath(result_path))
+    if download_dir.startswith(os.path.abspath(artifact_store.DOWNLOAD_DIR) + os.sep):
+        try:
+            os.rmdir(download_dir)  # gradio_client's per-download directory, now empty
+        except OSError:
+            pass
+    order_store.get_connection().execute(
+        "INSERT OR REPLACE INTO tryon_results (result_key, tier, artifact_path, updated_at) VALUES (?, ?, ?, ?)",
+        (result_key(inputs, tier), tier, stored, time.time())
+    )
+    return stored
+
+
+def pending(row: Dict[str, Any]) -> bool:
+    """True for a background upgrade that is still being rendered."""
+    return row["artifact_path"] is None and time.time() - row["updated_at"] < UPGRADE_STALE_SECONDS
+
+
+def claim_upgrade(inputs: str) -> bool:
+    """Mark the best-tier render of these inputs as pending; False if it is already pending or stored."""
+    key = result_key(inputs, BEST_TIER)
+    conn = order_store.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT * FROM tryon_results WHERE result_key = ?", (key,)).fetchone()
+        if row is not None and (row["artifact_path"] is not None and os.path.exists(row["artifact_path"])
+                                or pending(dict(row))):
+            conn.execute("COMMIT")
+            return False
+        conn.execute("INSERT OR REPLACE INTO tryon_results (result_key, tier, artifact_path, updated_at) "
+                     "VALUES (?, ?, NULL, ?)", (key, BEST_TIER, time.time()))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def abandon_upgrade(inputs: str, result: str) -> None:
+    """Drop a claimed upgrade that won't be rendered (result: 'skipped' or 'failed')."""
+    order_store.get_connection().execute(
+        "DELETE FROM tryon_results WHERE result_key = ? AND artifact_path IS NULL",
+        (result_key(inputs, BEST_TIER),)
+    )
+    metrics.inc(UPGRADE_METRIC, result=result)
+
+
+def wants_upgrade(tier: str) -> bool:
+    return UPGRADE_PREVIEWS and tier != BEST_TIER
+
+
+def work_copies(*paths: str) -> Tuple[str, ...]:
+    """Scratch copies of a request's inputs that outlive it, for a background upgrade."""
+    copies = []
+    for path in paths:
+        copy = artifact_store.store.scratch_path(os.path.splitext(path)[1].lower())
+        shutil.copy(path, copy)
+        copies.append(copy)
+    return tuple(copies)
+
+
+def describe(requested_tier: str, tier: str, degraded: bool, from_cache: bool,
+             upgrade: bool = False, inputs: Optional[str] = None) -> Dict[str, Any]:
+    """Response fields saying which tier was served, and where its best-tier upgrade will appear."""
+    fields: Dict[str, Any] = {"quality": {"tier": tier, "requested": requested_tier, "degraded": degraded,
+                                          "cached": from_cache}}
+    if upgrade and inputs is not None:
+        fields["upgrade"] = {"tier": BEST_TIER, "url": f"/api/tryon/results/{result_key(inputs, BEST_TIER)}"}
+    return fields
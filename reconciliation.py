@@ -0,0 +1,269 @@
+"""
+Reconcile payments captured in Razorpay against orders recorded locally.
+
+Usage:
+    python reconciliation.py                  # resume from the last checkpoint
+    python reconciliation.py --since 2025-12-01 --workers 16
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+import order_store
+
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "8"))
+RECONCILE_MAX_WORKERS = 32  # Razorpay rate-limits well before this
+RECONCILE_WINDOW = int(os.getenv("RECONCILE_WINDOW", "3600"))        # seconds of payments per task
+RECONCILE_OVERLAP = int(os.getenv("RECONCILE_OVERLAP", "3600"))      # re-read before the checkpoint
+RECONCILE_DEFAULT_LOOKBACK = int(os.getenv("RECONCILE_DEFAULT_LOOKBACK", str(7 * 86400)))
+RECONCILE_REPORT_PATH = os.path.join(order_store.DATA_DIR, "reconciliation_report.json")
+PAGE_SIZE = 100  # Razorpay's maximum page size
+MAX_REPORTED = 100  # examples kept per mismatch kind
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id TEXT PRIMARY KEY,
+    order_id TEXT,
+    amount INTEGER,
+    currency TEXT,
+    status TEXT,
+    method TEXT,
+    created_at INTEGER,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payments_order ON payments(order_id);
+CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+""")
+
+_run_lock = threading.Lock()
+_state = {"running": False, "last_report": None, "error": None}
+
+
+def get_checkpoint(name: str = "payments") -> Optional[float]:
+    row = order_store.get_connection().execute(
+        "SELECT value FROM checkpoints WHERE name = ?", (name,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_checkpoint(value: float, name: str = "payments") -> None:
+    """Advance the checkpoint to value; it never moves backwards."""
+    order_store.get_connection().execute(
+        "INSERT INTO checkpoints (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)", (name, value)
+    )
+
+
+def _store_page(payments: List[Dict[str, Any]]) -> None:
+    now = time.time()
+    conn = order_store.get_connection()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO payments "
+            "(payment_id, order_id, amount, currency, status, method, created_at, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(p["id"], p.get("order_id"), p.get("amount"), p.get("currency"), p.get("status"),
+              p.get("method"), p.get("created_at"), now) for p in payments]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _fetch_window(gateway, start: int, end: int, retries: int = 3) -> int:
+    """Page through one time window, streaming each page into the local index."""
+    fetched = 0
+    skip = 0
+    while True:
+        params = {"from": start, "to": end - 1, "count": PAGE_SIZE, "skip": skip}
+        for attempt in range(retries + 1):
+            try:
+                page = gateway.call("payment.all", gateway.client.payment.all, params)
+                break
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                # Rate limits and transient errors: back off and retry this page
+                print(f"⚠️  Payment page {start}+{skip} failed ({e}), retrying...")
+                time.sleep(0.5 * (2 ** attempt))
+
+        items = page.get("items", [])
+        if items:
+            _store_page(items)
+        fetched += len(items)
+        if len(items) < PAGE_SIZE:
+            return fetched
+        skip += PAGE_SIZE
+
+
+def sync_payments(gateway, start: int, end: int, workers: int = RECONCILE_WORKERS,
+                  window: int = RECONCILE_WINDOW, checkpoint: bool = True) -> int:
+    """
+    Fetch all payments created in [start, end) with bounded parallelism.
+    The checkpoint only advances over a contiguous prefix of finished windows,
+    so an interrupted run resumes without gaps. Pass checkpoint=False for a range that
+    didn't start at the checkpoint: advancing it then would skip what lies in between.
+    """
+    windows = [(s, min(s + window, end)) for s in range(start, end, window)]
+    done = set()
+    next_index = 0
+    fetched = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_fetch_window, gateway, s, e): i for i, (s, e) in enumerate(windows)}
+        for future in as_completed(futures):
+            fetched += future.result()
+            done.add(futures[future])
+            advanced = False
+            while next_index in done:
+                next_index += 1
+                advanced = True
+            if advanced and checkpoint:
+                set_checkpoint(windows[next_index - 1][1])
+
+    return fetched
+
+
+def find_mismatches(start: int, end: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Compare the payment index with recorded orders for payments created in [start, end)."""
+    conn = order_store.get_connection()
+    queries = {
+        # Razorpay captured money but our order is missing or not marked paid
+        "captured_but_unrecorded": """
+            SELECT p.payment_id, p.order_id, p.amount, o.status AS order_status
+            FROM payments p LEFT JOIN orders o ON o.order_id = p.order_id
+            WHERE p.status = 'captured' AND p.created_at >= ? AND p.created_at < ?
+              AND (o.order_id IS NULL OR o.status NOT IN ('paid', 'refunded'))
+        """,
+        # We marked the order paid, but the payment behind it did not capture
+        "recorded_but_failed": """
+            SELECT o.order_id, o.payment_id, p.status AS payment_status
+            FROM orders o JOIN payments p ON p.payment_id = o.payment_id
+            WHERE o.status = 'paid' AND p.status NOT IN ('captured', 'refunded')
+              AND p.created_at >= ? AND p.created_at < ?
+        """,
+        "amount_mismatch": """
+            SELECT p.payment_id, p.order_id, p.amount AS paid_amount, o.amount AS order_amount
+            FROM payments p JOIN orders o ON o.order_id = p.order_id
+            WHERE p.status = 'captured' AND p.amount != o.amount
+              AND p.created_at >= ? AND p.created_at < ?
+        """,
+    }
+    return {
+        kind: [dict(r) for r in conn.execute(sql, (start, end)).fetchall()]
+        for kind, sql in queries.items()
+    }
+
+
+def reconcile(gateway, since: Optional[int] = None, until: Optional[int] = None,
+              workers: int = RECONCILE_WORKERS) -> Dict[str, Any]:
+    """
+    Sync payments incrementally from the checkpoint and report mismatches. An explicit
+    since (a backfill or ad-hoc range) leaves the checkpoint alone.
+    """
+    started = time.time()
+    until = int(until or started)
+    incremental = since is None
+    if since is None:
+        checkpoint = get_checkpoint()
+        since = int(checkpoint - RECONCILE_OVERLAP) if checkpoint else until - RECONCILE_DEFAULT_LOOKBACK
+
+    print(f"🔄 Reconciling payments from {datetime.fromtimestamp(since)} to {datetime.fromtimestamp(until)}...")
+    fetched = sync_payments(gateway, since, until, workers=workers, checkpoint=incremental)
+    mismatches = find_mismatches(since, until)
+
+    report = {
+        "from": since,
+        "to": until,
+        "paymentsFetched": fetched,
+        "durationSeconds": round(time.time() - started, 2),
+        "counts": {kind: len(rows) for kind, rows in mismatches.items()},
+        "mismatches": {kind: rows[:MAX_REPORTED] for kind, rows in mismatches.items()},
+        "generatedAt": str(datetime.now()),
+    }
+    os.makedirs(os.path.dirname(RECONCILE_REPORT_PATH) or ".", exist_ok=True)
+    with open(RECONCILE_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ Reconciled {fetched} payments in {report['durationSeconds']}s: {report['counts']}")
+    return report
+
+
+def start_background(gateway, **kwargs) -> bool:
+    """Run reconcile() in a background thread. Returns False if a run is already active."""
+    if not _run_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        _state.update(running=True, error=None)
+        try:
+            _state["last_report"] = reconcile(gateway, **kwargs)
+        except Exception as e:
+            print(f"❌ Reconciliation failed: {e}")
+            _state["error"] = str(e)
+        finally:
+            _state["running"] = False
+            _run_lock.release()
+
+    threading.Thread(target=run, name="reconciliation", daemon=True).start()
+    return True
+
+
+def status() -> Dict[str, Any]:
+    """Current run state and the most recent report (from disk if this process has none)."""
+    report = _state["last_report"]
+    if report is None and os.path.exists(RECONCILE_REPORT_PATH):
+        with open(RECONCILE_REPORT_PATH) as f:
+            report = json.load(f)
+    return {"running": _state["running"], "error": _state["error"], "lastReport": report}
+
+
+def parse_date(value) -> int:
+    """Epoch seconds from an ISO date/datetime or a number of epoch seconds; raises ValueError."""
+    if isinstance(value, bool):
+        raise ValueError(f"Not a date: {value!r}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        raise ValueError(f"Not a date: {value!r}")
+    if value.strip().isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value.strip()).timestamp())
+
+
+def parse_workers(value) -> int:
+    """A worker count between 1 and RECONCILE_MAX_WORKERS; raises ValueError."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"workers must be an integer, got {value!r}")
+    workers = int(value)
+    if not 1 <= workers <= RECONCILE_MAX_WORKERS:
+        raise ValueError(f"workers must be between 1 and {RECONCILE_MAX_WORKERS}")
+    return workers
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from payment_gateway import PaymentGateway
+
+    parser = argparse.ArgumentParser(description="Reconcile Razorpay payments against local orders")
+    parser.add_argument("--since", type=parse_date, help="start date (ISO), default: last checkpoint")
+    parser.add_argument("--until", type=parse_date, help="end date (ISO), default: now")
+    parser.add_argument("--workers", type=parse_workers, default=RECONCILE_WORKERS, help="parallel page fetchers")
+    args = parser.parse_args()
+
+    gateway = PaymentGateway(os.getenv("RAZORPAY_KEY_ID", ""), os.getenv("RAZORPAY_KEY_SECRET", ""))
+    report = reconcile(gateway, since=args.since, until=args.until, workers=args.workers)
+    print(json.dumps(report["counts"], indent=2))
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import os
+from typing import Optional, Dict, Any, List
+
+import order_store
+
+# Priority classes and their fair-share weights: with one request of each class queued,
+# a checkout request is dispatched WEIGHT times as often as an anonymous one
+PRIORITY_WEIGHTS = {
+    "checkout": float(os.getenv("TRYON_WEIGHT_CHECKOUT", "8")),
+    "logged_in": float(os.getenv("TRYON_WEIGHT_LOGGED_IN", "3")),
+    "anonymous": float(os.getenv("TRYON_WEIGHT_ANONYMOUS", "1")),
+}
+DEFAULT_CLASS = "anonymous"
+
+QUEUE_WAIT_METRIC = "verse_tryon_queue_wait_seconds"
+
+
+def classify(headers, cookies=None) -> str:
+    """
+    Priority class of a try-on request:
+    - checkout: X-Verse-Order-Id names an unpaid order we created
+    - logged_in: an Authorization header or verse-auth cookie is present, or items in the cart
+    - anonymous: everyone else
+    These are unverified hints: nothing checks that the caller owns the order, and the auth header,
+    cookie and cart count are taken as sent (the server has no sessions to check them against).
+    A client can claim a higher class; the per-client rate limit bounds what that buys it.
+    """
+    order_id = headers.get("X-Verse-Order-Id", "").strip()
+    if order_id:
+        order = order_store.get_order(order_id)
+        if order is not None and order.get("status") == "created":
+            return "checkout"
+    if headers.get("Authorization") or (cookies is not None and cookies.get("verse-auth")):
+        return "logged_in"
+    try:
+        if int(headers.get("X-Verse-Cart-Items", "0")) > 0:
+            return "logged_in"
+    except ValueError:
+        pass
+    return DEFAULT_CLASS
+
+
+class FairQueue:
+    """
+    Weighted fair queue (self-clocked fair queuing) over client flows.
+
+    Each client is its own flow with its class weight; a request's finish tag is
+    max(virtual time, the client's previous tag) + 1/weight and the smallest tag
+    goes first. Heavy clients only push their own later requests back, and higher
+    classes get proportionally more dispatches without starving the rest.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = weights or PRIORITY_WEIGHTS
+        self.virtual_time = 0.0
+        self._heap: List = []
+        self._last_finish: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._size = 0
+        self.by_class: Dict[str, int] = {name: 0 for name in self.weights}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, item, client: str, klass: str) -> None:
+        weight = self.weights.get(klass, self.weights[DEFAULT_CLASS])
+        finish = max(self.virtual_time, self._last_finish.get(client, 0.0)) + 1.0 / weight
+        self._last_finish[client] = finish
+        item.fair_tag = (finish, next(self._seq))
+        item.klass = klass
+        item.queued = True
+        heapq.heappush(self._heap, (finish, item.fair_tag[1], item))
+        self._size += 1
+        self.by_class[klass] = self.by_class.get(klass, 0) + 1
+
+    def pop(self):
+        """Remove and return the item with the smallest finish tag (None if empty)."""
+        while self._heap:
+            finish, _, item = heapq.heappop(self._heap)
+            if not item.queued:
+                continue  # removed earlier (timeout, cancellation or eviction)
+            self._mark_removed(item)
+            self.virtual_time = finish
+            if len(self._last_finish) > 4 * max(16, self._size):
+                self._last_finish = {c: f for c, f in self._last_finish.items() if f > self.virtual_time}
+            return item
+        return None
+
+    def remove(self, item) -> bool:
+        """Drop a queued item (lazily: its heap entry is skipped on pop)."""
+        if not getattr(item, "queued", False):
+            return False
+        self._mark_removed(item)
+        return True
+
+    def lowest(self):
+        """The queued item that would be dispatched last: lowest class weight, then latest tag."""
+        candidates = [entry[2] for entry in self._heap if entry[2].queued]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda item: (-self.weights.get(item.klass, 0.0), item.fair_tag))
+
+    def _mark_removed(self, item) -> None:
+        item.queued = False
+        self._size -= 1
+        self.by_class[item.klass] -= 1
+        if self._size == 0:
+            self._heap.clear()
+        elif len(self._heap) > 2 * self._size + 64:
+            # Compact the heap of lazily removed entries
+            self._heap = [entry for entry in self._heap if entry[2].queued]
+            heapq.heapify(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self._size, "by_class": dict(self.by_class), "virtual_time": round(self.virtual_time, 3)}
@@ -0,0 +1,111 @@
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional, Dict, Any, Iterator
+
+from gradio_client import Client
+from gradio_client.client import Job
+from gradio_client.utils import Status, StatusUpdate
+
+import metrics
+from eta import JobEta
+
+# How often a waiting caller looks at the job: the longest an abandoned job keeps running upstream
+JOB_POLL_INTERVAL = float(os.getenv("TRYON_JOB_POLL_INTERVAL", "0.5"))
+CANCELLED_METRIC = "verse_tryon_cancelled_total"
+
+STAGES = {
+    Status.STARTING: "submitting",
+    Status.JOINING_QUEUE: "submitting",
+    Status.SENDING_DATA: "submitting",
+    Status.QUEUE_FULL: "queued",
+    Status.IN_QUEUE: "queued",
+    Status.PROCESSING: "processing",
+    Status.ITERATING: "processing",
+    Status.PROGRESS: "processing",
+    Status.LOG: "processing",
+    Status.FINISHED: "finished",
+    Status.CANCELLED: "cancelled",
+}
+
+
+class JobCancelled(Exception):
+    """The caller gave up on a try-on; its upstream job was cancelled."""
+
+
+def describe(status: StatusUpdate) -> Dict[str, Any]:
+    """JSON-friendly progress update: stage, queue position/ETA and model progress when known."""
+    update: Dict[str, Any] = {"stage": STAGES.get(status.code, "processing")}
+    if status.code == Status.IN_QUEUE and status.rank is not None:
+        update["queue_position"] = status.rank + 1
+        if status.queue_size is not None:
+            update["queue_size"] = status.queue_size
+    if status.eta is not None:
+        update["eta"] = round(status.eta, 1)
+    if status.progress_data:
+        unit = status.progress_data[-1]
+        if unit.progress is not None:
+            update["progress"] = round(unit.progress, 3)
+        elif unit.index is not None and unit.length:
+            update["progress"] = round(unit.index / unit.length, 3)
+        if unit.desc:
+            update["detail"] = unit.desc
+    return update
+
+
+class SpaceJob:
+    """
+    A Space prediction submitted through gradio_client's job interface instead of predict(),
+    so an abandoned call can be cancelled upstream. Leaving the with-block before the job
+    finishes (an error, a closed stream, a cancelled batch) cancels it: the Space drops it
+    from its queue, or stops it if it is already running.
+    With a tracker (eta.JobEta), updates carry a predicted completion time.
+    """
+
+    def __init__(self, job: Job, tracker: Optional[JobEta] = None):
+        self.job = job
+        self.tracker = tracker
+
+    @classmethod
+    def submit(cls, client: Client, *args, tracker: Optional[JobEta] = None, **kwargs) -> "SpaceJob":
+        return cls(client.submit(*args, **kwargs), tracker)
+
+    def __enter__(self) -> "SpaceJob":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if not self.job.done():
+            self.cancel("disconnected" if exc_type is GeneratorExit else "abandoned")
+        return False
+
+    def updates(self, cancelled: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """
+        The job's status every poll interval until it finishes (unchanged updates included,
+        so streaming callers write often enough to notice a disconnect).
+        Raises JobCancelled once `cancelled` is set.
+        """
+        while not self.job.done():
+            if cancelled is not None and cancelled.is_set():
+                self.cancel("cancelled")
+                raise JobCancelled("Try-on cancelled")
+            update = describe(self.job.status())
+            yield self.tracker.observe(update) if self.tracker else update
+            try:
+                self.job.result(timeout=JOB_POLL_INTERVAL)
+            except FutureTimeout:
+                pass
+            except Exception:
+                break  # the failure is raised again by result()
+
+    def result(self):
+        result = self.job.result()
+        if self.tracker:
+            self.tracker.finish()
+        return result
+
+    def cancel(self, reason: str) -> None:
+        try:
+            self.job.cancel()
+        except Exception as e:
+            print(f"⚠️  Could not cancel Space job: {e}")
+        metrics.inc(CANCELLED_METRIC, reason=reason)
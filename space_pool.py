@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+import httpx
+
+import metrics
+from async_space import resolve_space_url
+from space_jobs import JobCancelled
+
+# Keep-alive probe interval while customers are around, and the ceiling it backs off to when idle
+SPACE_PROBE_MIN_INTERVAL = float(os.getenv("SPACE_PROBE_MIN_INTERVAL", "60"))
+SPACE_PROBE_MAX_INTERVAL = float(os.getenv("SPACE_PROBE_MAX_INTERVAL", "900"))
+SPACE_PROBE_TIMEOUT = float(os.getenv("SPACE_PROBE_TIMEOUT", "60"))
+# Try-on traffic within this many seconds counts as busy hours (probe at the minimum interval)
+SPACE_TRAFFIC_WINDOW = float(os.getenv("SPACE_TRAFFIC_WINDOW", "1800"))
+
+FAILURES_TO_MARK_DOWN = 3
+# Assumed try-on latency for a Space that hasn't served one yet
+DEFAULT_CALL_SECONDS = 20.0
+EWMA_ALPHA = 0.3
+HISTORY_POINTS = 1440
+PROBE_METRIC = "verse_space_probe_seconds"
+CALL_METRIC = "verse_space_call_seconds"
+
+
+def configured_spaces(default: str) -> List[str]:
+    """Spaces serving /tryon: TRYON_SPACES (comma-separated), else just the default (TRYON_SPACE)."""
+    spaces = [s.strip() for s in os.getenv("TRYON_SPACES", "").split(",") if s.strip()]
+    return spaces or [default]
+
+
+class SpaceHealth:
+    """Rolling health of one Space: up/down, latency EWMAs and a bounded history of samples."""
+
+    def __init__(self, src: str):
+        self.src = src
+        self.root = resolve_space_url(src)
+        self.up = True  # optimistic until proven otherwise
+        self.consecutive_failures = 0
+        self.call_seconds: Optional[float] = None
+        self.probe_seconds: Optional[float] = None
+        self.inflight = 0
+        self.last_used = 0.0
+        self.last_probe = 0.0
+        # (timestamp, source, ok, seconds) with source "probe" or "request"
+        self.history: deque = deque(maxlen=HISTORY_POINTS)
+
+    def score(self) -> float:
+        """Expected wait for a new request here; lower is better."""
+        call = self.call_seconds if self.call_seconds is not None else DEFAULT_CALL_SECONDS
+        # A slow probe means the Space is waking up (or overloaded) and will be slow to answer too
+        return call * (1 + self.inflight) + (self.probe_seconds or 0.0)
+
+    def summary(self) -> Dict[str, Any]:
+        samples = list(self.history)
+        ok = sum(1 for _, _, success, _ in samples if success)
+        return {
+            "space": self.src,
+            "url": self.root,
+            "up": self.up,
+            "inflight": self.inflight,
+            "consecutive_failures": self.consecutive_failures,
+            "call_seconds_ewma": round(self.call_seconds, 2) if self.call_seconds is not None else None,
+            "probe_seconds_ewma": round(self.probe_seconds, 3) if self.probe_seconds is not None else None,
+            "availability": round(ok / len(samples), 4) if samples else None,
+            "samples": len(samples),
+            "last_used": self.last_used or None,
+            "last_probe": self.last_probe or None,
+        }
+
+
+class SpacePool:
+    """
+    Routes try-ons to the healthiest configured Space and keeps idle Spaces warm with
+    cheap probes (GET /config), so cold starts happen off the customer path. Probing is
+    frequent during busy hours, backs off when the site is idle, and skips Spaces that
+    real traffic has touched recently.
+    """
+
+    def __init__(self, sources: List[str], hf_token: str = ""):
+        self.spaces = {src: SpaceHealth(src) for src in sources}
+        self.sources = list(sources)
+        self.hf_token = hf_token
+        self.last_traffic = 0.0
+        self._lock = threading.Lock()
+        self._prober: Optional[threading.Thread] = None
+        metrics.register_gauge("verse_space_up", lambda: {(("space", h.src),): int(h.up)
+                                                          for h in self.spaces.values()},
+                               "1 if the Space is taking try-ons")
+        metrics.register_gauge("verse_space_inflight", lambda: {(("space", h.src),): h.inflight
+                                                                for h in self.spaces.values()},
+                               "Try-ons in flight per Space")
+        metrics.register_gauge("verse_space_latency_seconds", self._latency_gauge,
+                               "EWMA latency per Space of try-on calls and keep-alive probes")
+
+    def _latency_gauge(self) -> Dict:
+        values = {}
+        for h in self.spaces.values():
+            if h.call_seconds is not None:
+                values[(("source", "request"), ("space", h.src))] = h.call_seconds
+            if h.probe_seconds is not None:
+                values[(("source", "probe"), ("space", h.src))] = h.probe_seconds
+        return values
+
+    def choose(self) -> SpaceHealth:
+        """The up Space with the lowest expected wait (any Space, if all are down)."""
+        with self._lock:
+            candidates = [h for h in self.spaces.values() if h.up] or list(self.spaces.values())
+            return min(candidates, key=lambda h: h.score())
+
+    @contextmanager
+    def use(self, space: Optional[SpaceHealth] = None):
+        """Hold a Space for one try-on call; the outcome and latency feed its health."""
+        space = space or self.choose()
+        now = time.time()
+        with self._lock:
+            space.inflight += 1
+            space.last_used = now
+            self.last_traffic = now
+        start = time.perf_counter()
+        # Cancelled calls (the client went away) say nothing about the Space's health
+        try:
+            yield space
+        except JobCancelled:
+            raise
+        except Exception:
+            self.record(space, False, time.perf_counter() - start, "request")
+            raise
+        else:
+            self.record(space, True, time.perf_counter() - start, "request")
+        finally:
+            with self._lock:
+                space.inflight -= 1
+
+    def record(self, space: SpaceHealth, ok: bool, seconds: float, source: str) -> None:
+        with self._lock:
+            space.history.append((time.time(), source, ok, round(seconds, 3)))
+            if ok:
+                attr = "call_seconds" if source == "request" else "probe_seconds"
+                previous = getattr(space, attr)
+                setattr(space, attr, seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous))
+                if not space.up:
+                    print(f"✅ Space {space.src} is back up")
+                space.up = True
+                space.consecutive_failures = 0
+            else:
+                space.consecutive_failures += 1
+                if space.up and (source == "probe" or space.consecutive_failures >= FAILURES_TO_MARK_DOWN):
+                    print(f"⚠️  Space {space.src} marked down after {space.consecutive_failures} failure(s)")
+                    space.up = False
+        metrics.observe(PROBE_METRIC if source == "probe" else CALL_METRIC, seconds, space=space.src,
+                        ok=str(ok).lower())
+
+    def recent_p95(self, window: float = 300.0) -> Optional[float]:
+        """p95 latency of try-on calls across all Spaces in the last `window` seconds (None without calls)."""
+        cutoff = time.time() - window
+        with self._lock:
+            samples = sorted(seconds for h in self.spaces.values() for ts, source, ok, seconds in h.history
+                             if source == "request" and ok and ts >= cutoff)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def probe_interval(self, now: Optional[float] = None) -> float:
+        """Minimum interval during busy hours, then a quarter of the idle time, up to the maximum."""
+        idle = (now or time.time()) - self.last_traffic
+        if idle < SPACE_TRAFFIC_WINDOW:
+            return SPACE_PROBE_MIN_INTERVAL
+        return min(SPACE_PROBE_MAX_INTERVAL, max(SPACE_PROBE_MIN_INTERVAL, idle / 4))
+
+    def probe(self, space: SpaceHealth, http: httpx.Client) -> bool:
+        """One keep-alive request; waking a sleeping Space is the point, so it may be slow."""
+        space.last_probe = time.time()
+        start = time.perf_counter()
+        try:
+            ok = http.get(f"{space.root}/config").status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        self.record(space, ok, time.perf_counter() - start, "probe")
+        return ok
+
+    def due(self, space: SpaceHealth, now: float) -> bool:
+        # Down Spaces are re-checked at the minimum interval so they rejoin quickly
+        interval = SPACE_PROBE_MIN_INTERVAL if not space.up else self.probe_interval(now)
+        if space.up and now - space.last_used < interval:
+            return False  # real traffic already keeps it warm and measured
+        return now - space.last_probe >= interval
+
+    def start_prober(self) -> None:
+        """Probe Spaces in the background (once per process)."""
+        with self._lock:
+            if self._prober is not None or SPACE_PROBE_MIN_INTERVAL <= 0:
+                return
+            self._prober = threading.Thread(target=self._probe_forever, name="space-prober", daemon=True)
+        self._prober.start()
+
+    def _probe_forever(self) -> None:
+        headers = {"Authorization": f"Bearer {self.hf_token}"} if self.hf_token else {}
+        with httpx.Client(headers=headers, follow_redirects=True, timeout=SPACE_PROBE_TIMEOUT) as http:
+            while True:
+                now = time.time()
+                for space in list(self.spaces.values()):
+                    if self.due(space, now):
+                        try:
+                            self.probe(space, http)
+                        except Exception as e:
+                            print(f"⚠️  Probe of {space.src} failed: {e}")
+                time.sleep(min(15.0, SPACE_PROBE_MIN_INTERVAL / 4))
+
+    def stats(self, history: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            spaces = []
+            for h in self.spaces.values():
+                summary = h.summary()
+                if history:
+                    summary["history"] = [{"ts": ts, "source": source, "ok": ok, "seconds": seconds}
+                                          for ts, source, ok, seconds in h.history]
+                spaces.append(summary)
+        return {"probe_interval": self.probe_interval(), "last_traffic": self.last_traffic or None,
+                "spaces": spaces}
+
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, Callable, NamedTuple
+
+import image_ingest
+import metrics
+from image_utils import PersonCrop, locate_and_crop_person, render_overlay_preview
+from space_jobs import SpaceJob
+
+# Start a try-on's work when a person photo and garment are both chosen, before "Try On Now"
+SPECULATE = os.getenv("TRYON_SPECULATE", "false").lower() == "true"
+# Budgets: threads preparing inputs (probe, crop, preview), and speculative Space jobs in flight
+SPECULATIVE_PREPARES = int(os.getenv("TRYON_SPECULATIVE_PREPARES", "2"))
+SPECULATIVE_PREDICTS = int(os.getenv("TRYON_SPECULATIVE_PREDICTS", "1"))
+# Speculative Space jobs only start while at most this many clicked try-ons are running, and are
+# cancelled as soon as more are: speculation never takes the Space from a committed request
+SPECULATIVE_MAX_COMMITTED = int(os.getenv("TRYON_SPECULATIVE_MAX_COMMITTED", "0"))
+# A speculation nobody clicked for is dropped (and its Space job cancelled) after this long
+SPECULATION_TTL = float(os.getenv("TRYON_SPECULATION_TTL", "120"))
+SPECULATION_METRIC = "verse_tryon_speculation_total"
+
+
+class Inputs(NamedTuple):
+    person: str
+    garment: str
+    description: str
+    tier: str
+
+
+class Prepared(NamedTuple):
+    crop: PersonCrop
+    preview: Optional[bytes]  # JPEG of the local overlay, None if previews are off or it failed
+
+
+class Speculation:
+    """One session's try-on started ahead of the click: prepared inputs, and maybe a Space job."""
+
+    def __init__(self, inputs: Inputs):
+        self.inputs = inputs
+        self.created = time.time()
+        self.prepared: Future = Future()
+        self.job: Optional[SpaceJob] = None
+        self.claimed = False
+        self.discarded = False
+
+    def expired(self, now: float) -> bool:
+        return now - self.created > SPECULATION_TTL
+
+    def usable_job(self) -> Optional[SpaceJob]:
+        """The speculative Space job, unless it already failed or was cancelled (then resubmit)."""
+        job = self.job
+        if job is None or job.job.cancelled():
+            return None
+        if job.job.done() and job.job.exception() is not None:
+            return None
+        return job
+
+
+class Speculator:
+    """
+    Speculative try-ons for the Gradio app. When a session has a person photo and a garment,
+    speculate() crops the person and draws the overlay preview in the background, then submits
+    the Space job if the speculative budget allows. claim() hands the work to the try-on the
+    user actually starts, if its inputs match; anything else is discarded, and unclaimed
+    speculative jobs are cancelled whenever a committed try-on needs the Space.
+    """
+
+    def __init__(self, submit: Callable[[PersonCrop, Inputs], SpaceJob], preview: bool = True):
+        self.submit = submit
+        self.preview = preview
+        self.committed_running = 0
+        self._sessions: Dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+        self._prepares = ThreadPoolExecutor(max_workers=SPECULATIVE_PREPARES, thread_name_prefix="speculate")
+        metrics.register_gauge("verse_tryon_speculative_jobs", self._jobs_gauge,
+                               "Speculative try-on Space jobs in flight")
+
+    def _jobs_gauge(self) -> Dict:
+        with self._lock:
+            return {(): self._jobs_in_flight()}
+
+    def _jobs_in_flight(self) -> int:
+        # Called with the lock held
+        return sum(1 for s in self._sessions.values() if s.job is not None and not s.job.job.done())
+
+    def speculate(self, session: str, inputs: Inputs) -> None:
+        """Start (or keep) the session's speculation for these inputs; replaces one for other inputs."""
+        if not SPECULATE or not session:
+            return
+        with self._lock:
+            self._expire(time.time())
+            current = self._sessions.get(session)
+            if current is not None and current.inputs == inputs:
+                return
+            if current is not None:
+                self._discard(current, "replaced")
+            speculation = Speculation(inputs)
+            self._sessions[session] = speculation
+        self._prepares.submit(self._prepare, speculation)
+
+    def _prepare(self, speculation: Speculation) -> None:
+        try:
+            if speculation.discarded:
+                speculation.prepared.cancel()
+                return
+            image_ingest.probe(speculation.inputs.person)
+            image_ingest.probe(speculation.inputs.garment)
+            with metrics.span("speculation.prepare"):
+                crop = locate_and_crop_person(speculation.inputs.person)
+                preview = (render_overlay_preview(crop.path, speculation.inputs.garment, crop.torso)
+                           if self.preview else None)
+            speculation.prepared.set_result(Prepared(crop, preview))
+        except Exception as e:
+            # The click runs the same steps again and reports the error properly
+            speculation.prepared.set_exception(e)
+            return
+        with self._lock:
+            if speculation.discarded or speculation.claimed or not self._can_predict():
+                return
+            try:
+                speculation.job = self.submit(crop, speculation.inputs)
+            except Exception as e:
+                print(f"⚠️  Speculative try-on could not be submitted: {e}")
+                return
+        metrics.inc(SPECULATION_METRIC, result="submitted")
+
+    def _can_predict(self) -> bool:
+        # Called with the lock held
+        return (self.committed_running <= SPECULATIVE_MAX_COMMITTED
+                and self._jobs_in_flight() < SPECULATIVE_PREDICTS)
+
+    def claim(self, session: str, inputs: Inputs) -> Optional[Speculation]:
+        """The session's speculation if it was for exactly these inputs (it is then the caller's)."""
+        if not SPECULATE or not session:
+            return None
+        with self._lock:
+            speculation = self._sessions.pop(session, None)
+            if speculation is None:
+                metrics.inc(SPECULATION_METRIC, result="miss")
+                return None
+            if speculation.inputs != inputs or speculation.expired(time.time()):
+                self._discard(speculation, "mismatched")
+                return None
+            speculation.claimed = True
+        metrics.inc(SPECULATION_METRIC, result="hit" if speculation.job is not None else "prepared")
+        return speculation
+
+    @contextmanager
+    def committed(self):
+        """Hold while a clicked try-on runs; speculative jobs beyond the budget give way to it."""
+        with self._lock:
+            self.committed_running += 1
+            self._expire(time.time())
+            if self.committed_running > SPECULATIVE_MAX_COMMITTED:
+                for speculation in self._sessions.values():
+                    if speculation.job is not None and not speculation.job.job.done():
+                        speculation.job.cancel("preempted")
+                        speculation.job = None
+                        metrics.inc(SPECULATION_METRIC, result="preempted")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.committed_running -= 1
+
+    def _expire(self, now: float) -> None:
+        # Called with the lock held
+        for session, speculation in list(self._sessions.items()):
+            if speculation.expired(now):
+                del self._sessions[session]
+                self._discard(speculation, "expired")
+
+    def _discard(self, speculation: Speculation, reason: str) -> None:
+        speculation.discarded = True
+        if speculation.job is not None and not speculation.job.job.done():
+            speculation.job.cancel("speculation_" + reason)
+        metrics.inc(SPECULATION_METRIC, result=reason)
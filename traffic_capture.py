@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Optional, Dict, Any, List
+
+from PIL import Image
+
+import metrics
+from jsonl_log import JsonlLog
+
+# Opt-in: record the shape of every request to a rotating JSONL file (replay with bench/replay.py)
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "false").lower() in ("1", "true", "yes")
+TRAFFIC_CAPTURE_LOG = os.getenv("TRAFFIC_CAPTURE_LOG", os.path.join("logs", "traffic.jsonl"))
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+
+# Never captured: the capture itself would be noise (scrapes, profiles) or admin-only
+SKIP_ROUTES = {"/metrics", "/debug/profile"}
+SKIP_PREFIXES = ("/api/admin/",)
+
+# String values kept verbatim; every other string is replaced by its length
+SAFE_STRING_KEYS = {
+    "currency", "bodyType", "fitPreference", "generate_video", "mode", "event", "status",
+    "id", "orderId", "order_id", "razorpay_order_id", "razorpay_payment_id", "entity", "method",
+}
+# Values dropped regardless of type (PII and secrets); replay regenerates them
+REDACTED_KEYS = {"phone", "contact", "email", "fullName", "name", "address", "pincode", "razorpay_signature"}
+# Request headers whose presence (not value) matters for replay
+TRACKED_HEADERS = ("Idempotency-Key", "X-Razorpay-Signature", "X-Razorpay-Event-Id")
+
+HASH_CHUNK = 1024 * 1024
+
+
+def sanitize(value: Any, key: Optional[str] = None) -> Any:
+    """
+    Strip PII from a request payload while keeping its shape: numbers, booleans and
+    whitelisted strings survive, other strings become {"$redacted": "str", "len": n}.
+    """
+    if key in REDACTED_KEYS and value is not None:
+        return {"$redacted": type(value).__name__, "len": len(str(value))}
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key) for v in value]
+    if isinstance(value, str) and key not in SAFE_STRING_KEYS:
+        return {"$redacted": "str", "len": len(value)}
+    return value
+
+
+def file_info(field: str, stream, content_type: Optional[str], filename: Optional[str]) -> Dict[str, Any]:
+    """Size, sha256 and pixel dimensions of an uploaded file, rewinding the stream afterwards."""
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+            size += len(chunk)
+        info = {"field": field, "content_type": content_type, "bytes": size, "sha256": digest.hexdigest(),
+                "ext": os.path.splitext(filename or "")[1].lower()}
+        stream.seek(0)
+        try:
+            # Only reads the header, not the pixels
+            with Image.open(stream) as img:
+                info["width"], info["height"] = img.size
+                info["format"] = img.format
+        except Exception:
+            pass
+        stream.seek(0)
+        return info
+    except (OSError, ValueError):
+        return {"field": field, "content_type": content_type, "bytes": size}
+
+
+def base_record(route: str, method: str, status: int, duration: float,
+                path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Fields common to every captured request; handlers add payload details. route is the URL
+    rule (e.g. /api/tryon/results/<result_key>) that reports group by, path the URL replayed.
+    """
+    return {
+        # Arrival time, so replay reproduces the original inter-arrival gaps
+        "ts": round(time.time() - duration, 4),
+        "route": route,
+        "path": path or route,
+        "method": method,
+        "status": status,
+        "duration_ms": round(duration * 1000, 2),
+        "stages": [{"stage": name, "ms": round(seconds * 1000, 2)} for name, seconds in metrics.request_stages()],
+    }
+
+
+class TrafficCapture:
+    """Writes one sanitized JSONL record per handled request when TRAFFIC_CAPTURE is on."""
+
+    def __init__(self, enabled: bool = TRAFFIC_CAPTURE, log_path: str = TRAFFIC_CAPTURE_LOG,
+                 sample_rate: float = TRAFFIC_CAPTURE_SAMPLE):
+        self.sample_rate = sample_rate
+        self.log = JsonlLog(log_path) if enabled else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.log is not None
+
+    def wants(self, route: str) -> bool:
+        """Whether a request to this route should be captured (enabled, not skipped, sampled in)."""
+        if not self.enabled or route in SKIP_ROUTES or route.startswith(SKIP_PREFIXES):
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def write(self, record: Dict[str, Any]) -> None:
+        try:
+            self.log.write(record)
+        except Exception as e:
+            print(f"⚠️  Traffic capture failed for {record.get('method')} {record.get('route')}: {e}")
+
+    def record(self, request, response, route: str, duration: float) -> None:
+        """Log the current Flask request; call from an after_request hook."""
+        if not self.wants(route):
+            return
+        try:
+            record = self._build(request, response, route, duration)
+        except Exception as e:
+            print(f"⚠️  Traffic capture failed for {request.method} {route}: {e}")
+            return
+        self.write(record)
+
+    def _build(self, request, response, route: str, duration: float) -> Dict[str, Any]:
+        record = base_record(route, request.method, response.status_code, duration, path=request.path)
+        record.update({
+            "request_bytes": request.content_length or 0,
+            "response_bytes": response.calculate_content_length(),
+            "content_type": request.mimetype,
+            "headers": [name for name in TRACKED_HEADERS if name in request.headers],
+        })
+        if request.args:
+            record["query"] = sanitize(request.args.to_dict())
+        if request.files:
+            record["files"] = [file_info(field, storage.stream, storage.mimetype, storage.filename)
+                               for field, storage in request.files.items(multi=True)]
+        if request.form:
+            record["form"] = sanitize(request.form.to_dict())
+        elif request.is_json:
+            body = request.get_data(cache=True)
+            record["body_sha256"] = hashlib.sha256(body).hexdigest()
+            payload = request.get_json(silent=True)
+            if payload is not None:
+                record["json"] = sanitize(payload)
+        return record
+
+
+def load_records(paths: List[str]) -> List[Dict[str, Any]]:
+    """Read captured records from one or more JSONL files (rotated backups included), oldest first."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r["ts"])
+    return records
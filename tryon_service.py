@@ -0,0 +1,122 @@
+import base64
+import json
+import os
+import uuid
+from typing import Optional, Dict, Any, Tuple, Iterable, List
+
+import image_output
+import metrics
+from image_utils import PersonCrop, create_video_from_image, render_overlay_preview
+
+OUTPUT_DIR = "outputs"
+
+# Fixed IDM-VTON parameters shared by the Flask and async try-on handlers
+TRYON_OPTIONS = {
+    "is_checked": True,
+    "is_checked_crop": True,  # Enable garment cropping for better fit
+    "denoise_steps": 40,  # Maximum allowed value for best quality
+    "seed": 42,
+}
+
+# Garments accepted by one /api/tryon/batch request, and how many of its Space calls run at once
+MAX_BATCH_GARMENTS = int(os.getenv("TRYON_BATCH_MAX_GARMENTS", "6"))
+BATCH_CONCURRENCY = int(os.getenv("TRYON_BATCH_CONCURRENCY", "3"))
+# Idle gap after which a try-on stream writes a blank line: writing is how a client that went away is noticed
+STREAM_KEEPALIVE_SECONDS = 1.0
+# Streamed try-ons send a rough local overlay (a 'preview' line) before the Space call
+LOCAL_PREVIEW = os.getenv("TRYON_LOCAL_PREVIEW", "true").lower() == "true"
+
+def upload_paths() -> Tuple[str, str]:
+    """Temporary person/garment paths, unique per request (concurrent requests share the process)."""
+    request_id = uuid.uuid4().hex
+    return (os.path.join(OUTPUT_DIR, f'person_{request_id}.jpg'),
+            os.path.join(OUTPUT_DIR, f'garment_{request_id}.jpg'))
+
+def batch_upload_paths(garments: int) -> Tuple[str, List[str]]:
+    """Temporary paths for one person photo and several garments."""
+    request_id = uuid.uuid4().hex
+    return (os.path.join(OUTPUT_DIR, f'person_{request_id}.jpg'),
+            [os.path.join(OUTPUT_DIR, f'garment_{request_id}_{i}.jpg') for i in range(garments)])
+
+def stream_line(payload: Dict[str, Any]) -> bytes:
+    """One NDJSON line of a streamed try-on response (stream=true or /api/tryon/batch)."""
+    return (json.dumps(payload) + "\n").encode()
+
+def preview_line(crop: PersonCrop, garment_path: str) -> Optional[Dict[str, Any]]:
+    """The 'preview' stream line for a cropped person, or None if previews are off or it couldn't be drawn."""
+    if not LOCAL_PREVIEW:
+        return None
+    with metrics.span("tryon.local_preview"):
+        preview = render_overlay_preview(crop.path, garment_path, crop.torso)
+    if preview is None:
+        return None
+    return {'type': 'preview', 'image': f"data:image/jpeg;base64,{base64.b64encode(preview).decode('utf-8')}"}
+
+def stream_error(error_msg: str, status: Optional[int] = None) -> Dict[str, Any]:
+    """Stream line for a failed try-on, using the same messages as the JSON responses."""
+    body, mapped_status = space_error_response(error_msg) or ({'error': error_msg}, 502)
+    return {'type': 'error', 'status': status or mapped_status, **body}
+
+def batch_error(index: int, error_msg: str, status: Optional[int] = None) -> Dict[str, Any]:
+    """Stream line for a garment of a batch that failed."""
+    return {'type': 'error', 'index': index, **stream_error(error_msg, status)}
+
+def space_error_response(error_msg: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Map a Space failure to a (JSON body, status) for the client, or None if it isn't a known one."""
+    lowered = error_msg.lower()
+    # Check if it's a timeout error
+    if "timeout" in lowered or "timed out" in lowered:
+        return {
+            'error': 'The AI model is taking longer than expected to respond.',
+            'details': 'The Hugging Face API is experiencing slow response times. This usually happens when the model is cold-starting or under heavy load.',
+            'suggestion': 'Please try again in a few moments. The model should be faster on subsequent requests.',
+            'tip': 'Adding a Hugging Face token may provide better reliability and priority access.'
+        }, 504
+    # Check if it's a quota/authentication error
+    if "quota" in lowered or "rate limit" in lowered:
+        return {
+            'error': 'API quota limit reached. Please add a Hugging Face token to your .env file.',
+            'details': 'Get a free token at https://huggingface.co/settings/tokens',
+            'instructions': 'Add HF_TOKEN=your_token to .env file and restart the server'
+        }, 429
+    if "upstream" in lowered:
+        return {
+            'error': 'The AI model is currently unavailable or overloaded. Please try again in a few moments.',
+            'details': error_msg,
+            'suggestion': 'Consider adding a Hugging Face token for better reliability'
+        }, 503
+    return None
+
+def build_response(result_image_path: str, generate_video: bool,
+                   image_format: str = image_output.DEFAULT_FORMAT) -> Dict[str, Any]:
+    """Encode the try-on result (see image_output.negotiate) and optional video into the API response body."""
+    image_bytes, mime_type = image_output.encode(result_image_path, image_format)
+    with metrics.span("tryon.encode_base64"):
+        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+
+    response_data = {
+        'image': f'data:{mime_type};base64,{image_base64}',
+        'status': 'success'
+    }
+
+    # Generate video if requested
+    if generate_video:
+        with metrics.span("tryon.create_video_from_image"):
+            video_path = create_video_from_image(result_image_path, duration=4)
+        if video_path:
+            with metrics.span("tryon.encode_video_base64"):
+                with open(video_path, 'rb') as f:
+                    video_base64 = base64.b64encode(f.read()).decode('utf-8')
+            response_data['video'] = f'data:video/mp4;base64,{video_base64}'
+
+    return response_data
+
+def remove_files(paths: Iterable[Optional[str]]) -> None:
+    """Best-effort cleanup of per-request temporary files."""
+    for path in set(paths):
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
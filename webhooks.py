@@ -0,0 +1,149 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Optional, Dict, Any
+
+import order_store
+
+# Secret configured on the Razorpay dashboard for this webhook URL
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+
+# Queued events are applied to orders in batches by a background worker
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "0.5"))
+
+order_store.register_schema("""
+CREATE TABLE IF NOT EXISTS webhook_events (
+    event_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    processed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+    ON webhook_events(received_at) WHERE processed_at IS NULL;
+""")
+
+# Order status each event moves to, and the statuses it is allowed to move from.
+# A late payment.failed (an earlier attempt) must never downgrade a paid order.
+EVENT_TRANSITIONS = {
+    "payment.authorized": ("authorized", ("created",)),
+    "payment.captured": ("paid", ("created", "authorized", "failed")),
+    "order.paid": ("paid", ("created", "authorized", "failed")),
+    "payment.failed": ("failed", ("created", "authorized")),
+    "refund.processed": ("refunded", ("paid",)),
+}
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def verify_signature(body: bytes, signature: str, secret: Optional[str] = None) -> bool:
+    """Check X-Razorpay-Signature (HMAC-SHA256 of the raw body) in constant time."""
+    secret = secret if secret is not None else RAZORPAY_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def enqueue_event(body: bytes, event_id: Optional[str] = None) -> bool:
+    """
+    Durably queue a verified webhook body. Returns False for a duplicate delivery.
+    Parsing and order updates happen later in the worker, off the request path.
+    """
+    event_id = event_id or hashlib.sha256(body).hexdigest()
+    cur = order_store.get_connection().execute(
+        "INSERT OR IGNORE INTO webhook_events (event_id, payload, received_at) VALUES (?, ?, ?)",
+        (event_id, body.decode("utf-8", errors="replace"), time.time())
+    )
+    _wakeup.set()
+    return cur.rowcount > 0
+
+
+def _order_update(event: Dict[str, Any]) -> Optional[tuple]:
+    """Turn one Razorpay event into (status, allowed_from, order_id, payment_id)."""
+    transition = EVENT_TRANSITIONS.get(event.get("event"))
+    if not transition:
+        return None
+
+    payload = event.get("payload", {})
+    payment = payload.get("payment", {}).get("entity", {})
+    order = payload.get("order", {}).get("entity", {})
+    order_id = payment.get("order_id") or order.get("id")
+    if not order_id:
+        return None
+
+    status, allowed_from = transition
+    return status, allowed_from, order_id, payment.get("id")
+
+
+def process_pending(batch_size: int = WEBHOOK_BATCH_SIZE) -> int:
+    """Apply one batch of queued events to orders. Returns the number of events consumed."""
+    conn = order_store.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT event_id, payload FROM webhook_events WHERE processed_at IS NULL "
+            "ORDER BY received_at LIMIT ?", (batch_size,)
+        ).fetchall()
+        if not rows:
+            conn.execute("COMMIT")
+            return 0
+
+        now = time.time()
+        for row in rows:
+            try:
+                update = _order_update(json.loads(row["payload"]))
+            except Exception as e:
+                # Not valid JSON, or not shaped like a Razorpay event: still marked processed below,
+                # or this batch would be retried (and every later payment held up) forever
+                print(f"⚠️  Skipping malformed webhook event {row['event_id']}: {type(e).__name__}: {e}")
+                continue
+            if update is None:
+                continue
+            status, allowed_from, order_id, payment_id = update
+            placeholders = ",".join("?" * len(allowed_from))
+            conn.execute(
+                f"UPDATE orders SET status = ?, payment_id = COALESCE(?, payment_id), updated_at = ? "
+                f"WHERE order_id = ? AND status IN ({placeholders})",
+                (status, payment_id, now, order_id, *allowed_from)
+            )
+
+        conn.executemany(
+            "UPDATE webhook_events SET processed_at = ? WHERE event_id = ?",
+            [(now, row["event_id"]) for row in rows]
+        )
+        conn.execute("COMMIT")
+        return len(rows)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _run_worker():
+    while True:
+        _wakeup.wait(WEBHOOK_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            # Drain the backlog (including events left over from a restart)
+            while process_pending() == WEBHOOK_BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"❌ Error applying webhook events: {e}")
+            import traceback
+            traceback.print_exc()
+            time.sleep(WEBHOOK_FLUSH_INTERVAL)
+
+
+def start_worker() -> None:
+    """Start the background thread that applies queued events (once per process)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name="razorpay-webhooks", daemon=True)
+            _worker.start()
+
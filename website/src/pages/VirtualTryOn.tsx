@@ -1,8 +1,9 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Upload, Sparkles, Video, Image as ImageIcon, Check, AlertCircle, Loader2 } from 'lucide-react';
 import Navigation from '../components/Navigation';
 import Footer from '../components/Footer';
 import { fetchProducts } from '../lib/shopify';
+import { getCartItemCount } from '../lib/cart';
 import type { ShopifyProduct } from '../lib/shopify';
 
 const VirtualTryOn = () => {
@@ -14,12 +15,18 @@ const VirtualTryOn = () => {
     const [customGarmentPreview, setCustomGarmentPreview] = useState<string>('');
     const [resultImage, setResultImage] = useState<string>('');
     const [resultVideo, setResultVideo] = useState<string>('');
+    // The result slot shows the backend's rough local overlay until the real render replaces it
+    const [isRoughPreview, setIsRoughPreview] = useState(false);
     const [isProcessing, setIsProcessing] = useState(false);
     const [status, setStatus] = useState('Ready to try on...');
     const [statusType, setStatusType] = useState<'idle' | 'processing' | 'success' | 'error'>('idle');
     const [generateVideo, setGenerateVideo] = useState(false);
     const [useCustomGarment, setUseCustomGarment] = useState(false);
     const [currentStep, setCurrentStep] = useState(1);
+    // Aborting the request makes the backend cancel the Space job instead of finishing it for nobody
+    const tryOnRequest = useRef<AbortController | null>(null);
+    // Polls for the full-quality version of a preview the backend is re-rendering in the background
+    const upgradeRequest = useRef<AbortController | null>(null);
 
     useEffect(() => {
         const loadProducts = async () => {
@@ -33,6 +40,11 @@ const VirtualTryOn = () => {
         loadProducts();
     }, []);
 
+    useEffect(() => () => {
+        tryOnRequest.current?.abort();
+        upgradeRequest.current?.abort();
+    }, []);
+
     const handlePersonImageChange = (e: React.ChangeEvent<HTMLInputElement>) => {
         const file = e.target.files?.[0];
         if (file) {
@@ -78,10 +90,16 @@ const VirtualTryOn = () => {
             return;
         }
 
+        tryOnRequest.current?.abort();
+        upgradeRequest.current?.abort();
+        const controller = new AbortController();
+        tryOnRequest.current = controller;
+
         setIsProcessing(true);
         setStatus('Processing your virtual try-on...');
         setStatusType('processing');
         setResultImage('');
+        setIsRoughPreview(false);
         setResultVideo('');
 
         try {
@@ -99,13 +117,22 @@ const VirtualTryOn = () => {
             }
 
             formData.append('generate_video', generateVideo.toString());
+            // Progress comes back as NDJSON status lines, then the result
+            formData.append('stream', 'true');
 
             // Use environment variable for backend URL, fallback to localhost for development
             const BACKEND_URL = import.meta.env.VITE_BACKEND_URL || 'http://localhost:7860';
 
             const apiResponse = await fetch(`${BACKEND_URL}/api/tryon`, {
                 method: 'POST',
+                // Shoppers with a cart get a larger share of the try-on queue
+                headers: {
+                    // The result comes back as WebP instead of a multi-MB PNG
+                    'Accept': 'application/json, image/webp, image/jpeg;q=0.8',
+                    'X-Verse-Cart-Items': String(getCartItemCount()),
+                },
                 body: formData,
+                signal: controller.signal,
             });
 
             if (!apiResponse.ok) {
@@ -123,7 +150,15 @@ const VirtualTryOn = () => {
                 return;
             }
 
-            const result = await apiResponse.json();
+            const result = await readTryOnStream(apiResponse);
+            setIsRoughPreview(false);
+            if (result.type === 'error') {
+                setResultImage('');
+                const details = result.details || result.suggestion || result.tip || '';
+                setStatus(`${result.error}${details ? ' ' + details : ''}`);
+                setStatusType('error');
+                return;
+            }
 
             if (result.image) {
                 setResultImage(result.image);
@@ -133,14 +168,109 @@ const VirtualTryOn = () => {
                 setResultVideo(result.video);
             }
 
-            setStatus('Try-on complete! Looking amazing! ✨');
+            if (result.upgrade?.url) {
+                // The backend was busy and sent a quicker preview; full quality follows when it's rendered
+                pollUpgrade(`${BACKEND_URL}${result.upgrade.url}`);
+                setStatus('Here is a quick preview. Full quality is on its way... ✨');
+            } else {
+                setStatus('Try-on complete! Looking amazing! ✨');
+            }
             setStatusType('success');
         } catch (error) {
+            if (controller.signal.aborted) {
+                if (tryOnRequest.current === controller) {
+                    setIsRoughPreview(false);
+                    setResultImage('');
+                    setStatus('Try-on cancelled');
+                    setStatusType('idle');
+                }
+                return;
+            }
             console.error('Error during try-on:', error);
             setStatus('Error: Unable to connect to the backend. Make sure the Python server is running on port 7860.');
             setStatusType('error');
         } finally {
-            setIsProcessing(false);
+            if (tryOnRequest.current === controller) {
+                tryOnRequest.current = null;
+                setIsProcessing(false);
+            }
+        }
+    };
+
+    const cancelTryOn = () => tryOnRequest.current?.abort();
+
+    const pollUpgrade = async (url: string) => {
+        const controller = new AbortController();
+        upgradeRequest.current = controller;
+        try {
+            for (let attempt = 0; attempt < 60; attempt++) {
+                await new Promise((resolve) => setTimeout(resolve, 5000));
+                if (controller.signal.aborted) return;
+                const response = await fetch(url, {
+                    headers: { 'Accept': 'image/webp, image/jpeg;q=0.8' },
+                    signal: controller.signal,
+                });
+                if (response.status === 202) continue; // still rendering
+                if (!response.ok) return; // no spare capacity after all: keep the preview
+                const blob = await response.blob();
+                setResultImage(URL.createObjectURL(blob));
+                setStatus('Try-on complete in full quality! Looking amazing! ✨');
+                return;
+            }
+        } catch (error) {
+            if (!controller.signal.aborted) console.error('Error fetching full-quality result:', error);
+        }
+    };
+
+    // Reads the NDJSON try-on stream, showing status lines as they arrive; returns the result or error line
+    const readTryOnStream = async (response: Response) => {
+        const reader = response.body!.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() ?? '';
+            for (const line of lines) {
+                if (!line.trim()) continue; // keepalive
+                const message = JSON.parse(line);
+                if (message.type === 'preview') {
+                    // Rough overlay drawn locally in well under a second, shown while the real one renders
+                    setResultImage(message.image);
+                    setIsRoughPreview(true);
+                    continue;
+                }
+                if (message.type !== 'status') return message;
+                // The backend's ETA is learned from recent try-ons; showing it keeps people from resubmitting
+                setStatus(message.eta ? `${describeStage(message)} (about ${formatEta(message.eta)} left)` : describeStage(message));
+            }
+        }
+        throw new Error('Try-on stream ended without a result');
+    };
+
+    const formatEta = (seconds: number) =>
+        seconds >= 90 ? `${Math.round(seconds / 60)} min` : `${Math.round(seconds)}s`;
+
+    const describeStage = (update: { stage: string; queue_position?: number; queue_size?: number; progress?: number }) => {
+        switch (update.stage) {
+            case 'preparing':
+                return 'Finding you in the photo...';
+            case 'submitting':
+                return 'Sending your photos to the try-on model...';
+            case 'queued':
+                return update.queue_position
+                    ? `Waiting in line: #${update.queue_position}${update.queue_size ? ` of ${update.queue_size}` : ''}`
+                    : 'Waiting in line...';
+            case 'processing':
+                return update.progress !== undefined
+                    ? `Dressing you up... ${Math.round(update.progress * 100)}%`
+                    : 'Dressing you up...';
+            case 'encoding':
+                return 'Almost there...';
+            default:
+                return 'Processing your virtual try-on...';
         }
     };
 
@@ -386,6 +516,14 @@ const VirtualTryOn = () => {
                                     </>
                                 )}
                             </button>
+                            {isProcessing && (
+                                <button
+                                    onClick={cancelTryOn}
+                                    className="w-full py-3 px-8 rounded-2xl font-semibold text-gray-600 border border-gray-300 hover:bg-gray-50 transition-all duration-300"
+                                >
+                                    Cancel
+                                </button>
+                            )}
                         </div>
 
                         {/* Right Panel - Results */}
@@ -407,14 +545,22 @@ const VirtualTryOn = () => {
                                 {/* Result Image */}
                                 {resultImage && (
                                     <div className="mb-6 animate-scaleIn">
-                                        <h3 className="font-bold text-lg mb-3 text-gray-900">Virtual Try-On Result</h3>
+                                        <h3 className="font-bold text-lg mb-3 text-gray-900">
+                                            {isRoughPreview ? 'Quick Preview' : 'Virtual Try-On Result'}
+                                        </h3>
                                         <div className="relative rounded-2xl overflow-hidden shadow-2xl border-2 border-peach-200">
                                             <img
                                                 src={resultImage}
-                                                alt="Try-on result"
-                                                className="w-full"
+                                                alt={isRoughPreview ? 'Rough try-on preview' : 'Try-on result'}
+                                                className={`w-full transition-opacity duration-300 ${isRoughPreview ? 'opacity-80' : ''}`}
                                             />
                                             <div className="absolute inset-0 bg-gradient-to-t from-peach-900/20 to-transparent pointer-events-none"></div>
+                                            {isRoughPreview && (
+                                                <div className="absolute bottom-3 left-3 right-3 flex items-center gap-2 rounded-xl bg-white/90 px-3 py-2 text-sm font-semibold text-peach-700">
+                                                    <Loader2 className="h-4 w-4 animate-spin" />
+                                                    Rough preview - the full try-on is on its way
+                                                </div>
+                                            )}
                                         </div>
                                     </div>
                                 )}